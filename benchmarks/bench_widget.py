@@ -0,0 +1,181 @@
+# Бенчмарк отрисовки и обновления виджета на синтетических портфелях.
+#
+# Сеть не используется: загрузка цен подменяется генератором случайных цен.
+# Нужен дисплей (на сервере/в CI запускать через Xvfb):
+#
+#     xvfb-run -a python benchmarks/bench_widget.py
+#     xvfb-run -a python benchmarks/bench_widget.py --sizes 10 100 --repeat 5 --json bench.json
+#     xvfb-run -a python benchmarks/bench_widget.py --renderer canvas
+#
+# Для каждого размера портфеля измеряются: создание окна, полное обновление,
+# клик по сортировке, прокрутка таблицы на страницу, смена темы и показ окна уведомления, а также число
+# Tk-виджетов и пиковая память (tracemalloc).
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_core
+import crypto_widget
+
+
+def make_config(coin_count, renderer):
+    """Синтетический конфиг с coin_count монетами (уведомления отключены, чтобы не мешать замерам)."""
+    config = crypto_core.load_config(os.path.join(tempfile.gettempdir(), 'missing-config.json'))
+    config['coins'] = {
+        f"coin-{i:04d}": {"name": f"C{i:04d}", "amount": round(random.uniform(0, 1000), 4)}
+        for i in range(coin_count)
+    }
+    config['notification_mode'] = 'disabled'
+    config['table_renderer'] = renderer
+    config['autostart_enabled'] = False
+    config['window_x'] = 0
+    config['window_y'] = 0
+    return config
+
+
+class SyntheticMarket:
+    """Генератор цен: случайное блуждание по каждой монете."""
+    def __init__(self, coin_ids, currency):
+        self.currency = currency
+        self.prices = {api_id: random.uniform(0.001, 50000) for api_id in coin_ids}
+
+    def tick(self):
+        data = {}
+        for api_id, price in self.prices.items():
+            price *= 1 + random.gauss(0, 0.01)
+            self.prices[api_id] = price
+            data[api_id] = {
+                self.currency: price,
+                "change_24h": random.uniform(-10, 10),
+                "market_cap": None,
+                "volume": None
+            }
+        return data
+
+
+def count_widgets(widget):
+    """Число Tk-виджетов в дереве (включая сам widget)."""
+    return 1 + sum(count_widgets(child) for child in widget.winfo_children())
+
+
+def timed(func, repeat):
+    """Медиана времени выполнения func() в миллисекундах."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def bench_size(coin_count, repeat, workdir, renderer):
+    config = make_config(coin_count, renderer)
+    crypto_core.CONFIG_FILE = os.path.join(workdir, f'config-{coin_count}.json')
+    crypto_core.HISTORY_DB_FILE = os.path.join(workdir, f'history-{coin_count}.db')
+    crypto_core.MARKET_SNAPSHOT_FILE = os.path.join(workdir, f'snapshot-{coin_count}.json')
+    crypto_core.save_config(config)
+
+    market = SyntheticMarket(crypto_core.get_api_coin_ids(config), crypto_core.PIVOT_CURRENCY)
+    # Фоновый поток не должен ходить в сеть
+    crypto_core.fetch_prices = lambda coin_ids, currency: (market.tick(), crypto_core.FETCH_OK, None)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    app = crypto_widget.CryptoWidget()
+    app.update_idletasks()
+    results = {'coins': coin_count, 'startup_ms': (time.perf_counter() - started) * 1000}
+
+    def refresh():
+        app.update_widget(recalculate_order=True, data=market.tick())
+        app.update_idletasks()
+
+    def sort_click():
+        app.sort_by_column('price')
+        app.update_idletasks()
+
+    def scroll_page():
+        # Вниз на страницу, а у конца списка — обратно в начало
+        offset = app.scroll_offset + len(app.row_slots)
+        app.scroll_table_to(offset if offset < len(app.row_views) else 0)
+        app.update_idletasks()
+
+    def theme_switch():
+        app.config['theme'] = 'light' if app.config.get('theme') == 'dark' else 'dark'
+        app.apply_theme()
+        app.update_idletasks()
+
+    signals = [
+        {
+            'api_id': api_id,
+            'coin_name': coin['name'],
+            'trend_type': random.choice(["BULLISH", "BEARISH"]),
+            'series_length': random.randint(1, app.trend_engine.history_size),
+            'change_percent': random.uniform(-5, 5)
+        }
+        for api_id, coin in config['coins'].items()
+    ]
+
+    def notification_popup():
+        # Окно уведомлений одно на все время работы: показ, слияние сигналов и скрытие
+        if app.notification_window is None:
+            app.notification_window = crypto_widget.NotificationWindow(app)
+        app.notification_window.show_signals(signals, 10)
+        app.notification_window.update_idletasks()
+        app.notification_window.hide()
+
+    refresh() # Первое обновление создает строки таблицы
+    results['refresh_ms'] = timed(refresh, repeat)
+    results['sort_ms'] = timed(sort_click, repeat)
+    results['scroll_ms'] = timed(scroll_page, repeat)
+    results['theme_ms'] = timed(theme_switch, repeat)
+    results['notification_ms'] = timed(notification_popup, repeat)
+    results['widgets'] = count_widgets(app)
+
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results['peak_mem_mb'] = peak / (1024 * 1024)
+
+    app.destroy()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк отрисовки виджета на синтетических портфелях.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help="Размеры портфелей (число монет)")
+    parser.add_argument('--repeat', type=int, default=3, help="Сколько раз повторять каждый замер (берется медиана)")
+    parser.add_argument('--json', default=None, help="Сохранить результаты в JSON-файл")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--renderer', choices=['labels', 'canvas'], default='labels', help="Способ отрисовки таблицы")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    crypto_widget.setup_locale() # Как при обычном запуске окна
+    columns = ['coins', 'startup_ms', 'refresh_ms', 'sort_ms', 'scroll_ms', 'theme_ms', 'notification_ms', 'widgets', 'peak_mem_mb']
+    print(" | ".join(f"{name:>15}" for name in columns))
+
+    all_results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for coin_count in args.sizes:
+            results = bench_size(coin_count, args.repeat, workdir, args.renderer)
+            all_results.append(results)
+            print(" | ".join(
+                f"{results[name]:>15.1f}" if isinstance(results[name], float) else f"{results[name]:>15}"
+                for name in columns
+            ))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(all_results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+# Локальная замена CoinGecko API для тестов и нагрузочных проверок без интернета.
+#
+# Отдает /api/v3/coins/markets, /api/v3/simple/price, /api/v3/exchange_rates и /api/v3/coins/list по данным из файла-фикстуры
+# или по синтетическим ценам (случайное блуждание). Умеет имитировать задержку,
+# ошибки 429/5xx, обрезанные страницы и медленную отдачу тела ответа.
+# По адресу /prices?assets=bitcoin,ethereum работает поток цен по WebSocket в формате CoinCap.
+# Для проверки переключения источников те же цены отдаются в форматах CoinCap (/v2/assets)
+# и Binance (/api/v3/ticker/24hr).
+#
+# Запуск:
+#     python coingecko_stub_server.py --port 8787 --latency-ms 300 --rate-429 0.1
+# Виджет (или crypto_core.py --headless) направляется на сервер так:
+#     CRYPTO_WIDGET_API_URL=http://127.0.0.1:8787/api/v3 python crypto_widget.py
+# или ключом "api_base_url" в config.json. Поток цен:
+#     CRYPTO_WIDGET_STREAM_URL=ws://127.0.0.1:8787/prices python crypto_widget.py
+
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from crypto_core import BinanceClient
+
+
+# Курсы валют относительно USD для пересчета синтетических цен
+FX_RATES = {
+    'usd': 1.0,
+    'eur': 0.92,
+    'rub': 92.0,
+    'gbp': 0.79,
+    'btc': 1 / 60000.0
+}
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11" # Для ответа Sec-WebSocket-Accept (RFC 6455)
+
+
+class SyntheticMarket:
+    """
+    Цены монет в USD: из фикстуры ({api_id: цена}) или случайные для неизвестных ID.
+    При каждом обращении цена сдвигается случайным блужданием, пропорционально прошедшему времени.
+    """
+    def __init__(self, fixture=None, volatility=0.01, known_only=False, seed=None):
+        self.random = random.Random(seed)
+        self.volatility = volatility # Стандартное отклонение изменения за минуту
+        self.known_only = known_only
+        self.lock = threading.Lock()
+        self.prices = {}
+        self.open_prices = {} # Цена "24 часа назад" для price_change_percentage_24h
+        self.updated_at = {}
+        for api_id, price in (fixture or {}).items():
+            self.add_coin(api_id, float(price))
+
+    def add_coin(self, api_id, price):
+        self.prices[api_id] = price
+        self.open_prices[api_id] = price * (1 + self.random.uniform(-0.1, 0.1))
+        self.updated_at[api_id] = time.monotonic()
+
+    def get(self, api_id):
+        """Текущая цена монеты в USD и изменение за 24ч (или None, если монета неизвестна)."""
+        with self.lock:
+            if api_id not in self.prices:
+                if self.known_only:
+                    return None
+                # Стабильная "стартовая" цена для любого ID
+                self.add_coin(api_id, 10 ** (zlib.crc32(api_id.encode()) % 900 / 100 - 4))
+
+            now = time.monotonic()
+            minutes = (now - self.updated_at[api_id]) / 60
+            if minutes > 0:
+                step = self.random.gauss(0, self.volatility * math.sqrt(minutes))
+                self.prices[api_id] *= math.exp(step)
+                self.updated_at[api_id] = now
+
+            price = self.prices[api_id]
+            change_24h = (price / self.open_prices[api_id] - 1) * 100
+            return price, change_24h
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "CoinGeckoStub/1.0"
+
+    def log_message(self, format, *args):
+        if not self.server.options.quiet:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        options = self.server.options
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if self.headers.get('Upgrade', '').lower() == 'websocket' and url.path.rstrip('/').endswith('/prices'):
+            self.stream_prices(query)
+            return
+
+        # Задержка ответа
+        delay_ms = options.latency_ms + random.uniform(0, options.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+        # Имитация ограничений и сбоев
+        if random.random() < options.rate_429:
+            self.send_json({"status": {"error_code": 429, "error_message": "You've exceeded the Rate Limit."}}, status=429,
+                           headers={'Retry-After': str(options.retry_after)})
+            return
+        if random.random() < options.rate_5xx:
+            self.send_json({"error": "Internal stub error"}, status=random.choice([500, 502, 503]))
+            return
+
+        path = url.path.rstrip('/')
+        if path.endswith('/coins/markets'):
+            self.send_json(self.coins_markets(query))
+        elif path.endswith('/coins/list'):
+            self.send_json(self.coins_list())
+        elif path.endswith('/simple/price'):
+            self.send_json(self.simple_price(query))
+        elif path.endswith('/assets'):
+            self.send_json(self.coincap_assets(query))
+        elif path.endswith('/ticker/24hr'):
+            self.send_json(self.binance_ticker(query))
+        elif path.endswith('/exchange_rates'):
+            self.send_json(self.exchange_rates())
+        elif path.endswith('/ping'):
+            self.send_json({"gecko_says": "(V3) To the Moon!"})
+        else:
+            self.send_json({"error": "Not found"}, status=404)
+
+    def coins_markets(self, query):
+        options = self.server.options
+        currency = query.get('vs_currency', 'usd').lower()
+        rate = FX_RATES.get(currency, 1.0)
+        ids = [api_id for api_id in query.get('ids', '').split(',') if api_id]
+
+        per_page = min(int(query.get('per_page', 100)), 250)
+        page = max(1, int(query.get('page', 1)))
+        if options.max_per_page:
+            per_page = min(per_page, options.max_per_page) # "Обрезанные" страницы
+        ids = ids[(page - 1) * per_page:page * per_page]
+
+        result = []
+        for api_id in ids:
+            quote = self.server.market.get(api_id)
+            if quote is None:
+                continue
+            price, change_24h = quote
+            result.append({
+                "id": api_id,
+                "symbol": api_id[:4],
+                "name": api_id.replace('-', ' ').title(),
+                "current_price": price * rate,
+                "market_cap": price * rate * 1e7,
+                "total_volume": price * rate * 1e5,
+                "price_change_percentage_24h": change_24h
+            })
+        return result
+
+    def coins_list(self):
+        """Список монет как /coins/list: монеты фикстуры, известные тикеры Binance и синтетические stub-coin-N."""
+        coins = {api_id: symbol.lower() for api_id, symbol in BinanceClient.default_symbols.items()}
+        for api_id in list(self.server.market.prices):
+            coins.setdefault(api_id, api_id[:4])
+        for i in range(self.server.options.coin_list_size):
+            coins.setdefault(f"stub-coin-{i}", f"sc{i}")
+        return [
+            {"id": api_id, "symbol": symbol, "name": api_id.replace('-', ' ').title()}
+            for api_id, symbol in coins.items()
+        ]
+
+    def simple_price(self, query):
+        ids = [api_id for api_id in query.get('ids', '').split(',') if api_id]
+        currencies = [c for c in query.get('vs_currencies', 'usd').lower().split(',') if c]
+        include_change = query.get('include_24hr_change') == 'true'
+
+        result = {}
+        for api_id in ids:
+            quote = self.server.market.get(api_id)
+            if quote is None:
+                continue
+            price, change_24h = quote
+            item = {}
+            for currency in currencies:
+                item[currency] = price * FX_RATES.get(currency, 1.0)
+                if include_change:
+                    item[f"{currency}_24h_change"] = change_24h
+            result[api_id] = item
+        return result
+
+    def coincap_assets(self, query):
+        """Цены в формате CoinCap /v2/assets (ID монет — как у CoinGecko, числа — строками)."""
+        result = []
+        for api_id in [api_id for api_id in query.get('ids', '').split(',') if api_id]:
+            quote = self.server.market.get(api_id)
+            if quote is None:
+                continue
+            price, change_24h = quote
+            result.append({
+                "id": api_id,
+                "priceUsd": f"{price:.10g}",
+                "changePercent24Hr": f"{change_24h:.6f}",
+                "marketCapUsd": f"{price * 1e7:.2f}",
+                "volumeUsd24Hr": f"{price * 1e5:.2f}"
+            })
+        return {"data": result}
+
+    def binance_ticker(self, query):
+        """Цены в формате Binance /api/v3/ticker/24hr по парам к USDT (тикеры — из таблицы BinanceClient)."""
+        api_ids = {f"{symbol}USDT": api_id for api_id, symbol in BinanceClient.default_symbols.items()}
+        result = []
+        for pair in json.loads(query.get('symbols', '[]')):
+            quote = self.server.market.get(api_ids.get(pair, pair.lower()))
+            if quote is None:
+                continue
+            price, change_24h = quote
+            result.append({
+                "symbol": pair,
+                "lastPrice": f"{price:.8f}",
+                "priceChangePercent": f"{change_24h:.3f}",
+                "quoteVolume": f"{price * 1e5:.2f}"
+            })
+        return result
+
+    def exchange_rates(self):
+        """Курсы валют относительно BTC, как в /exchange_rates CoinGecko."""
+        rates = {}
+        for currency, rate in FX_RATES.items():
+            rates[currency] = {
+                "name": currency.upper(),
+                "unit": currency.upper(),
+                "value": rate / FX_RATES['btc'],
+                "type": "crypto" if currency == 'btc' else "fiat"
+            }
+        return {"rates": rates}
+
+    def stream_prices(self, query):
+        """
+        Поток цен по WebSocket в формате CoinCap: раз в stream_interval_ms приходит
+        {"bitcoin": "60000.12", ...} по монетам, цена которых изменилась (в USD).
+        С --stream-drop-sec соединение обрывается через указанное время (проверка перехода на REST).
+        """
+        options = self.server.options
+        key = self.headers.get('Sec-WebSocket-Key')
+        if not key:
+            self.send_json({"error": "Sec-WebSocket-Key required"}, status=400)
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = True
+
+        ids = [api_id for api_id in query.get('assets', '').split(',') if api_id]
+        started = time.monotonic()
+        try:
+            while not options.stream_drop_sec or time.monotonic() - started < options.stream_drop_sec:
+                # Как в настоящем потоке, в сообщение попадает только часть монет
+                batch = {}
+                for api_id in ids:
+                    quote = self.server.market.get(api_id)
+                    if quote is not None and random.random() < 0.5:
+                        batch[api_id] = f"{quote[0]:.10g}"
+                if batch:
+                    self.send_websocket_text(json.dumps(batch))
+                time.sleep(options.stream_interval_ms / 1000)
+        except OSError:
+            pass # Клиент закрыл соединение
+
+    def send_websocket_text(self, text):
+        """Отправляет текстовый кадр WebSocket (от сервера — без маски)."""
+        payload = text.encode('utf-8')
+        if len(payload) < 126:
+            header = struct.pack('!BB', 0x81, len(payload))
+        elif len(payload) < 1 << 16:
+            header = struct.pack('!BBH', 0x81, 126, len(payload))
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, len(payload))
+        self.wfile.write(header + payload)
+        self.wfile.flush()
+
+    def send_json(self, payload, status=200, headers=None):
+        options = self.server.options
+        body = json.dumps(payload).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+
+        if options.slow_body_ms <= 0:
+            self.wfile.write(body)
+            return
+
+        # Медленная отдача: тело уходит частями в течение slow_body_ms
+        chunks = [body[i:i + 256] for i in range(0, len(body), 256)] or [body]
+        pause = options.slow_body_ms / 1000 / len(chunks)
+        for chunk in chunks:
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            time.sleep(pause)
+
+
+def make_server(options):
+    """Создает (но не запускает) сервер с указанными параметрами."""
+    fixture = None
+    if options.fixture:
+        with open(options.fixture, 'r', encoding='utf-8') as f:
+            fixture = json.load(f)
+
+    server = ThreadingHTTPServer((options.host, options.port), StubHandler)
+    server.daemon_threads = True
+    server.options = options
+    server.market = SyntheticMarket(fixture, options.volatility, options.known_only, options.seed)
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная замена CoinGecko API с имитацией задержек и ошибок.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--fixture', default=None, help="JSON-файл с ценами в USD: {\"bitcoin\": 60000, ...}")
+    parser.add_argument('--known-only', action='store_true', help="Не отдавать монеты, которых нет в фикстуре")
+    parser.add_argument('--volatility', type=float, default=0.01, help="Волатильность случайного блуждания за минуту")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--latency-ms', type=float, default=0, help="Задержка перед ответом")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Случайная добавка к задержке (0..jitter)")
+    parser.add_argument('--rate-429', type=float, default=0, help="Доля ответов 429 (0..1)")
+    parser.add_argument('--retry-after', type=int, default=30, help="Значение Retry-After для ответов 429")
+    parser.add_argument('--rate-5xx', type=float, default=0, help="Доля ответов 5xx (0..1)")
+    parser.add_argument('--max-per-page', type=int, default=0, help="Обрезать страницы до N монет (0 — без обрезки)")
+    parser.add_argument('--slow-body-ms', type=float, default=0, help="Растянуть отдачу тела ответа на N мс")
+    parser.add_argument('--coin-list-size', type=int, default=10000, help="Сколько синтетических монет добавить в /coins/list")
+    parser.add_argument('--stream-interval-ms', type=float, default=500, help="Как часто поток WebSocket отправляет цены")
+    parser.add_argument('--stream-drop-sec', type=float, default=0, help="Обрывать поток WebSocket через N секунд (0 — не обрывать)")
+    parser.add_argument('--quiet', action='store_true', help="Не выводить журнал запросов")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    server = make_server(options)
+    print(f"Заглушка CoinGecko: http://{options.host}:{server.server_address[1]}/api/v3")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2289 @@
+# Ядро виджета без графического интерфейса: загрузка цен, расчет портфеля и трендов.
+# Модуль не импортирует tkinter/PIL/pystray, поэтому его можно запускать на сервере
+# или в CI (python crypto_core.py --headless) и использовать из других скриптов.
+
+import json
+import os
+import sys
+import time
+import threading
+import queue
+import sqlite3
+import random
+import importlib
+import heapq
+import gzip
+import tempfile
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# --- Константы ---
+BASE_DIR = os.path.dirname(os.path.abspath(sys.argv[0]))
+CONFIG_FILE = os.path.join(BASE_DIR, 'config.json')
+HISTORY_DB_FILE = os.path.join(BASE_DIR, 'trend_history.db') # История цен и трендов между запусками
+MARKET_SNAPSHOT_FILE = os.path.join(BASE_DIR, 'market_snapshot.json') # Последние данные для мгновенного старта окна
+COIN_INDEX_FILE = os.path.join(BASE_DIR, 'coin_index.json.gz') # Список монет CoinGecko для поиска ID в настройках
+API_URL = "https://api.coingecko.com/api/v3/simple/price"
+API_BASE_URL = "https://api.coingecko.com/api/v3"
+API_URL_ENV = "CRYPTO_WIDGET_API_URL" # Переменная окружения с другим адресом API (например, локальной заглушки)
+STREAM_URL_ENV = "CRYPTO_WIDGET_STREAM_URL" # Переменная окружения с адресом потока цен (WebSocket)
+STREAM_STALE_SEC = 30 # Поток без сообщений дольше этого считается оборванным (цены снова только по REST)
+STREAM_RECONNECT_MIN_SEC = 1 # Начальная пауза перед переподключением к потоку (удваивается)
+STREAM_RECONNECT_MAX_SEC = 60 # Максимальная пауза перед переподключением
+STREAM_REST_EVERY_SEC = 10 * 60 # При живом потоке полный запрос REST (изменение за 24ч и т.п.) не реже раза в N секунд
+HTTP_TIMEOUT_SEC = 10 # Таймаут одного HTTP-запроса
+HTTP_MAX_RETRIES = 3 # Количество повторов при временных ошибках сети/API
+HTTP_BACKOFF_BASE_SEC = 0.5 # Начальная задержка между повторами (удваивается)
+HTTP_BACKOFF_MAX_SEC = 8 # Максимальная задержка между повторами
+HTTP_POOL_SIZE = 4 # Размер пула соединений
+MARKETS_CHUNK_SIZE = 100 # Сколько ID монет запрашивать за один вызов /coins/markets (макс. per_page = 250)
+MARKETS_MAX_PARALLEL = 4 # Сколько частей списка монет запрашивать одновременно
+PRICE_PROVIDERS_DEFAULT = ["coingecko"] # Источники цен в порядке приоритета (запасные включаются в конфиге)
+PROVIDER_HEDGE_AFTER_SEC = 1.5 # Через сколько секунд без ответа параллельно запрашивать следующий источник
+PROVIDER_DEADLINE_SEC = 15 # Дольше этого ответа источников не ждем (верхняя граница времени обновления)
+PROVIDER_BLOCK_SEC = 60 # Пауза для источника, ответившего 429 без Retry-After
+REFRESH_MIN_INTERVAL_SEC = 10 # Минимальный интервал между запросами (и скорость пополнения token bucket)
+REFRESH_MAX_INTERVAL_SEC = 600 # Максимальный интервал при частых 429/5xx
+REFRESH_BUCKET_CAPACITY = 3 # Сколько внеочередных запросов можно сделать подряд (смена настроек и т.п.)
+REFRESH_RATE_MS = 60000 # Обновление раз в минуту
+REFRESH_TIERS_SEC = (10, 60, 300) # Интервалы обновления, которые можно выбрать для монеты ("refresh_sec")
+REFRESH_BATCH_AHEAD_SEC = 5 # Монеты, срок которых наступит в ближайшие N секунд, уходят в тот же запрос
+PIVOT_CURRENCY = "usd" # Цены всегда запрашиваются в этой валюте, остальные получаются пересчетом
+FX_RATES_TTL_SEC = 60 * 60 # Как часто обновлять таблицу курсов валют (/exchange_rates)
+MARKET_CACHE_TTL_SEC = 10 # Столько секунд данные считаются свежими (повторный запрос не уходит в сеть)
+MARKET_CACHE_MAX_STALE_SEC = 24 * 60 * 60 # Дольше этого устаревшие данные не показываются даже при сбое API
+HISTORY_SIZE = 5 # Размер истории трендов (5x)
+SIGNAL_COOLDOWN_SEC = 15 * 60 # Повтор того же сигнала (монета, направление, длина серии) не чаще раза в N секунд
+SIGNAL_HYSTERESIS = 0.5 # Новая серия сигналит, только если изменение больше порога на эту долю (1.5x порога)
+MAX_VISIBLE_ROWS = 20 # Сколько строк таблицы видно одновременно (остальные — прокруткой)
+HISTORY_KEEP_TICKS = 1440 # Сколько последних записей (цен/трендов) хранить на диске по каждой монете
+HISTORY_THIN_STEP_SEC = 60 * 60 # Цены старше HISTORY_KEEP_TICKS записей хранятся по одной за этот шаг (час)
+HISTORY_KEEP_THIN_SEC = 7 * 24 * 60 * 60 + HISTORY_THIN_STEP_SEC # ...но не дольше этого (7 дней для аналитики и запас на шаг)
+HISTORY_COMPACT_EVERY = 60 # Сжатие базы истории раз в N обновлений
+HISTORY_PREV_PRICE_MAX_AGE_SEC = 30 * 60 # Старше этого последняя цена не используется для сравнения после запуска
+CONFIG_SAVE_DELAY_SEC = 2.0 # Изменения конфига, сделанные за это время, записываются на диск одной записью
+SNAPSHOT_SAVE_EVERY_SEC = 5 * 60 # Как часто сохранять снимок последних данных (и всегда — при выходе)
+COIN_INDEX_TTL_SEC = 7 * 24 * 60 * 60 # Как часто обновлять список монет (/coins/list)
+COIN_INDEX_SCAN_LIMIT = 200 # Сколько совпадений по префиксу просматривать при поиске (остальные — хуже по рангу)
+ANALYTICS_WINDOWS = (("1h", 60 * 60), ("24h", 24 * 60 * 60), ("7d", 7 * 24 * 60 * 60)) # Окна прибыли/убытка портфеля
+ANALYTICS_BUCKET_SEC = 5 * 60 # Шаг истории цен для аналитики (в пределах шага остается последняя цена)
+APP_NAME = "CryptoWidgetCoinGecko" # Имя приложения (реестр, User-Agent)
+
+
+# Сообщения для уведомлений о трендах в зависимости от длины серии (по умолчанию; свои — ключ "trend_messages").
+# Ключи — пороги (уровни): для серии длиннее последнего уровня используется сообщение самого старшего уровня.
+TREND_MESSAGES = {
+    1: {
+        "BULLISH": "НАЧАЛЬНЫЙ ПРИЗНАК: Возможен восходящий импульс.",
+        "BEARISH": "НАЧАЛЬНЫЙ ПРИЗНАК: Возможен нисходящий импульс."
+    },
+    2: {
+        "BULLISH": "ПОДВТЕРЖДЕЮЩИЙСЯ ПРИЗНАК: Возможен восходящий импульс.",
+        "BEARISH": "ПОДТВЕРЖДАЮЩИЙСЯ ПРИЗНАК: Возможен нисходящий импульс."
+    },
+    3: {
+        "BULLISH": "УСИЛЕНИЕ: Подтверждается краткосрочный восходящий тренд.",
+        "BEARISH": "УСИЛЕНИЕ: Подтверждается краткосрочный нисходящий тренд."
+    },
+    4: {
+        "BULLISH": "СИЛЬНЫЙ СИГНАЛ: Высокая вероятность продолжения роста.",
+        "BEARISH": "СИЛЬНЫЙ СИГНАЛ: Высокая вероятность продолжения падения."
+    },
+    5: {
+        "BULLISH": "МАКСИМАЛЬНЫЙ ТРЕНД: Устойчивый, сильный бычий сигнал.",
+        "BEARISH": "МАКСИМАЛЬНЫЙ ТРЕНД: Устойчивый, сильный медвежий сигнал."
+    }
+}
+
+# --- Управление Конфигурацией ---
+def load_config(path=None):
+    """
+    Загружает конфигурацию из config.json (или из path), при его повреждении — из config.json.bak,
+    иначе создает дефолтную.
+    """
+    path = path or CONFIG_FILE
+    default_config = {
+        "base_currency": "usd", 
+        "display_currencies": ["usd"], # Валюты, в которых показывается общая стоимость портфеля
+        "coins": {
+            "bitcoin": {"name": "BTC", "amount": 0.0}, 
+            "ethereum": {"name": "ETH", "amount": 0.0}
+        },
+        "trend_threshold_percent": 0.01, # процент при котором выскакивает окошко оповещения о тренде
+        "signal_cooldown_sec": SIGNAL_COOLDOWN_SEC, # Пауза перед повтором того же уведомления
+        "signal_hysteresis": SIGNAL_HYSTERESIS, # Запас над порогом для начала новой серии уведомлений
+        "font_size": 10,
+        "max_visible_rows": MAX_VISIBLE_ROWS, # Высота таблицы в строках, длинные списки прокручиваются
+        "table_renderer": "labels", # Отрисовка таблицы: "labels" (виджеты) или "canvas" (один холст)
+        "trend_history_size": HISTORY_SIZE, # Длина истории трендов (5x)
+        "trend_messages": {str(tier): dict(texts) for tier, texts in TREND_MESSAGES.items()}, # Уровни сообщений уведомлений по длине серии
+        "refresh_rate_ms": REFRESH_RATE_MS, # Базовый интервал обновления (адаптируется к лимитам API)
+        "api_base_url": None, # Другой адрес API (например, локальная заглушка), None — CoinGecko
+        "price_providers": list(PRICE_PROVIDERS_DEFAULT), # Источники цен: "coingecko", "binance", "coincap" (по приоритету)
+        "provider_urls": {}, # Другие адреса источников {"binance": "http://..."}; CoinGecko — api_base_url
+        "provider_symbols": {}, # ID монет у источников {"binance": {"aptos": "APT"}}, если не совпадают с CoinGecko
+        "hedge_after_ms": int(PROVIDER_HEDGE_AFTER_SEC * 1000), # Ожидание главного источника перед запросом запасного
+        "stream_url": None, # Адрес потока цен по WebSocket (формат CoinCap /prices), None — только запросы REST
+        "window_x": None, 
+        "window_y": None,
+        "notification_window_x": None, # НОВОЕ: Позиция окна уведомления X
+        "notification_window_y": None, # НОВОЕ: Позиция окна уведомления Y
+        "opacity": 0.95,
+        "autostart_enabled": True,
+        "hide_on_close": True, 
+        "theme": "light",
+        "trend_notifications_enabled": True, # Оставлено для совместимости при миграции
+        "notification_duration_sec": 10,  # НОВОЕ: Длительность уведомления в секундах
+        "notification_mode": "always"     # НОВОЕ: "always", "tray_only", "disabled"
+    }
+    
+    # Если основной файл поврежден (например, запись прервалась), пробуем резервную копию
+    for config_path in (path, path + '.bak'):
+        if not os.path.exists(config_path):
+            continue
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except Exception as e:
+            print(f"Не удалось прочитать конфиг {config_path}: {e}", file=sys.stderr)
+            continue
+        if config_path != path:
+            print(f"Настройки восстановлены из резервной копии {config_path}", file=sys.stderr)
+            
+        # Обновление старого формата монет на новый
+        if 'coins' in config:
+            new_coins = {}
+            for api_id, data in config['coins'].items():
+                if isinstance(data, str):
+                    new_coins[api_id] = {"name": data, "amount": 0.0}
+                elif isinstance(data, dict):
+                    # Игнорируем специфические поля DEX, если они есть
+                    coin_data = {
+                        "name": data.get("name", api_id.upper()),
+                        "amount": data.get("amount", 0.0)
+                    }
+                    if data.get("refresh_sec"):
+                        coin_data["refresh_sec"] = data["refresh_sec"] # Свой интервал обновления монеты
+                    new_coins[api_id] = coin_data
+                
+            config['coins'] = new_coins
+        
+        for key, default_val in default_config.items():
+            if key not in config:
+                config[key] = default_val
+                
+        # Миграция: если старая настройка отключена, устанавливаем режим "disabled"
+        if 'trend_notifications_enabled' in config and not config['trend_notifications_enabled'] and config.get('notification_mode', default_config['notification_mode']) == default_config['notification_mode']:
+             config['notification_mode'] = 'disabled'
+        # Удаляем старую настройку
+        if 'trend_notifications_enabled' in config:
+            del config['trend_notifications_enabled']
+            
+        return config
+        
+    return default_config
+
+
+def serialize_config(config):
+    """Текст config.json (без устаревших настроек)."""
+    return json.dumps({key: value for key, value in config.items() if key != 'trend_notifications_enabled'}, indent=4)
+
+
+def write_config_file(text, path=None):
+    """
+    Атомарно записывает текст конфига: сначала во временный файл, затем os.replace,
+    поэтому прерванная запись не оставляет обрезанный config.json. Прошлая версия
+    сохраняется в config.json.bak (только если она читается — испорченный файл
+    не должен затереть хорошую резервную копию).
+    """
+    write_file_atomic(text, path or CONFIG_FILE, backup=True)
+
+
+def write_file_atomic(text, path, backup=False):
+    """
+    Записывает текст (или bytes) во временный файл и переименовывает его в path (os.replace).
+    Имя временного файла уникально, поэтому одновременные записи из разных потоков
+    не пишут в один файл. backup=True — прошлая версия, если это читаемый JSON, переносится в path + '.bak'.
+    """
+    binary = isinstance(text, bytes)
+    with tempfile.NamedTemporaryFile(
+        'wb' if binary else 'w', encoding=None if binary else 'utf-8',
+        dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + '.', suffix='.tmp', delete=False
+    ) as f:
+        tmp_path = f.name
+        try:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.close()
+            os.remove(tmp_path)
+            raise
+        
+    if backup:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                json.load(f)
+            os.replace(path, path + '.bak')
+        except (OSError, ValueError):
+            pass
+    os.replace(tmp_path, path)
+
+
+def save_config(config, path=None, on_permission_error=None):
+    """
+    Сразу сохраняет конфигурацию в config.json (или в path), атомарно.
+    on_permission_error(e) вызывается при ошибке прав доступа (например, чтобы показать окно с ошибкой).
+    """
+    try:
+        write_config_file(serialize_config(config), path)
+    except PermissionError as e:
+        print(f"Ошибка прав доступа при сохранении конфига: {e}", file=sys.stderr)
+        
+        if on_permission_error is not None:
+            on_permission_error(e)
+    except Exception as e:
+        print(f"Неизвестная ошибка при сохранении конфига: {e}", file=sys.stderr)
+
+
+class ConfigPersister:
+    """
+    Отложенное (write-behind) сохранение конфига.
+    save() только снимает копию настроек (в вызывающем потоке) и откладывает запись:
+    все изменения за delay_sec записываются одной атомарной записью в фоновом потоке.
+    Если текст не изменился с последней записи, файл не трогается.
+    Ошибки прав доступа складываются в очередь errors — окно показывает их в основном потоке.
+    """
+    def __init__(self, path=None, delay_sec=CONFIG_SAVE_DELAY_SEC):
+        self.path = path
+        self.delay = delay_sec
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock() # Одна запись за раз (таймер и flush при выходе)
+        self.pending = None # Текст, ожидающий записи
+        self.last_written = None # Текст, который сейчас на диске (None — еще не сверяли)
+        self.timer = None
+        self.errors = queue.Queue()
+
+    def save(self, config):
+        """Ставит конфиг в очередь на запись."""
+        text = serialize_config(config)
+        with self.lock:
+            if text == self.last_written:
+                self.pending = None # Вернули как было — писать нечего
+                return
+            self.pending = text
+            if self.timer is None:
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Записывает отложенные изменения сразу (вызывается таймером и при выходе)."""
+        with self.write_lock:
+            with self.lock:
+                text, self.pending = self.pending, None
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+            if text is None:
+                return
+                
+            path = self.path or CONFIG_FILE
+            if self.last_written is None:
+                # Первая запись: сверяем с файлом на диске (например, при старте ничего не изменилось)
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        self.last_written = f.read()
+                except OSError:
+                    pass
+            if text == self.last_written:
+                return
+                
+            try:
+                write_config_file(text, path)
+                self.last_written = text
+            except PermissionError as e:
+                print(f"Ошибка прав доступа при сохранении конфига: {e}", file=sys.stderr)
+                self.errors.put(e)
+            except Exception as e:
+                print(f"Неизвестная ошибка при сохранении конфига: {e}", file=sys.stderr)
+
+
+# --- Отложенные импорты ---
+# Тяжелые зависимости (requests, PIL, pystray) загружаются при первом использовании,
+# а не при запуске: окно появляется раньше, а requests импортируется уже в фоновом потоке загрузки.
+LAZY_IMPORT_TIMES = {} # {модуль: время импорта в мс} для отчета о запуске
+
+def timed_import(name):
+    """Импортирует модуль (или берет уже загруженный) и запоминает время первого импорта."""
+    if name in sys.modules:
+        return sys.modules[name]
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    LAZY_IMPORT_TIMES.setdefault(name, (time.perf_counter() - started) * 1000)
+    return module
+
+requests = None # Загружается при первом запросе, см. import_requests
+
+def import_requests():
+    global requests
+    if requests is None:
+        requests = timed_import('requests') # Вместе с requests.adapters
+    return requests
+
+
+# --- Получение данных (API) ---
+class PartialMarketsError(Exception):
+    """Часть списка монет не загружена: result — загруженные монеты, missing — монеты неудавшихся частей."""
+    def __init__(self, result, missing, error):
+        super().__init__(f"часть списка монет не загружена ({len(missing)} шт.): {error}")
+        self.result = result
+        self.missing = missing
+        self.error = error
+
+
+class ApiClient:
+    """
+    Общая часть клиентов источников цен поверх одной requests.Session.
+    Соединение переиспользуется между обновлениями (keep-alive, без повторных DNS/TCP/TLS),
+    ответы запрашиваются в gzip, временные ошибки повторяются с экспоненциальной
+    задержкой со случайным разбросом. Время последнего запроса хранится в last_latency_ms.
+    Наследники задают name, адрес по умолчанию, валюты и get_markets_chunk, а ID монет
+    источника берут из symbols ({api_id: ID у источника}, по умолчанию совпадают с ID CoinGecko).
+    """
+    name = None
+    default_base_url = None
+    currencies = None # Валюты, в которых источник отдает цены (None — любые)
+    default_symbols = {}
+    # 429 не повторяем: повтор лишь расходует общий лимит, паузу выдерживает RefreshScheduler
+    RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+    def __init__(self, base_url=None, timeout=HTTP_TIMEOUT_SEC, max_retries=HTTP_MAX_RETRIES, pool_size=HTTP_POOL_SIZE, symbols=None):
+        self.base_url = (base_url or self.default_base_url).rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.symbols = dict(self.default_symbols, **(symbols or {}))
+        self.session = None # Создается при первом запросе (вместе с импортом requests)
+        self.session_lock = threading.Lock()
+        
+        self.last_latency_ms = None # Длительность последнего запроса (мс)
+        self.blocked_until = 0.0 # time.monotonic(), до которого источник пропускается (после 429)
+        self.executor = None # Пул потоков для параллельной загрузки частей списка монет
+
+    def supports(self, currency):
+        return self.currencies is None or currency in self.currencies
+
+    def get_symbol(self, api_id):
+        """ID монеты у источника (None — источник эту монету не знает)."""
+        return self.symbols.get(api_id, api_id)
+
+    def get_session(self):
+        """Общая requests.Session клиента (создается один раз, из любого потока)."""
+        with self.session_lock:
+            if self.session is None:
+                import_requests()
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({
+                    'Accept': 'application/json',
+                    'Accept-Encoding': 'gzip, deflate',
+                    'User-Agent': APP_NAME
+                })
+                self.session = session
+            return self.session
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Задержка перед повтором: Retry-After от сервера или 2^attempt со случайным разбросом."""
+        if retry_after is not None:
+            return retry_after
+        delay = min(HTTP_BACKOFF_MAX_SEC, HTTP_BACKOFF_BASE_SEC * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def get_json(self, path, params=None):
+        """Выполняет GET-запрос с повторами и возвращает разобранный JSON."""
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        session = self.get_session()
+        
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = session.get(url, params=params, timeout=self.timeout)
+                self.last_latency_ms = (time.perf_counter() - started) * 1000
+                
+                if response.status_code not in self.RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                    
+                if attempt >= self.max_retries:
+                    response.raise_for_status()
+                    
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after is not None and retry_after > HTTP_BACKOFF_MAX_SEC:
+                    # Сервер просит ждать дольше, чем имеет смысл держать запрос
+                    response.raise_for_status()
+                    
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.last_latency_ms = (time.perf_counter() - started) * 1000
+                if attempt >= self.max_retries:
+                    raise
+                    
+            time.sleep(self.backoff_delay(attempt, retry_after))
+
+    def get_markets(self, coin_ids, currency):
+        """
+        Получает цены и процент изменения за 24ч: {api_id: {валюта: цена, 'change_24h', 'market_cap', 'volume'}}.
+        Длинный список ID делится на части по MARKETS_CHUNK_SIZE (лимит страницы API
+        и длины URL), части запрашиваются параллельно, результаты объединяются в один словарь.
+        Если не удались только некоторые части — PartialMarketsError с остальными данными.
+        """
+        coin_ids = list(coin_ids)
+        chunks = [coin_ids[i:i + MARKETS_CHUNK_SIZE] for i in range(0, len(coin_ids), MARKETS_CHUNK_SIZE)]
+        
+        if len(chunks) <= 1:
+            return self.get_markets_chunk(chunks[0], currency) if chunks else {}
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=MARKETS_MAX_PARALLEL, thread_name_prefix=self.name)
+            
+        futures = [self.executor.submit(self.get_markets_chunk, chunk, currency) for chunk in chunks]
+        
+        result = {}
+        errors = []
+        missing = []
+        for chunk, future in zip(chunks, futures):
+            try:
+                result.update(future.result())
+            except (requests.exceptions.RequestException, ValueError) as e:
+                errors.append(e)
+                missing.extend(chunk)
+                
+        if errors and not result:
+            raise errors[0] # Не удалось получить ни одной части
+        if errors:
+            raise PartialMarketsError(result, missing, errors[0])
+        return result
+
+    def get_markets_chunk(self, coin_ids, currency):
+        """Запрашивает одну часть списка монет (не больше одной страницы API)."""
+        raise NotImplementedError
+
+
+class CoinGeckoClient(ApiClient):
+    """Клиент CoinGecko API (/coins/markets; он же отдает курсы валют /exchange_rates)."""
+    name = 'coingecko'
+    default_base_url = API_BASE_URL
+
+    def get_markets_chunk(self, coin_ids, currency):
+        data = self.get_json(
+            "coins/markets",
+            params={
+                "vs_currency": currency,
+                "ids": ",".join(coin_ids),
+                "price_change_percentage": "24h",
+                "per_page": len(coin_ids),
+                "page": 1
+            }
+        )
+
+        # Преобразуем ответ в формат, совместимый со старым кодом
+        result = {}
+        for item in data:
+            result[item["id"]] = {
+                currency: item["current_price"],
+                "change_24h": item.get("price_change_percentage_24h", 0.0),
+                "market_cap": item.get("market_cap"),
+                "volume": item.get("total_volume")
+            }
+        return result
+
+
+class CoinCapClient(ApiClient):
+    """Клиент CoinCap API (/assets, цены только в USD). ID монет почти всегда совпадают с CoinGecko."""
+    name = 'coincap'
+    default_base_url = "https://api.coincap.io/v2"
+    currencies = ('usd',)
+    default_symbols = {
+        'binancecoin': 'binance-coin',
+        'ripple': 'xrp',
+        'avalanche-2': 'avalanche',
+        'matic-network': 'polygon'
+    }
+
+    def get_markets_chunk(self, coin_ids, currency):
+        symbols = {self.get_symbol(api_id): api_id for api_id in coin_ids}
+        data = self.get_json("assets", params={"ids": ",".join(symbols), "limit": len(symbols)})
+        
+        result = {}
+        for item in data["data"]:
+            api_id = symbols.get(item["id"])
+            if api_id is None or item.get("priceUsd") is None:
+                continue
+            result[api_id] = {
+                currency: float(item["priceUsd"]),
+                "change_24h": float(item.get("changePercent24Hr") or 0.0),
+                "market_cap": float(item["marketCapUsd"]) if item.get("marketCapUsd") else None,
+                "volume": float(item["volumeUsd24Hr"]) if item.get("volumeUsd24Hr") else None
+            }
+        return result
+
+
+class BinanceClient(ApiClient):
+    """
+    Клиент Binance (/ticker/24hr): цена в USD берется по паре к USDT.
+    Биржа знает монеты по тикерам, поэтому запрашиваются только монеты из symbols
+    (встроенная таблица плюс "provider_symbols" → "binance" в конфиге).
+    """
+    name = 'binance'
+    default_base_url = "https://api.binance.com/api/v3"
+    currencies = ('usd',)
+    quote_asset = 'USDT'
+    default_symbols = {
+        'bitcoin': 'BTC',
+        'ethereum': 'ETH',
+        'binancecoin': 'BNB',
+        'solana': 'SOL',
+        'ripple': 'XRP',
+        'cardano': 'ADA',
+        'dogecoin': 'DOGE',
+        'tron': 'TRX',
+        'toncoin': 'TON',
+        'polkadot': 'DOT',
+        'litecoin': 'LTC',
+        'chainlink': 'LINK',
+        'avalanche-2': 'AVAX',
+        'aptos': 'APT',
+        'sui': 'SUI',
+        'near': 'NEAR'
+    }
+
+    def get_symbol(self, api_id):
+        return self.symbols.get(api_id)
+
+    def get_markets_chunk(self, coin_ids, currency):
+        pairs = {}
+        for api_id in coin_ids:
+            symbol = self.get_symbol(api_id)
+            if symbol:
+                pairs[f"{symbol}{self.quote_asset}"] = api_id
+        if not pairs:
+            return {}
+        data = self.get_json("ticker/24hr", params={"symbols": json.dumps(list(pairs), separators=(',', ':'))})
+        
+        result = {}
+        for item in data:
+            api_id = pairs.get(item["symbol"])
+            if api_id is None:
+                continue
+            result[api_id] = {
+                currency: float(item["lastPrice"]),
+                "change_24h": float(item.get("priceChangePercent") or 0.0),
+                "market_cap": None,
+                "volume": float(item["quoteVolume"]) if item.get("quoteVolume") else None
+            }
+        return result
+
+
+PRICE_PROVIDERS = {client.name: client for client in (CoinGeckoClient, CoinCapClient, BinanceClient)}
+
+
+class ProviderPool:
+    """
+    Источники цен в порядке приоритета с переключением при сбое и hedged-запросами.
+    Запрос уходит первому источнику; если он не ответил за hedge_after секунд (или ответил
+    ошибкой), параллельно запрашивается следующий, и так далее. Берется первый удачный ответ
+    главного источника (первого в списке, даже если он на паузе) или любого, знающего все монеты;
+    неполные ответы запасных источников объединяются и отдаются, если лучшего не будет, а монеты
+    без цены попадают в last_missing. Так же объединяется ответ источника, у которого не удалась
+    часть списка монет (PartialMarketsError). Опоздавшие запросы просто дорабатывают в фоне.
+    Дольше deadline ответа не ждем, так что время обновления ограничено сверху.
+    Источник, ответивший 429, пропускается до конца паузы.
+    После смены настроек старый набор закрывается (close), но идущие запросы дорабатывают на нем.
+    """
+    def __init__(self, providers, hedge_after_sec=PROVIDER_HEDGE_AFTER_SEC, deadline_sec=PROVIDER_DEADLINE_SEC):
+        self.providers = providers
+        self.hedge_after = hedge_after_sec
+        self.deadline = deadline_sec
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(providers), thread_name_prefix="providers")
+        self.last_provider = None # Имя источника последнего удачного ответа
+        self.last_latency_ms = None # Время получения последнего ответа (с учетом hedged-запросов)
+        self.last_missing = [] # Монеты, которых нет в последнем неполном ответе (запасных источников или части списка)
+        self.lock = threading.Lock()
+        self.active_calls = 0 # Запросы, идущие сейчас (executor закрывается только после них)
+        self.closed = False
+
+    def close(self):
+        """Закрывает executor сразу, если запросов нет, иначе — когда закончится последний."""
+        with self.lock:
+            self.closed = True
+            idle = self.active_calls == 0
+        if idle:
+            self.executor.shutdown(wait=False)
+
+    def get_markets(self, coin_ids, currency):
+        """
+        Данные первого ответившего источника; если ответа нет ни от одного — исключение главного из них.
+        Если ответ собран из неполных ответов запасных источников, недостающие монеты — в last_missing.
+        """
+        with self.lock:
+            if self.closed:
+                raise ValueError("Набор источников цен закрыт (настройки изменились)")
+            self.active_calls += 1
+        try:
+            return self.get_markets_hedged(coin_ids, currency)
+        finally:
+            with self.lock:
+                self.active_calls -= 1
+                idle = self.closed and self.active_calls == 0
+            if idle:
+                self.executor.shutdown(wait=False)
+
+    def get_markets_hedged(self, coin_ids, currency):
+        import_requests()
+        started = time.monotonic()
+        providers = [p for p in self.providers if p.supports(currency) and started >= p.blocked_until]
+        if not providers:
+            providers = [p for p in self.providers if p.supports(currency)][:1] # Все на паузе: спрашиваем главный
+        if not providers:
+            raise ValueError(f"Нет источника цен в валюте {currency}")
+            
+        pending = {}
+        errors = [] # [(приоритет источника, исключение)]
+        partial = {} # Неполные ответы запасных источников
+        partial_from = []
+        launched = 0
+        hedge_at = started
+        while True:
+            now = time.monotonic()
+            if launched < len(providers) and now >= hedge_at:
+                future = self.executor.submit(providers[launched].get_markets, coin_ids, currency)
+                pending[future] = launched
+                launched += 1
+                hedge_at = now + self.hedge_after
+            if not pending or now - started >= self.deadline:
+                if partial:
+                    return self.accept(partial, ','.join(partial_from), started, [api_id for api_id in coin_ids if api_id not in partial])
+                if not pending:
+                    raise min(errors, key=lambda error: error[0])[1]
+                raise requests.exceptions.Timeout(f"Ни один источник цен не ответил за {self.deadline} сек")
+                
+            timeout = started + self.deadline - now
+            if launched < len(providers):
+                timeout = min(timeout, hedge_at - now)
+            done, _not_done = wait(pending, timeout=max(0.0, timeout), return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                index = pending.pop(future)
+                provider = providers[index]
+                try:
+                    result = future.result()
+                except PartialMarketsError as e:
+                    # Часть списка не загружена: как неполный ответ запасного источника, даже у главного
+                    print(f"Источник цен {provider.name} ответил не полностью: {e}", file=sys.stderr)
+                    self.on_error(provider, e.error)
+                    for api_id, item in e.result.items():
+                        partial.setdefault(api_id, item)
+                    partial_from.append(provider.name)
+                    hedge_at = time.monotonic()
+                    continue
+                except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+                    print(f"Источник цен {provider.name} не ответил: {e}", file=sys.stderr)
+                    self.on_error(provider, e)
+                    errors.append((index, e))
+                    hedge_at = time.monotonic() # Ошибка: следующий источник запрашивается сразу
+                    continue
+                # Главный источник сравнивается по исходному приоритету: пока он на паузе после 429,
+                # неполный ответ запасного не считается полным
+                if provider is self.providers[0] or all(api_id in result for api_id in coin_ids):
+                    return self.accept(result, provider.name, started)
+                for api_id, item in result.items():
+                    partial.setdefault(api_id, item)
+                partial_from.append(provider.name)
+                hedge_at = time.monotonic() # Неполный ответ: недостающие монеты спрашиваем у следующего источника сразу
+
+    def accept(self, result, provider_name, started, missing=()):
+        self.last_provider = provider_name
+        self.last_latency_ms = (time.monotonic() - started) * 1000
+        self.last_missing = list(missing)
+        return result
+
+    def on_error(self, provider, error):
+        """После 429 источник пропускается на время Retry-After (или PROVIDER_BLOCK_SEC)."""
+        response = getattr(error, 'response', None)
+        if response is not None and response.status_code == 429:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            provider.blocked_until = time.monotonic() + (retry_after if retry_after is not None else PROVIDER_BLOCK_SEC)
+
+
+def parse_retry_after(value):
+    """Разбирает заголовок Retry-After (в секундах). Возвращает None, если его нет или он не число."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+_api_client = None
+_provider_pool = None
+_provider_pool_key = None
+
+def resolve_api_base_url(config=None):
+    """Адрес API: переменная окружения CRYPTO_WIDGET_API_URL, затем "api_base_url" из конфига, затем CoinGecko."""
+    return (os.environ.get(API_URL_ENV) or (config or {}).get('api_base_url') or API_BASE_URL).rstrip('/')
+
+def configure_api(config):
+    """Пересоздает общий клиент CoinGecko и набор источников цен, если их настройки изменились."""
+    global _api_client, _provider_pool, _provider_pool_key
+    config = config or {}
+    base_url = resolve_api_base_url(config)
+    if _api_client is None or _api_client.base_url != base_url:
+        _api_client = CoinGeckoClient(base_url, symbols=(config.get('provider_symbols') or {}).get('coingecko'))
+        _provider_pool_key = None
+        
+    names = [name for name in config.get('price_providers') or PRICE_PROVIDERS_DEFAULT if name in PRICE_PROVIDERS] or ['coingecko']
+    key = json.dumps([names, config.get('provider_urls'), config.get('provider_symbols'), config.get('hedge_after_ms')], sort_keys=True)
+    if _provider_pool is None or key != _provider_pool_key:
+        if _provider_pool is not None:
+            _provider_pool.close() # Запрос, идущий в фоновом потоке, дорабатывает на старом наборе
+        providers = []
+        for name in names:
+            if name == 'coingecko':
+                providers.append(_api_client) # Один клиент и для цен, и для курсов валют
+            else:
+                # CRYPTO_WIDGET_API_URL направляет на заглушку все источники, чтобы запросы не уходили в интернет
+                providers.append(PRICE_PROVIDERS[name](
+                    os.environ.get(API_URL_ENV) or (config.get('provider_urls') or {}).get(name),
+                    symbols=(config.get('provider_symbols') or {}).get(name)
+                ))
+        hedge_after_sec = config.get('hedge_after_ms', PROVIDER_HEDGE_AFTER_SEC * 1000) / 1000
+        _provider_pool = ProviderPool(providers, hedge_after_sec)
+        _provider_pool_key = key
+
+def resolve_stream_url(config=None):
+    """Адрес потока цен: переменная окружения CRYPTO_WIDGET_STREAM_URL, затем "stream_url" из конфига (пусто — поток выключен)."""
+    return (os.environ.get(STREAM_URL_ENV) or (config or {}).get('stream_url') or '').strip()
+
+def get_api_client():
+    """Возвращает общий (создаваемый один раз) клиент CoinGecko."""
+    if _api_client is None:
+        configure_api({})
+    return _api_client
+
+def get_provider_pool():
+    """Возвращает общий набор источников цен (по умолчанию — из PRICE_PROVIDERS_DEFAULT)."""
+    if _provider_pool is None:
+        configure_api({})
+    return _provider_pool
+
+
+# Результат запроса для планировщика обновлений
+FETCH_OK = 'ok'
+FETCH_RATE_LIMITED = 'rate_limited' # 429
+FETCH_SERVER_ERROR = 'server_error' # 5xx
+FETCH_NETWORK_ERROR = 'network_error' # Нет сети, таймаут, неверный ответ
+
+class MarketDataCache:
+    """
+    Кэш рыночных данных по ключу (api_id, валюта) в режиме stale-while-revalidate.
+    Каждая запись хранит время получения (fetched_at). Свежие (моложе ttl) данные
+    отдаются без запроса в сеть; при сбое API вместо пустого ответа отдаются последние
+    удачные данные (не старше max_stale) с пометкой 'stale': True, пока планировщик
+    повторяет запрос.
+    """
+    def __init__(self, ttl_sec=MARKET_CACHE_TTL_SEC, max_stale_sec=MARKET_CACHE_MAX_STALE_SEC):
+        self.ttl = ttl_sec
+        self.max_stale = max_stale_sec
+        self.entries = {} # {(api_id, валюта): данные монеты с 'fetched_at'}
+        self.lock = threading.Lock()
+
+    def put(self, data, currency, now=None):
+        """Запоминает удачный ответ API и проставляет в нем время получения."""
+        now = time.time() if now is None else now
+        with self.lock:
+            for api_id, item in data.items():
+                item['fetched_at'] = now
+                self.entries[(api_id, currency)] = dict(item)
+
+    def get_fresh(self, coin_ids, currency, now=None):
+        """Данные по всем монетам, если все они моложе ttl, иначе None."""
+        now = time.time() if now is None else now
+        result = {}
+        with self.lock:
+            for api_id in coin_ids:
+                item = self.entries.get((api_id, currency))
+                if item is None or now - item['fetched_at'] > self.ttl:
+                    return None
+                result[api_id] = dict(item)
+        return result
+
+    def restore(self, data, currency):
+        """Заполняет кэш данными из снимка (время получения берется из самих данных)."""
+        with self.lock:
+            for api_id, item in data.items():
+                self.entries.setdefault((api_id, currency), {key: value for key, value in item.items() if key != 'stale'})
+
+    def fill_stale(self, data, coin_ids, currency, now=None):
+        """Дополняет ответ последними известными данными по монетам, которых в нем нет."""
+        now = time.time() if now is None else now
+        with self.lock:
+            for api_id in coin_ids:
+                if api_id in data:
+                    continue
+                item = self.entries.get((api_id, currency))
+                if item is not None and now - item['fetched_at'] <= self.max_stale:
+                    data[api_id] = dict(item, stale=True)
+        return data
+
+
+class FxRateTable:
+    """
+    Таблица курсов валют относительно PIVOT_CURRENCY (из /exchange_rates CoinGecko).
+    Цены монет запрашиваются один раз в опорной валюте, а в остальные валюты
+    пересчитываются по этой таблице, поэтому смена валюты не требует запроса в сеть.
+    Таблица обновляется не чаще раза в ttl секунд. После неудачной загрузки повтор
+    откладывается так же, как у планировщика запросов: от REFRESH_MIN_INTERVAL_SEC
+    с удвоением до REFRESH_MAX_INTERVAL_SEC, чтобы во время сбоя не тратить лимит API.
+    """
+    def __init__(self, ttl_sec=FX_RATES_TTL_SEC):
+        self.ttl = ttl_sec
+        self.rates = {PIVOT_CURRENCY: 1.0} # {валюта: сколько единиц валюты в 1 единице PIVOT_CURRENCY}
+        self.updated_at = None
+        self.failures = 0 # Неудачных загрузок подряд
+        self.retry_at = 0.0 # time.time(), раньше которого повтор не нужен
+
+    def is_stale(self, now=None):
+        now = time.time() if now is None else now
+        return self.updated_at is None or now - self.updated_at > self.ttl
+
+    def is_due(self, now=None):
+        """Пора ли загружать курсы: таблица устарела и пауза после неудачи прошла."""
+        now = time.time() if now is None else now
+        return self.is_stale(now) and now >= self.retry_at
+
+    def on_failure(self, now=None):
+        now = time.time() if now is None else now
+        self.failures += 1
+        self.retry_at = now + min(REFRESH_MAX_INTERVAL_SEC, REFRESH_MIN_INTERVAL_SEC * 2 ** (self.failures - 1))
+
+    def refresh(self, client):
+        """Загружает курсы (курсы в ответе API заданы относительно BTC)."""
+        btc_rates = client.get_json("exchange_rates")["rates"]
+        pivot_value = btc_rates[PIVOT_CURRENCY]["value"]
+        rates = {currency: info["value"] / pivot_value for currency, info in btc_rates.items()}
+        rates[PIVOT_CURRENCY] = 1.0
+        self.rates = rates # Замена словаря целиком: основной поток читает его без блокировок
+        self.updated_at = time.time()
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def convert(self, amount, currency):
+        """Пересчитывает сумму из PIVOT_CURRENCY в currency (None, если курса нет)."""
+        rate = self.rates.get(currency.lower())
+        if rate is None or amount is None:
+            return None
+        return amount * rate
+
+
+_fx_rates = FxRateTable()
+
+def get_fx_rates():
+    """Общая таблица курсов валют."""
+    return _fx_rates
+
+
+def get_stale_since(data):
+    """Время получения самых старых устаревших данных в ответе (или None, если все данные свежие)."""
+    stale_times = [item['fetched_at'] for item in data.values() if item.get('stale')]
+    return min(stale_times) if stale_times else None
+
+
+_market_cache = MarketDataCache()
+
+def fetch_prices(coin_ids, currency=PIVOT_CURRENCY):
+    """
+    Получает цены и процент изменения за 24ч у источников цен (по умолчанию — в опорной валюте).
+    Возвращает (data, status, retry_after): status — одна из констант FETCH_*,
+    retry_after — пауза в секундах из заголовка Retry-After (или None).
+    Если API недоступен, в data попадают последние удачные данные из кэша с пометкой 'stale'.
+    """
+    if not coin_ids:
+        return {}, FETCH_OK, None
+
+    cached = _market_cache.get_fresh(coin_ids, currency)
+    if cached is not None:
+        return cached, FETCH_OK, None
+
+    import_requests() # Первый запрос — в фоновом потоке загрузки, окно уже показано
+    data, status, retry_after = {}, FETCH_OK, None
+    try:
+        pool = get_provider_pool()
+        data = pool.get_markets(coin_ids, currency)
+        _market_cache.put(data, currency)
+        if pool.last_missing:
+            # Запасные источники знают не все монеты или часть списка не загрузилась: для недостающих запрос не удался
+            print(f"Источники цен не вернули данные по монетам: {', '.join(pool.last_missing)}", file=sys.stderr)
+            status = FETCH_NETWORK_ERROR
+        if _fx_rates.is_due():
+            if _fx_rates.updated_at is None:
+                refresh_fx_rates() # Первые курсы: headless-запись сразу получает итог во всех валютах
+            else:
+                # Прежние курсы пока годятся: медленный CoinGecko не задерживает обновление цен
+                threading.Thread(target=refresh_fx_rates, daemon=True).start()
+    except requests.exceptions.HTTPError as e:
+        print(f"Ошибка сети/API: {e}", file=sys.stderr)
+        response = e.response
+        if response is not None and response.status_code == 429:
+            status, retry_after = FETCH_RATE_LIMITED, parse_retry_after(response.headers.get('Retry-After'))
+        elif response is not None and response.status_code >= 500:
+            status, retry_after = FETCH_SERVER_ERROR, parse_retry_after(response.headers.get('Retry-After'))
+        else:
+            status = FETCH_NETWORK_ERROR
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Ошибка сети/API: {e}", file=sys.stderr)
+        status = FETCH_NETWORK_ERROR
+        
+    return _market_cache.fill_stale(data, coin_ids, currency), status, retry_after
+
+
+_fx_refresh_lock = threading.Lock()
+
+def refresh_fx_rates():
+    """
+    Обновляет таблицу курсов валют; при ошибке остаются прежние курсы, а повтор откладывается.
+    Повторный вызов во время обновления ничего не делает.
+    """
+    if not _fx_refresh_lock.acquire(blocking=False):
+        return
+    import_requests()
+    try:
+        _fx_rates.refresh(get_api_client())
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError, ZeroDivisionError) as e:
+        _fx_rates.on_failure()
+        print(f"Не удалось обновить курсы валют (повтор через {_fx_rates.retry_at - time.time():.0f} сек): {e}", file=sys.stderr)
+    finally:
+        _fx_refresh_lock.release()
+
+
+def get_missing_ids(coin_ids, data):
+    """Монеты без свежих данных в ответе fetch_prices (их нет в ответе или они взяты из кэша с пометкой 'stale')."""
+    return [api_id for api_id in coin_ids if api_id not in data or data[api_id].get('stale')]
+
+
+def save_market_snapshot(data, prices, path=None):
+    """
+    Сохраняет снимок последних данных (ответ fetch_prices в PIVOT_CURRENCY), цен для
+    сравнения и таблицы курсов, чтобы следующий запуск сразу показал таблицу.
+    """
+    path = path or MARKET_SNAPSHOT_FILE
+    fetched_times = [item['fetched_at'] for item in data.values() if 'fetched_at' in item]
+    snapshot = {
+        # Время последнего удачного запроса (не время сохранения: повторное сохранение не "молодит" данные)
+        'fetched_at': max(fetched_times) if fetched_times else time.time(),
+        'currency': PIVOT_CURRENCY,
+        'data': {api_id: {key: value for key, value in item.items() if key != 'stale'} for api_id, item in data.items()},
+        'prices': prices,
+        'fx_rates': _fx_rates.rates,
+        'fx_updated_at': _fx_rates.updated_at
+    }
+    try:
+        write_file_atomic(json.dumps(snapshot), path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Не удалось сохранить снимок данных: {e}", file=sys.stderr)
+
+
+def load_market_snapshot(path=None, max_age_sec=MARKET_CACHE_MAX_STALE_SEC, now=None):
+    """
+    Загружает снимок последних данных: {'data': данные с пометкой 'stale', 'prices', 'fetched_at'}.
+    Данные попадают и в кэш (при сбое первого запроса показываются они), курсы — в таблицу курсов.
+    Слишком старый, чужой или поврежденный снимок игнорируется.
+    """
+    path = path or MARKET_SNAPSHOT_FILE
+    now = time.time() if now is None else now
+    empty = {'data': {}, 'prices': {}, 'fetched_at': None}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        fetched_at = float(snapshot['fetched_at'])
+        if snapshot.get('currency') != PIVOT_CURRENCY or now - fetched_at > max_age_sec:
+            return empty
+        data = {
+            api_id: dict(item, fetched_at=item.get('fetched_at', fetched_at), stale=True)
+            for api_id, item in snapshot['data'].items()
+        }
+        prices = {api_id: float(price) for api_id, price in snapshot.get('prices', {}).items()}
+    except FileNotFoundError:
+        return empty
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        print(f"Не удалось прочитать снимок данных: {e}", file=sys.stderr)
+        return empty
+        
+    _market_cache.restore(data, PIVOT_CURRENCY)
+    if snapshot.get('fx_rates') and _fx_rates.updated_at is None:
+        _fx_rates.rates = dict(snapshot['fx_rates'], **{PIVOT_CURRENCY: 1.0})
+        _fx_rates.updated_at = snapshot.get('fx_updated_at')
+    return {'data': data, 'prices': prices, 'fetched_at': fetched_at}
+
+
+# --- Индекс монет (поиск ID в настройках) ---
+class CoinIndex:
+    """
+    Локальный индекс списка монет CoinGecko (/coins/list, десятки тысяч записей) для
+    автодополнения и проверки ID в окне настроек без запроса в сеть на каждое нажатие.
+    На диске хранится в gzip JSON ([[id, символ, имя], ...]). Поиск по префиксу ID, символа
+    или имени — bisect по отсортированному списку ключей, проверка ID — по словарю.
+    """
+    def __init__(self, coins=(), fetched_at=None):
+        self.fetched_at = fetched_at
+        self.coins = {} # {api_id: (символ, имя)}
+        entries = []
+        for api_id, symbol, name in coins:
+            self.coins[api_id] = (symbol, name)
+            for key in {api_id, symbol.lower(), name.lower()}:
+                entries.append((key, api_id))
+        entries.sort()
+        self.keys = [key for key, _api_id in entries]
+        self.ids = [api_id for _key, api_id in entries]
+
+    def __len__(self):
+        return len(self.coins)
+
+    def __contains__(self, api_id):
+        return api_id in self.coins
+
+    def is_stale(self, now=None):
+        now = time.time() if now is None else now
+        return self.fetched_at is None or now - self.fetched_at > COIN_INDEX_TTL_SEC
+
+    def search(self, text, limit=10):
+        """
+        Монеты, у которых ID, символ или имя начинается с text: [(api_id, символ, имя)].
+        Сначала точные совпадения, затем более короткие ключи.
+        """
+        prefix = text.strip().lower()
+        if not prefix:
+            return []
+        ranks = {}
+        start = bisect_left(self.keys, prefix)
+        for i in range(start, min(len(self.keys), start + COIN_INDEX_SCAN_LIMIT)):
+            key = self.keys[i]
+            if not key.startswith(prefix):
+                break
+            rank = (key != prefix, len(key), key)
+            api_id = self.ids[i]
+            if api_id not in ranks or rank < ranks[api_id]:
+                ranks[api_id] = rank
+        best = sorted(ranks, key=ranks.get)[:limit]
+        return [(api_id,) + self.coins[api_id] for api_id in best]
+
+    def save(self, path=None):
+        rows = [[api_id, symbol, name] for api_id, (symbol, name) in self.coins.items()]
+        payload = json.dumps({'fetched_at': self.fetched_at, 'coins': rows}, ensure_ascii=False, separators=(',', ':'))
+        write_file_atomic(gzip.compress(payload.encode('utf-8')), path or COIN_INDEX_FILE)
+
+    @classmethod
+    def load(cls, path=None):
+        """Индекс с диска (None, если файла нет или он поврежден)."""
+        try:
+            with gzip.open(path or COIN_INDEX_FILE, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+            return cls(data['coins'], data.get('fetched_at'))
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, KeyError, TypeError) as e:
+            print(f"Не удалось прочитать список монет: {e}", file=sys.stderr)
+            return None
+
+    @classmethod
+    def fetch(cls, client=None):
+        """Загружает список монет из API (/coins/list)."""
+        coins = (client or get_api_client()).get_json("coins/list")
+        return cls([(item['id'], item.get('symbol') or '', item.get('name') or '') for item in coins], time.time())
+
+
+def load_coin_index(path=None):
+    """
+    Индекс монет с диска; если его нет или он старше COIN_INDEX_TTL_SEC — загружается из API
+    и сохраняется. При ошибке сети остается прежний (пусть и устаревший) индекс или None.
+    """
+    index = CoinIndex.load(path)
+    if index is not None and not index.is_stale():
+        return index
+        
+    import_requests()
+    try:
+        fresh = CoinIndex.fetch()
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+        print(f"Не удалось обновить список монет: {e}", file=sys.stderr)
+        return index
+    try:
+        fresh.save(path)
+    except OSError as e:
+        print(f"Не удалось сохранить список монет: {e}", file=sys.stderr)
+    return fresh
+
+
+def get_display_currencies(config):
+    """Валюта виджета и дополнительные валюты портфеля (без повторов, валюта виджета первой)."""
+    currencies = []
+    for currency in [config['base_currency']] + list(config.get('display_currencies', [])):
+        currency = currency.strip().lower()
+        if currency and currency not in currencies:
+            currencies.append(currency)
+    return currencies
+
+
+def get_crypto_prices(coin_ids, currency):
+    """Получает цены и процент изменения за 24ч с CoinGecko."""
+    data, _status, _retry_after = fetch_prices(coin_ids, currency)
+    return data
+
+
+def get_coin_refresh_tiers(config):
+    """
+    Интервал обновления (сек) по базовым ID для API-запроса: "refresh_sec" монеты или общий
+    refresh_rate_ms (не меньше REFRESH_MIN_INTERVAL_SEC); у повторов (aptos, aptos_2) — наименьший.
+    """
+    default_sec = config.get('refresh_rate_ms', REFRESH_RATE_MS) / 1000
+    tiers = {}
+    for cid, coin in config['coins'].items():
+        base_id = cid.split('_')[0]
+        tier = max(REFRESH_MIN_INTERVAL_SEC, float(coin.get('refresh_sec') or default_sec))
+        tiers[base_id] = min(tier, tiers.get(base_id, tier))
+    return tiers
+
+
+def get_api_coin_ids(config):
+    """Собирает уникальные базовые ID для API-запроса (aptos_2 → aptos)."""
+    coin_ids = []
+    for cid in config['coins'].keys():
+        base_id = cid.split('_')[0]  # отрезаем "_2", "_3" и т.д.
+        if base_id not in coin_ids:
+            coin_ids.append(base_id)
+    return coin_ids
+
+
+# --- Планировщик обновлений ---
+class RefreshScheduler:
+    """
+    Планировщик запросов к API с учетом лимитов.
+    - Token bucket: не больше REFRESH_BUCKET_CAPACITY запросов подряд, один токен
+      восстанавливается за min_interval секунд (защищает от серий внеочередных обновлений).
+    - Интервал адаптивный: после 429/5xx он увеличивается (до max_interval),
+      после успешных ответов плавно возвращается к базовому.
+    - Retry-After от сервера откладывает следующий запрос как минимум на указанное время.
+    Время следующего запроса (next_fetch_at) используется прогресс-баром.
+    """
+    def __init__(self, base_interval_sec, min_interval_sec=REFRESH_MIN_INTERVAL_SEC, max_interval_sec=REFRESH_MAX_INTERVAL_SEC, bucket_capacity=REFRESH_BUCKET_CAPACITY):
+        self.min_interval = min_interval_sec
+        self.max_interval = max_interval_sec
+        self.capacity = bucket_capacity
+        self.set_base_interval(base_interval_sec)
+        self.interval = self.base_interval
+        
+        now = time.monotonic()
+        self.tokens = float(bucket_capacity)
+        self.last_refill = now
+        self.cycle_started_at = now
+        self.next_fetch_at = now # Первый запрос — сразу
+        self.blocked_until = now # До этого времени запросы запрещены (429/Retry-After)
+
+    def set_base_interval(self, base_interval_sec):
+        self.base_interval = min(self.max_interval, max(self.min_interval, base_interval_sec))
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.last_refill) / self.min_interval)
+        self.last_refill = now
+
+    def schedule(self, delay_sec, now):
+        self.cycle_started_at = now
+        self.next_fetch_at = now + delay_sec
+
+    def is_due(self, now=None):
+        """Пора ли выполнять плановый запрос."""
+        now = time.monotonic() if now is None else now
+        return now >= self.next_fetch_at
+
+    def try_acquire(self, now=None):
+        """
+        Пытается занять токен на запрос. Если токенов нет или сервер попросил подождать,
+        запрос переносится на ближайшее допустимое время и возвращается False.
+        """
+        now = time.monotonic() if now is None else now
+        self.refill(now)
+        
+        if self.tokens < 1:
+            wait = (1 - self.tokens) * self.min_interval
+            self.schedule(max(wait, self.next_fetch_at - now), now)
+            return False
+        if now < self.blocked_until:
+            return False # Действует пауза после 429/5xx, запрос уже назначен на next_fetch_at
+            
+        self.tokens -= 1
+        self.schedule(self.interval, now)
+        return True
+
+    def on_result(self, status, retry_after=None, now=None):
+        """Адаптирует интервал по результату запроса и назначает время следующего."""
+        now = time.monotonic() if now is None else now
+        
+        if status == FETCH_OK:
+            # Плавный возврат к базовому интервалу
+            self.interval = max(self.base_interval, self.interval * 0.75)
+        elif status == FETCH_RATE_LIMITED:
+            self.interval = min(self.max_interval, self.interval * 2)
+        elif status == FETCH_SERVER_ERROR:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+            
+        delay = self.interval
+        if status == FETCH_NETWORK_ERROR:
+            # Пока показываются устаревшие данные, пробуем обновить их раньше обычного
+            delay = min(delay, self.min_interval * 3)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if status != FETCH_OK:
+            # Внеочередные запросы тоже ждут, пока сервер не разрешит
+            self.blocked_until = now + (retry_after if retry_after is not None else self.min_interval)
+        self.schedule(delay, now)
+
+    def seconds_until_next(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.next_fetch_at - now)
+
+    def cycle_length(self):
+        """Длина текущего ожидания (для шкалы прогресс-бара)."""
+        return max(1.0, self.next_fetch_at - self.cycle_started_at)
+
+
+class CoinRefreshQueue:
+    """
+    Очередь обновления монет по сроку (heapq): у каждой монеты свой интервал, а плановый
+    запрос забирает все монеты, срок которых наступил (и наступит в ближайшие
+    REFRESH_BATCH_AHEAD_SEC), — одним запросом. Стабильные монеты с долгим интервалом
+    не расходуют лимит API каждую минуту. Когда можно отправить сам запрос, по-прежнему
+    решает RefreshScheduler. Записи кучи при переносе срока не удаляются, а пропускаются
+    при извлечении (срок в куче не совпадает с due_at).
+    """
+    def __init__(self):
+        self.tiers = {} # {api_id: интервал, сек}
+        self.due_at = {} # {api_id: time.monotonic() следующего обновления}
+        self.heap = [] # [(срок, api_id)]
+
+    def set_tiers(self, tiers, now=None):
+        """Новые монеты обновляются сразу; если интервал монеты сократился, ее срок переносится ближе."""
+        now = time.monotonic() if now is None else now
+        self.tiers = dict(tiers)
+        for api_id in list(self.due_at):
+            if api_id not in self.tiers:
+                del self.due_at[api_id]
+        for api_id, tier in self.tiers.items():
+            due_at = self.due_at.get(api_id)
+            if due_at is None:
+                self.push(api_id, now)
+            elif due_at - now > tier:
+                self.push(api_id, now + tier)
+
+    def push(self, api_id, due_at):
+        self.due_at[api_id] = due_at
+        heapq.heappush(self.heap, (due_at, api_id))
+
+    def mark_due(self, coin_ids, now=None):
+        """Назначает монеты к ближайшему запросу (например, после неудачного)."""
+        now = time.monotonic() if now is None else now
+        for api_id in coin_ids:
+            if api_id in self.tiers:
+                self.push(api_id, now)
+
+    def next_due_at(self):
+        """Срок ближайшей монеты (None, если монет нет)."""
+        while self.heap:
+            due_at, api_id = self.heap[0]
+            if self.due_at.get(api_id) == due_at:
+                return due_at
+            heapq.heappop(self.heap) # Перенесенный срок или удаленная монета
+        return None
+
+    def is_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        due_at = self.next_due_at()
+        return due_at is not None and due_at <= now
+
+    def seconds_until_next(self, now=None):
+        """Сколько секунд до срока ближайшей монеты (None, если монет нет)."""
+        now = time.monotonic() if now is None else now
+        due_at = self.next_due_at()
+        return None if due_at is None else max(0.0, due_at - now)
+
+    def pop_due(self, now=None, ahead_sec=REFRESH_BATCH_AHEAD_SEC):
+        """Забирает монеты для запроса и назначает им следующий срок по их интервалу."""
+        now = time.monotonic() if now is None else now
+        if not self.is_due(now):
+            return []
+        batch = []
+        while True:
+            due_at = self.next_due_at()
+            if due_at is None or due_at > now + ahead_sec:
+                break
+            _due_at, api_id = heapq.heappop(self.heap)
+            batch.append(api_id)
+        for api_id in batch:
+            self.push(api_id, now + self.tiers[api_id])
+        return batch
+
+
+# --- Движок трендов ---
+def get_trend_messages(config):
+    """
+    Уровни сообщений из "trend_messages" конфига ({"3": {"BULLISH": "...", "BEARISH": "..."}}).
+    Уровни с неверной длиной или без текста для обоих направлений пропускаются; если не осталось ни одного — TREND_MESSAGES.
+    """
+    messages = {}
+    for key, texts in (config.get('trend_messages') or {}).items():
+        try:
+            tier = int(key)
+        except (TypeError, ValueError):
+            tier = 0
+        if tier < 1 or not isinstance(texts, dict) or not all(isinstance(texts.get(trend_type), str) for trend_type in ("BULLISH", "BEARISH")):
+            print(f"Пропущен неверный уровень сообщений тренда в конфиге: {key!r}", file=sys.stderr)
+            continue
+        messages[tier] = {trend_type: texts[trend_type] for trend_type in ("BULLISH", "BEARISH")}
+    return messages or TREND_MESSAGES
+
+
+def get_trend_message(series_length, trend_type, messages=TREND_MESSAGES):
+    """Возвращает сообщение самого старшего уровня messages (см. get_trend_messages), не превышающего длину серии."""
+    tiers = [tier for tier in messages if tier <= series_length]
+    tier = max(tiers) if tiers else min(messages)
+    return messages[tier][trend_type]
+
+
+class TrendEngine:
+    """
+    Инкрементальный подсчет серий трендов (без Tk).
+    По каждой монете хранится кольцевой буфер последних history_size значков
+    и счетчик длины текущей серии одинаковых ▲/▼, поэтому новая точка
+    обрабатывается за O(1), без перебора всей истории.
+    """
+    TREND_ICONS = ('▲', '▼')
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.history_size = max(1, int(history_size))
+        self.history = {} # {api_id: deque([('▲', 'green'), ...], maxlen=history_size)}
+        self.runs = {} # {api_id: (значок, длина текущей серии)}
+
+    def load(self, trend_history):
+        """Заполняет буферы из сохраненной истории {api_id: [(значок, цвет), ...]}."""
+        for api_id, history in trend_history.items():
+            self.history[api_id] = deque(maxlen=self.history_size)
+            self.runs[api_id] = (None, 0)
+            for forecast_tuple in history:
+                self.push(api_id, forecast_tuple)
+
+    def set_coins(self, coin_ids):
+        """Оставляет историю только для монет из списка (новые начинаются с пустой истории)."""
+        coin_ids = set(coin_ids)
+        for api_id in list(self.history):
+            if api_id not in coin_ids:
+                del self.history[api_id]
+                del self.runs[api_id]
+        for api_id in coin_ids:
+            if api_id not in self.history:
+                self.history[api_id] = deque(maxlen=self.history_size)
+                self.runs[api_id] = (None, 0)
+
+    def resize(self, history_size):
+        """Меняет длину истории, сохраняя последние значки."""
+        history_size = max(1, int(history_size))
+        if history_size == self.history_size:
+            return
+        self.history_size = history_size
+        self.load({api_id: list(history) for api_id, history in self.history.items()})
+
+    def push(self, api_id, forecast_tuple):
+        """
+        Добавляет новый значок тренда и возвращает (значок, длина серии).
+        Длина серии — сколько последних значков подряд равны ▲ (или ▼), но не больше history_size;
+        для ▬ серия равна 0.
+        """
+        if api_id not in self.history:
+            self.history[api_id] = deque(maxlen=self.history_size)
+        self.history[api_id].append(forecast_tuple)
+        
+        icon = forecast_tuple[0]
+        last_icon, run_length = self.runs.get(api_id, (None, 0))
+        if icon not in self.TREND_ICONS:
+            run_length = 0
+        elif icon == last_icon:
+            run_length += 1
+        else:
+            run_length = 1
+        self.runs[api_id] = (icon, run_length)
+        
+        return icon, min(run_length, self.history_size)
+
+    def get_streak(self, api_id):
+        """Текущая серия монеты: (значок, длина) без добавления новой точки."""
+        icon, run_length = self.runs.get(api_id, (None, 0))
+        return icon, min(run_length, self.history_size)
+
+    def get_history(self, api_id):
+        """Последние значки тренда монеты (от старых к новым)."""
+        return list(self.history.get(api_id, ()))
+
+
+# --- Расчет портфеля и сигналов ---
+class SignalEngine:
+    """
+    Отбор сигналов трендов для уведомлений (без Tk).
+    По каждой монете помнится последний отправленный сигнал: направление, длина серии и время.
+      * Усиление (серия в том же направлении стала длиннее) отправляется сразу.
+      * Повтор (та же или более короткая серия) — не раньше чем через cooldown_sec.
+      * Гистерезис: новая серия (первый сигнал или смена направления) начинается, только если
+        изменение больше порога в (1 + hysteresis) раз, а закрывается уже при обратном
+        изменении больше порога. Поэтому колебания цены около порога не дают поток уведомлений.
+    """
+    def __init__(self, cooldown_sec=SIGNAL_COOLDOWN_SEC, hysteresis=SIGNAL_HYSTERESIS):
+        self.cooldown_sec = cooldown_sec
+        self.hysteresis = hysteresis
+        self.state = {} # {api_id: (направление, длина серии, время отправки)}
+
+    def configure(self, config):
+        self.cooldown_sec = max(0, config.get('signal_cooldown_sec', SIGNAL_COOLDOWN_SEC))
+        self.hysteresis = max(0.0, config.get('signal_hysteresis', SIGNAL_HYSTERESIS))
+
+    def set_coins(self, coin_ids):
+        """Забывает состояние монет, которых больше нет в списке."""
+        coin_ids = set(coin_ids)
+        for api_id in list(self.state):
+            if api_id not in coin_ids:
+                del self.state[api_id]
+
+    def accept(self, signal, threshold, now):
+        """Решает, отправлять ли сигнал, и обновляет состояние монеты."""
+        api_id = signal['api_id']
+        trend_type = signal['trend_type']
+        series_length = signal['series_length']
+        last = self.state.get(api_id)
+        
+        if last is None or last[0] != trend_type:
+            # Новая серия: нужен запас над порогом. Слабое обратное движение только закрывает старую серию.
+            if abs(signal['change_percent']) < threshold * (1 + self.hysteresis):
+                self.state.pop(api_id, None)
+                return False
+        elif series_length <= last[1] and now - last[2] < self.cooldown_sec:
+            return False # Повтор в пределах паузы
+        
+        self.state[api_id] = (trend_type, series_length, now)
+        return True
+
+    def filter(self, signals, threshold, now=None):
+        """Оставляет из signals только те, о которых нужно уведомить (порядок сохраняется)."""
+        now = time.time() if now is None else now
+        return [signal for signal in signals if self.accept(signal, threshold, now)]
+
+
+def calculate_change_percent(current_price, prev_price, threshold):
+    """Изменение цены с прошлого обновления: (процент, текст, цвет)."""
+    if prev_price is None or prev_price == 0:
+        return 0.0, "(0.00%)", "gray" 
+        
+    try:
+        change = ((current_price - prev_price) / prev_price) * 100
+
+        if change > threshold:
+            color = 'green'
+            prefix = '+'
+        elif change < -threshold:
+            color = 'red'
+            prefix = ''
+        else:
+            color = 'gray'
+            prefix = ''
+            
+        return change, f"({prefix}{change:.2f}%)", color
+    except Exception:
+        return 0.0, "(0.00%)", "gray"
+
+
+def get_forecast_tuple(change_percent, threshold):
+    """Значок тренда для изменения цены: ('▲', 'green'), ('▼', 'red') или ('▬', 'gray')."""
+    if change_percent > threshold: return ("▲", "green")
+    elif change_percent < -threshold: return ("▼", "red")
+    else: return ("▬", "gray") 
+
+
+def roll_prev_prices(prev_prices, current_prices, updated_ids=None):
+    """
+    Цены для сравнения на следующем обновлении: по обновленным монетам (базовые ID, None — все)
+    берутся текущие цены, у остальных остается прежняя база, чтобы их изменение не обнулялось.
+    """
+    if updated_ids is None:
+        return dict(current_prices)
+    updated_ids = set(updated_ids)
+    prev_prices = dict(prev_prices)
+    prev_prices.update({api_id: price for api_id, price in current_prices.items() if api_id.split('_')[0] in updated_ids})
+    return prev_prices
+
+
+def evaluate_portfolio(config, data, prev_prices, trend_engine=None, coin_order=None, fx_rates=None, signal_engine=None, updated_ids=None):
+    """
+    Считает стоимость портфеля и сигналы трендов по данным одного обновления.
+    data — ответ fetch_prices в PIVOT_CURRENCY, prev_prices — цены прошлого обновления
+    {api_id: цена в PIVOT_CURRENCY}. Цены и стоимость пересчитываются в валюту виджета
+    (base_currency), итог портфеля — во все валюты get_display_currencies по таблице fx_rates.
+    Пока курса валюты виджета нет (курсы еще не загружены), цены показываются в PIVOT_CURRENCY.
+    Если передан trend_engine, по монетам с известной прошлой ценой в историю добавляется
+    новая точка тренда и собираются сигналы (серии ▲/▼ длиной от 1). Если передан signal_engine,
+    в 'signals' остаются только сигналы, прошедшие его отбор (без повторов и с паузой).
+    updated_ids — базовые ID монет, обновленных этим запросом (None — все): точки тренда
+    и 'fresh_prices' только по ним, остальные монеты лишь пересчитываются.
+    Возвращает словарь:
+      'coins': {api_id: {...}} — данные строки (price = None, если данных по монете нет),
+      'prices': {api_id: цена в PIVOT_CURRENCY}, 'fresh_prices' — обновленные монеты без устаревших данных из кэша,
+      'currency' — валюта цен и стоимости (base_currency или PIVOT_CURRENCY без курса),
+      'total_value' (в 'currency'), 'totals': {валюта: стоимость или None, если курса нет},
+      'new_trends': {api_id: (значок, цвет)},
+      'signals': список сигналов, отсортированный по силе изменения.
+    """
+    currencies = get_display_currencies(config)
+    fx_rates = get_fx_rates() if fx_rates is None else fx_rates
+    if currencies[0] not in fx_rates.rates:
+        # Курса нет: цены в валюте ответа API лучше пустой таблицы
+        currencies = [PIVOT_CURRENCY] + [c for c in currencies if c != PIVOT_CURRENCY]
+    currency = currencies[0] # Валюта виджета
+    threshold = config.get('trend_threshold_percent', 0.01)
+    coin_order = list(config['coins'].keys()) if coin_order is None else coin_order
+    updated_ids = None if updated_ids is None else set(updated_ids)
+    totals = {c: (0.0 if c in fx_rates.rates else None) for c in currencies} # None — курс валюты неизвестен
+    
+    coins = {}
+    prices = {}
+    new_trends = {}
+    signals = []
+    
+    for api_id in coin_order:
+        coin_data = config['coins'].get(api_id, {"name": api_id.upper(), "amount": 0.0})
+        display_name = coin_data.get('name', api_id.upper())
+        amount = coin_data.get('amount', 0.0)
+        
+        coin = {
+            'name': display_name,
+            'amount': amount,
+            'price': None,
+            'value': 0.0
+        }
+        coins[api_id] = coin
+        
+        base_id = api_id.split('_')[0]
+        if base_id not in data or PIVOT_CURRENCY not in data[base_id]:
+            continue
+            
+        pivot_price = data[base_id][PIVOT_CURRENCY]
+        price = fx_rates.convert(pivot_price, currency)
+        if price is None:
+            continue # Нет курса для валюты виджета
+        prices[api_id] = pivot_price
+        
+        try:
+            coin['value'] = amount * price
+            for total_currency, total in totals.items():
+                if total is not None:
+                    totals[total_currency] = total + fx_rates.convert(amount * pivot_price, total_currency)
+        except Exception:
+            pass
+            
+        # Изменение считается в опорной валюте, поэтому смена валюты виджета не искажает тренд
+        prev_price = prev_prices.get(api_id)
+        change_percent, change_str, change_color = calculate_change_percent(pivot_price, prev_price, threshold)
+        current_forecast_tuple = get_forecast_tuple(change_percent, threshold)
+        
+        coin.update({
+            'price': price,
+            'change_24h': data[base_id].get("change_24h", 0.0) or 0.0,
+            'stale': bool(data[base_id].get('stale')),
+            'change_percent': change_percent,
+            'change_text': change_str,
+            'change_color': change_color
+        })
+
+        # Устаревшие данные (из кэша при сбое API) и монеты, не вошедшие в запрос, не добавляют точку тренда
+        updated = updated_ids is None or base_id in updated_ids
+        coin['updated'] = updated
+        if prev_price is not None and trend_engine is not None and updated and not data[base_id].get('stale'):
+            # Обновляем историю и длину текущей серии одинаковых индикаторов (O(1))
+            trend_icon, max_series_length = trend_engine.push(api_id, current_forecast_tuple)
+            new_trends[api_id] = current_forecast_tuple
+
+            # СБОР СИГНАЛА вместо отправки уведомления
+            if max_series_length >= 1:
+                signals.append({
+                    'api_id': api_id,
+                    'coin_name': display_name,
+                    'trend_type': "BULLISH" if trend_icon == '▲' else "BEARISH",
+                    'series_length': max_series_length,
+                    'change_percent': change_percent
+                })
+                
+    signals.sort(key=lambda s: abs(s['change_percent']), reverse=True)
+    if signal_engine is not None:
+        signals = signal_engine.filter(signals, threshold)
+    
+    return {
+        'coins': coins,
+        'prices': prices,
+        'fresh_prices': {api_id: price for api_id, price in prices.items() if coins[api_id]['updated'] and not coins[api_id]['stale']},
+        'currency': currency,
+        'total_value': totals[currency],
+        'totals': totals,
+        'new_trends': new_trends,
+        'signals': signals
+    }
+
+
+# --- Хранилище истории трендов ---
+class TrendStore:
+    """
+    Хранит на диске (SQLite) цены и значки тренда по каждой монете, чтобы после
+    перезапуска (автозапуск, сбой) тренд 5x продолжался, а не начинался с нуля.
+    Записи добавляются одной транзакцией на каждое обновление, база периодически
+    сжимается до HISTORY_KEEP_TICKS последних записей по монете; более старые цены
+    прореживаются до одной в час и хранятся HISTORY_KEEP_THIN_SEC (для аналитики за 7 дней).
+    Ошибки диска не мешают работе виджета: они выводятся в консоль, история остается в памяти.
+    """
+    def __init__(self, path=None):
+        path = path or HISTORY_DB_FILE
+        self.path = path
+        self.conn = None
+        self.writes_since_compact = 0
+        
+        try:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS ticks ("
+                    "api_id TEXT NOT NULL, ts REAL NOT NULL, currency TEXT NOT NULL, price REAL NOT NULL)"
+                )
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS trends ("
+                    "api_id TEXT NOT NULL, ts REAL NOT NULL, icon TEXT NOT NULL, color TEXT NOT NULL)"
+                )
+                self.conn.execute("CREATE INDEX IF NOT EXISTS ticks_coin_ts ON ticks (api_id, ts)")
+                self.conn.execute("CREATE INDEX IF NOT EXISTS trends_coin_ts ON trends (api_id, ts)")
+        except sqlite3.Error as e:
+            print(f"Не удалось открыть базу истории '{path}': {e}", file=sys.stderr)
+            self.conn = None
+
+    def load(self, coin_ids, currency, history_size=HISTORY_SIZE):
+        """
+        Загружает последнюю известную цену (если она не старше HISTORY_PREV_PRICE_MAX_AGE_SEC)
+        и последние history_size значков тренда по каждой монете.
+        Возвращает (prev_prices, trend_history).
+        """
+        prev_prices = {}
+        trend_history = {api_id: [] for api_id in coin_ids}
+        if self.conn is None:
+            return prev_prices, trend_history
+            
+        min_ts = time.time() - HISTORY_PREV_PRICE_MAX_AGE_SEC
+        try:
+            for api_id in coin_ids:
+                row = self.conn.execute(
+                    "SELECT price FROM ticks WHERE api_id = ? AND currency = ? AND ts >= ? ORDER BY ts DESC LIMIT 1",
+                    (api_id, currency, min_ts)
+                ).fetchone()
+                if row is not None:
+                    prev_prices[api_id] = row[0]
+                    
+                rows = self.conn.execute(
+                    "SELECT icon, color FROM trends WHERE api_id = ? ORDER BY ts DESC LIMIT ?",
+                    (api_id, history_size)
+                ).fetchall()
+                trend_history[api_id] = [(icon, color) for icon, color in reversed(rows)]
+        except sqlite3.Error as e:
+            print(f"Ошибка чтения базы истории: {e}", file=sys.stderr)
+            
+        return prev_prices, trend_history
+
+    def record_refresh(self, prices, trends, currency, ts=None):
+        """Записывает результаты одного обновления: {api_id: цена} и {api_id: (значок, цвет)}."""
+        if self.conn is None or (not prices and not trends):
+            return
+        ts = time.time() if ts is None else ts
+        
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO ticks (api_id, ts, currency, price) VALUES (?, ?, ?, ?)",
+                    [(api_id, ts, currency, price) for api_id, price in prices.items()]
+                )
+                self.conn.executemany(
+                    "INSERT INTO trends (api_id, ts, icon, color) VALUES (?, ?, ?, ?)",
+                    [(api_id, ts, icon, color) for api_id, (icon, color) in trends.items()]
+                )
+        except sqlite3.Error as e:
+            print(f"Ошибка записи в базу истории: {e}", file=sys.stderr)
+            return
+            
+        self.writes_since_compact += 1
+        if self.writes_since_compact >= HISTORY_COMPACT_EVERY:
+            self.compact()
+
+    def load_price_history(self, currency, since_ts, step_sec):
+        """
+        Цены в currency не старше since_ts, по одной (последней) на монету за каждый отрезок step_sec:
+        список (api_id, ts, цена) по возрастанию ts. Прореживает сама SQLite, поэтому
+        поминутная история тысяч монет не превращается в миллионы строк в Python.
+        """
+        if self.conn is None:
+            return []
+        try:
+            # Для MAX(ts) SQLite берет price из той же строки, т.е. последнюю цену в отрезке
+            return self.conn.execute(
+                "SELECT api_id, MAX(ts), price FROM ticks WHERE currency = ? AND ts >= ? "
+                "GROUP BY api_id, CAST(ts / ? AS INTEGER) ORDER BY 2",
+                (currency, since_ts, step_sec)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка чтения базы истории: {e}", file=sys.stderr)
+            return []
+
+    def compact(self, keep=HISTORY_KEEP_TICKS, keep_thin_sec=HISTORY_KEEP_THIN_SEC):
+        """
+        Удаляет старые записи, оставляя не больше keep последних по каждой монете.
+        Из более старых цен остается последняя за каждый HISTORY_THIN_STEP_SEC, если она не старше keep_thin_sec.
+        """
+        if self.conn is None:
+            return
+        self.writes_since_compact = 0
+        
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM ticks WHERE rowid IN ("
+                    "SELECT rowid FROM (SELECT rowid, ts, "
+                    "ROW_NUMBER() OVER (PARTITION BY api_id ORDER BY ts DESC) AS rn, "
+                    "ROW_NUMBER() OVER (PARTITION BY api_id, currency, CAST(ts / ? AS INTEGER) ORDER BY ts DESC) AS step_rn "
+                    "FROM ticks) "
+                    "WHERE rn > ? AND (step_rn > 1 OR ts < ?))",
+                    (HISTORY_THIN_STEP_SEC, keep, time.time() - keep_thin_sec)
+                )
+                self.conn.execute(
+                    "DELETE FROM trends WHERE rowid IN ("
+                    "SELECT rowid FROM (SELECT rowid, ROW_NUMBER() OVER (PARTITION BY api_id ORDER BY ts DESC) AS rn FROM trends) "
+                    "WHERE rn > ?)",
+                    (keep,)
+                )
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            print(f"Ошибка сжатия базы истории: {e}", file=sys.stderr)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# --- Аналитика портфеля (NumPy) ---
+def import_numpy():
+    """NumPy (необязательная зависимость) или None, если он не установлен."""
+    try:
+        return timed_import('numpy')
+    except ImportError:
+        return None
+
+
+def fill_price_gaps(np, prices):
+    """
+    Заполняет пропуски (NaN) в матрице цен монеты × время: последней известной ценой,
+    а до первой цены монеты — первой известной (чтобы появление монеты не выглядело скачком стоимости).
+    """
+    coin_count, length = prices.shape
+    if not length:
+        return prices
+    known = ~np.isnan(prices)
+    last_known = np.where(known, np.arange(length), 0)
+    np.maximum.accumulate(last_known, axis=1, out=last_known)
+    rows = np.arange(coin_count)
+    filled = prices[rows[:, None], last_known]
+    first_price = prices[rows, known.argmax(axis=1)]
+    return np.where(np.isnan(filled), first_price[:, None], filled)
+
+
+class PortfolioAnalytics:
+    """
+    Аналитика портфеля по истории цен в массивах NumPy: количества монет — вектор,
+    история — матрица монеты × отрезки по ANALYTICS_BUCKET_SEC (кольцевой буфер на самое длинное окно
+    и шаг прореживания базы истории, чтобы у окна всегда была цена на его начало).
+    evaluate() за один проход считает стоимость, доли монет, прибыль/убыток за окна
+    ANALYTICS_WINDOWS и просадку стоимости текущего портфеля на этой истории.
+    Все суммы — в PIVOT_CURRENCY, как и цены в истории.
+    """
+    def __init__(self, np, bucket_sec=ANALYTICS_BUCKET_SEC, windows=ANALYTICS_WINDOWS):
+        self.np = np
+        self.bucket_sec = bucket_sec
+        self.windows = windows
+        self.history_sec = max(seconds for _name, seconds in windows) + HISTORY_THIN_STEP_SEC
+        self.capacity = int(self.history_sec // bucket_sec) + 2
+        self.coin_ids = []
+        self.rows = {}
+        self.amounts = np.zeros(0)
+        self.prices = np.full((0, self.capacity), np.nan)
+        self.times = np.full(self.capacity, np.nan) # Время последней цены в отрезке
+        self.head = -1 # Столбец последнего отрезка (-1 — истории нет)
+
+    def set_holdings(self, config):
+        """Берет монеты и количества из конфига; история монет, оставшихся в портфеле, сохраняется."""
+        np = self.np
+        coin_ids = list(config['coins'])
+        prices = np.full((len(coin_ids), self.capacity), np.nan)
+        for row, api_id in enumerate(coin_ids):
+            old_row = self.rows.get(api_id)
+            if old_row is not None:
+                prices[row] = self.prices[old_row]
+                
+        self.coin_ids = coin_ids
+        self.rows = {api_id: row for row, api_id in enumerate(coin_ids)}
+        self.amounts = np.array([float(config['coins'][api_id].get('amount') or 0.0) for api_id in coin_ids])
+        self.prices = prices
+
+    def load_history(self, rows):
+        """
+        Заполняет историю записями TrendStore.load_price_history (api_id, ts, цена).
+        Записи один раз раскладываются в массивы, дальше разбор по отрезкам идет операциями NumPy.
+        """
+        np = self.np
+        coin_rows = np.array([self.rows.get(row[0], -1) for row in rows], dtype=np.int64)
+        times = np.array([row[1] for row in rows], dtype=float)
+        prices = np.array([row[2] for row in rows], dtype=float)
+        known = coin_rows >= 0
+        coin_rows, times, prices = coin_rows[known], times[known], prices[known]
+        if not len(times):
+            return
+            
+        # Записи идут по возрастанию ts, поэтому и номера отрезков не убывают
+        buckets = (times // self.bucket_sec).astype(np.int64)
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+        kept_buckets = buckets[starts][-self.capacity:]
+        columns = np.searchsorted(kept_buckets, buckets)
+        inside = buckets >= kept_buckets[0]
+        coin_rows, columns, times, prices = coin_rows[inside], columns[inside], times[inside], prices[inside]
+        
+        # В отрезке остается последняя цена монеты
+        cells = (coin_rows * len(kept_buckets) + columns)[::-1]
+        _cells, first = np.unique(cells, return_index=True)
+        latest = len(cells) - 1 - first
+        
+        history = np.full((len(self.coin_ids), len(kept_buckets)), np.nan)
+        history[coin_rows[latest], columns[latest]] = prices[latest]
+        bucket_times = np.full(len(kept_buckets), -np.inf)
+        np.maximum.at(bucket_times, columns, times)
+        
+        self.prices[:] = np.nan
+        self.times[:] = np.nan
+        self.prices[:, :len(kept_buckets)] = fill_price_gaps(np, history)
+        self.times[:len(kept_buckets)] = bucket_times
+        self.head = len(kept_buckets) - 1
+
+    def record(self, prices, ts=None):
+        """
+        Добавляет цены одного обновления {api_id: цена в PIVOT_CURRENCY}.
+        В пределах отрезка новая цена заменяет прежнюю; монеты без цены (другой интервал
+        обновления) сохраняют цену из предыдущего отрезка.
+        """
+        np = self.np
+        ts = time.time() if ts is None else ts
+        bucket = ts // self.bucket_sec
+        if self.head >= 0:
+            head_bucket = self.times[self.head] // self.bucket_sec
+            if bucket < head_bucket:
+                return # Цены старее истории (часы перевели назад) не записываем
+        if self.head < 0 or bucket > head_bucket:
+            previous = self.head
+            self.head = (self.head + 1) % self.capacity
+            self.prices[:, self.head] = self.prices[:, previous] if previous >= 0 else np.nan
+        self.times[self.head] = ts
+        
+        rows = [self.rows[api_id] for api_id in prices if api_id in self.rows]
+        if rows:
+            self.prices[rows, self.head] = [prices[api_id] for api_id in prices if api_id in self.rows]
+
+    def evaluate(self):
+        """
+        Считает аналитику по последним записанным ценам. Возвращает None, пока истории нет, иначе
+        {'total_value', 'weights': {api_id: доля}, 'pnl': {окно: {'value', 'percent', 'coins': {api_id: сумма}} или None},
+        'drawdown', 'max_drawdown'} (просадки в процентах от максимума стоимости, <= 0).
+        Окно равно None, если история короче окна.
+        """
+        np = self.np
+        if self.head < 0 or not self.coin_ids:
+            return None
+            
+        order = (np.arange(self.capacity) + self.head + 1) % self.capacity
+        order = order[~np.isnan(self.times[order])]
+        times = self.times[order]
+        prices = self.prices[:, order]
+        # record() переносит цены вперед, поэтому пропуски бывают только до первой цены монеты
+        gaps = np.flatnonzero(np.isnan(prices).any(axis=1))
+        if len(gaps):
+            prices[gaps] = np.nan_to_num(fill_price_gaps(np, prices[gaps])) # Монеты без единой цены не влияют на стоимость
+            
+        values = self.amounts @ prices # Стоимость текущего портфеля в каждом отрезке
+        current = self.amounts * prices[:, -1]
+        total = values[-1]
+        weights = current / total if total > 0 else np.zeros_like(current)
+        
+        pnl = {}
+        for name, seconds in self.windows:
+            column = np.searchsorted(times, times[-1] - seconds, side='right') - 1
+            if column < 0:
+                pnl[name] = None
+                continue
+            past = values[column]
+            pnl[name] = {
+                'value': float(total - past),
+                'percent': float((total - past) / past * 100) if past > 0 else None,
+                'coins': dict(zip(self.coin_ids, (current - self.amounts * prices[:, column]).tolist()))
+            }
+            
+        peaks = np.maximum.accumulate(values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drawdowns = np.where(peaks > 0, values / peaks - 1, 0.0) * 100
+            
+        return {
+            'total_value': float(total),
+            'weights': dict(zip(self.coin_ids, weights.tolist())),
+            'pnl': pnl,
+            'drawdown': float(drawdowns[-1]),
+            'max_drawdown': float(drawdowns.min())
+        }
+
+
+def create_portfolio_analytics(config, trend_store=None):
+    """
+    Создает PortfolioAnalytics с портфелем из конфига и историей из trend_store
+    (импорт NumPy и чтение истории заметно долгие: окно вызывает это в фоновом потоке).
+    Без NumPy возвращает None: виджет и headless-режим работают как раньше, без аналитики.
+    """
+    np = import_numpy()
+    if np is None:
+        # В stderr, чтобы не портить JSON Lines в stdout headless-режима
+        print("NumPy не установлен: аналитика портфеля отключена (pip install numpy)", file=sys.stderr)
+        return None
+        
+    analytics = PortfolioAnalytics(np)
+    analytics.set_holdings(config)
+    if trend_store is not None:
+        since = time.time() - analytics.history_sec
+        analytics.load_history(trend_store.load_price_history(PIVOT_CURRENCY, since, analytics.bucket_sec))
+    return analytics
+
+
+# --- Фоновая загрузка цен ---
+class PriceFetchWorker(threading.Thread):
+    """
+    Фоновый поток для запросов к API.
+    Задания приходят через очередь jobs, результаты складываются в очередь results,
+    которую основной поток Tkinter разбирает через after(). Так окно не замирает,
+    пока CoinGecko отвечает медленно.
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+
+    def submit(self, coin_ids, currency):
+        """Ставит запрос цен в очередь (вызывается из основного потока)."""
+        self.jobs.put((list(coin_ids), currency))
+
+    def stop(self):
+        self.jobs.put(None)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            # Если пока шел запрос накопилось несколько заданий, выполняем только последнее
+            try:
+                while True:
+                    newer_job = self.jobs.get_nowait()
+                    if newer_job is None:
+                        return
+                    job = newer_job
+            except queue.Empty:
+                pass
+
+            coin_ids, currency = job
+            try:
+                data, status, retry_after = fetch_prices(coin_ids, currency)
+            except Exception as e:
+                # Поток загрузки один: непредвиденная ошибка не должна его остановить,
+                # а окно должно получить ответ, иначе новый запрос никогда не уйдет
+                print(f"Непредвиденная ошибка загрузки цен: {e!r}", file=sys.stderr)
+                data, status, retry_after = _market_cache.fill_stale({}, coin_ids, currency), FETCH_NETWORK_ERROR, None
+            self.results.put((coin_ids, currency, data, status, retry_after))
+
+
+# --- Потоковые цены (WebSocket) ---
+def parse_price_ticks(message, coin_ids, received_at):
+    """
+    Разбирает сообщение потока в формате CoinCap ({"bitcoin": "60000.12", ...}, цены в PIVOT_CURRENCY).
+    Возвращает {api_id: (цена, время получения)} только по запрошенным монетам.
+    """
+    ticks = {}
+    for api_id, price in json.loads(message).items():
+        if api_id in coin_ids:
+            ticks[api_id] = (float(price), received_at)
+    return ticks
+
+
+def merge_price_ticks(data, ticks, now=None):
+    """
+    Вписывает цены из потока в данные fetch_prices (на месте) и возвращает data.
+    Цена из потока заменяет цену из ответа API, только если она новее; изменение за 24ч
+    и прочие поля остаются от последнего запроса. Устаревшие данные (кэш при сбое API)
+    перестают считаться устаревшими, только если цена из потока моложе STREAM_STALE_SEC.
+    """
+    now = time.time() if now is None else now
+    for api_id, (price, received_at) in ticks.items():
+        item = data.get(api_id)
+        if item is not None and item.get('fetched_at', 0) > received_at:
+            continue
+        stale = item is not None and item.get('stale') and now - received_at > STREAM_STALE_SEC
+        item = {key: value for key, value in (item or {}).items() if key != 'stale'}
+        item.update({PIVOT_CURRENCY: price, 'fetched_at': received_at})
+        if stale:
+            item['stale'] = True
+        data[api_id] = item
+    return data
+
+
+class PriceStreamWorker(threading.Thread):
+    """
+    Фоновый поток, получающий цены по WebSocket (необязательная библиотека websocket-client).
+    Каждое сообщение складывается в очередь ticks как {api_id: (цена, время)}; основной поток
+    разбирает ее через after() вместе с результатами PriceFetchWorker. При обрыве соединения
+    поток переподключается с растущей паузой, а виджет, пока поток не живой (is_live), получает
+    цены обычными запросами REST. Без websocket-client поток сразу завершается.
+    """
+    def __init__(self, url):
+        super().__init__(daemon=True)
+        self.url = url
+        self.ticks = queue.Queue()
+        self.coin_ids = ()
+        self.connection = None
+        self.last_message_at = None # time.monotonic() последнего сообщения
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def set_coins(self, coin_ids):
+        """Меняет список монет (вызывается из основного потока): соединение переоткрывается с новым списком."""
+        coin_ids = tuple(sorted(coin_ids))
+        with self.lock:
+            if coin_ids == self.coin_ids:
+                return
+            self.coin_ids = coin_ids
+            connection = self.connection
+        if connection is not None:
+            connection.abort() # Будит recv() в потоке, который сам переподключится
+
+    def stop(self):
+        self.stop_event.set()
+        with self.lock:
+            connection = self.connection
+        if connection is not None:
+            connection.abort()
+
+    def is_live(self, now=None):
+        """Соединение открыто и сообщения приходили не позже STREAM_STALE_SEC назад."""
+        now = time.monotonic() if now is None else now
+        return self.connection is not None and self.last_message_at is not None and now - self.last_message_at <= STREAM_STALE_SEC
+
+    def get_stream_url(self, coin_ids):
+        separator = '&' if '?' in self.url else '?'
+        return f"{self.url}{separator}assets={','.join(coin_ids)}"
+
+    def run(self):
+        try:
+            websocket = timed_import('websocket')
+        except ImportError:
+            print("Библиотека websocket-client не установлена: цены обновляются только запросами к API", file=sys.stderr)
+            return
+            
+        delay = STREAM_RECONNECT_MIN_SEC
+        while not self.stop_event.is_set():
+            coin_ids = self.coin_ids
+            if not coin_ids:
+                self.stop_event.wait(1)
+                continue
+                
+            try:
+                connection = websocket.create_connection(self.get_stream_url(coin_ids), timeout=STREAM_STALE_SEC)
+                with self.lock:
+                    self.connection = connection
+                    
+                while not self.stop_event.is_set() and coin_ids == self.coin_ids:
+                    message = connection.recv()
+                    self.last_message_at = time.monotonic()
+                    delay = STREAM_RECONNECT_MIN_SEC # Соединение рабочее: следующий обрыв — снова с короткой паузы
+                    ticks = parse_price_ticks(message, coin_ids, time.time())
+                    if ticks:
+                        self.ticks.put(ticks)
+            except (websocket.WebSocketException, OSError, ValueError, TypeError, AttributeError) as e:
+                if not self.stop_event.is_set() and coin_ids == self.coin_ids:
+                    print(f"Поток цен прерван: {e}", file=sys.stderr)
+            finally:
+                with self.lock:
+                    connection, self.connection = self.connection, None
+                if connection is not None:
+                    connection.close()
+                    
+            if coin_ids == self.coin_ids:
+                # Обрыв (а не смена списка монет): переподключаемся с растущей паузой
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, STREAM_RECONNECT_MAX_SEC)
+
+        
+
+
+# --- Режим без интерфейса (headless) ---
+def build_headless_record(config, result, status, trend_engine, analytics=None):
+    """Формирует одну JSON-запись о результате обновления (analytics — результат PortfolioAnalytics.evaluate)."""
+    coins = {}
+    for api_id, coin in result['coins'].items():
+        coins[api_id] = {
+            'name': coin['name'],
+            'amount': coin['amount'],
+            'price': coin['price'],
+            'value': coin['value'],
+            'change_percent': coin.get('change_percent'),
+            'change_24h': coin.get('change_24h'),
+            'stale': coin.get('stale', False),
+            'trend': ''.join(icon for icon, _color in trend_engine.get_history(api_id))
+        }
+        if analytics is not None:
+            coins[api_id]['weight'] = analytics['weights'].get(api_id)
+            coins[api_id]['pnl'] = {
+                name: window['coins'].get(api_id) if window else None
+                for name, window in analytics['pnl'].items()
+            }
+            
+    record = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'status': status,
+        'currency': result['currency'],
+        'latency_ms': get_provider_pool().last_latency_ms,
+        'provider': get_provider_pool().last_provider,
+        'total_value': result['total_value'],
+        'totals': result['totals'],
+        'coins': coins,
+        'signals': result['signals']
+    }
+    if analytics is not None:
+        # Суммы аналитики — в PIVOT_CURRENCY, как цены в истории
+        record['analytics'] = {
+            'currency': PIVOT_CURRENCY,
+            'total_value': analytics['total_value'],
+            'pnl': {
+                name: {'value': window['value'], 'percent': window['percent']} if window else None
+                for name, window in analytics['pnl'].items()
+            },
+            'drawdown': analytics['drawdown'],
+            'max_drawdown': analytics['max_drawdown']
+        }
+    return record
+
+
+def run_headless(config_path=None, output_path=None, history_db=HISTORY_DB_FILE, once=False):
+    """
+    Запускает цикл загрузки цен, расчета портфеля и трендов без окна.
+    После каждого обновления выводит одну строку JSON в stdout (или дописывает в output_path).
+    """
+    config = load_config(config_path)
+    configure_api(config)
+    
+    tiers = get_coin_refresh_tiers(config)
+    refresh_queue = CoinRefreshQueue()
+    refresh_queue.set_tiers(tiers)
+    scheduler = RefreshScheduler(min(tiers.values(), default=config.get('refresh_rate_ms', REFRESH_RATE_MS) / 1000))
+    trend_engine = TrendEngine(config.get('trend_history_size', HISTORY_SIZE))
+    signal_engine = SignalEngine()
+    signal_engine.configure(config)
+    trend_store = TrendStore(history_db)
+    prev_prices, trend_history = trend_store.load(config['coins'].keys(), PIVOT_CURRENCY, trend_engine.history_size)
+    trend_engine.load(trend_history)
+    current_prices = prev_prices.copy()
+    analytics = create_portfolio_analytics(config, trend_store)
+    last_data = {} # Последние данные по всем монетам (запрос приносит только монеты, срок которых наступил)
+    
+    output = open(output_path, 'a', encoding='utf-8') if output_path else sys.stdout
+    try:
+        while True:
+            now = time.monotonic()
+            wait = refresh_queue.seconds_until_next(now)
+            if wait:
+                time.sleep(wait) # Ни одной монете еще не пора обновляться
+                continue
+            if not scheduler.try_acquire():
+                time.sleep(scheduler.seconds_until_next())
+                continue
+                
+            coin_ids = refresh_queue.pop_due(now)
+            data, status, retry_after = fetch_prices(coin_ids, PIVOT_CURRENCY)
+            scheduler.on_result(status, retry_after)
+            if status != FETCH_OK:
+                refresh_queue.mark_due(get_missing_ids(coin_ids, data)) # Повтор — когда разрешит планировщик
+            
+            if data:
+                last_data = dict(last_data, **data)
+                prev_prices = roll_prev_prices(prev_prices, current_prices, coin_ids)
+                result = evaluate_portfolio(config, last_data, prev_prices, trend_engine, signal_engine=signal_engine, updated_ids=coin_ids)
+                current_prices = result['prices']
+                trend_store.record_refresh(result['fresh_prices'], result['new_trends'], PIVOT_CURRENCY)
+                if analytics is not None:
+                    analytics.record(result['fresh_prices'])
+            else:
+                # Неудачный запрос не сбрасывает историю: просто сообщаем о нем
+                result = evaluate_portfolio(config, last_data, prev_prices)
+                
+            summary = analytics.evaluate() if analytics is not None else None
+            record = build_headless_record(config, result, status, trend_engine, summary)
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            output.flush()
+            
+            if once:
+                break
+            time.sleep(scheduler.seconds_until_next())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        trend_store.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+def main(argv=None):
+    import argparse # Нужен только при запуске из командной строки
+    parser = argparse.ArgumentParser(description="Крипто виджет без интерфейса: цены, портфель и сигналы трендов в формате JSON Lines.")
+    parser.add_argument('--headless', action='store_true', help="Режим без окна (по умолчанию для этого модуля)")
+    parser.add_argument('--config', default=None, help="Путь к config.json (по умолчанию рядом с программой)")
+    parser.add_argument('--output', default=None, help="Файл для записи JSON Lines (по умолчанию stdout)")
+    parser.add_argument('--history-db', default=HISTORY_DB_FILE, help="Путь к базе истории трендов")
+    parser.add_argument('--once', action='store_true', help="Выполнить одно обновление и выйти")
+    args, _unknown = parser.parse_known_args(argv)
+    
+    run_headless(args.config, args.output, args.history_db, args.once)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
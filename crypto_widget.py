@@ -1,15 +1,22 @@
+import time
+_MODULE_STARTED = time.perf_counter() # Начало загрузки модуля (для отчета --startup-report)
+
 import tkinter as tk
 from tkinter import messagebox, ttk
-import requests
-import json
+import tkinter.font as tkfont
 import os
-import webbrowser
 import locale
 import sys
 import threading
-from PIL import Image, ImageDraw 
-import pystray 
-import time 
+import queue
+# PIL, pystray и webbrowser импортируются при первом использовании (см. crypto_core.timed_import)
+
+import crypto_core
+from crypto_core import (
+    APP_NAME, HISTORY_SIZE, HISTORY_PREV_PRICE_MAX_AGE_SEC, MAX_VISIBLE_ROWS, SNAPSHOT_SAVE_EVERY_SEC, SIGNAL_COOLDOWN_SEC, STREAM_REST_EVERY_SEC, REFRESH_RATE_MS, REFRESH_TIERS_SEC, PIVOT_CURRENCY, FETCH_OK,
+    load_config, load_market_snapshot, save_market_snapshot, configure_api, create_portfolio_analytics, get_api_coin_ids, get_coin_refresh_tiers, get_missing_ids, get_stale_since, get_display_currencies, get_fx_rates, evaluate_portfolio, get_trend_message, get_trend_messages, load_coin_index, merge_price_ticks, resolve_stream_url, roll_prev_prices,
+    CoinRefreshQueue, PriceFetchWorker, PriceStreamWorker, RefreshScheduler, SignalEngine, TrendEngine, TrendStore
+)
 
 # Модуль для работы с реестром Windows (для автозапуска)
 try:
@@ -17,51 +24,74 @@ try:
 except ImportError:
     winreg = None 
 
-# Установка локали для форматирования чисел 
-try:
-    locale.setlocale(locale.LC_ALL, 'ru_RU.UTF-8')
-except locale.Error:
+_IMPORTS_DONE = time.perf_counter()
+
+
+def setup_locale():
+    """Установка локали для форматирования чисел (при запуске окна, а не при импорте модуля)."""
     try:
-        locale.setlocale(locale.LC_ALL, 'C')
+        locale.setlocale(locale.LC_ALL, 'ru_RU.UTF-8')
     except locale.Error:
-        pass
+        try:
+            locale.setlocale(locale.LC_ALL, 'C')
+        except locale.Error:
+            pass
+
+
+def open_url(url):
+    """Открывает ссылку в браузере (модуль webbrowser загружается при первом клике)."""
+    crypto_core.timed_import('webbrowser').open(url)
+
+
+class StartupTimer:
+    """
+    Замеры этапов запуска (мс от начала загрузки модуля) для отчета --startup-report.
+    Подробная разбивка импортов по модулям: python -X importtime crypto_widget.py
+    """
+    def __init__(self, started):
+        self.started = started
+        self.marks = [] # [(этап, мс от начала)]
+        self.reported = False
+
+    def mark(self, name, at=None):
+        at = time.perf_counter() if at is None else at
+        self.marks.append((name, (at - self.started) * 1000))
+
+    def elapsed(self, name):
+        return next((ms for mark_name, ms in self.marks if mark_name == name), None)
+
+    def report(self):
+        """Печатает отчет один раз (в консоль)."""
+        if self.reported:
+            return
+        self.reported = True
+        print("Запуск (мс от начала загрузки модуля):")
+        for name, ms in self.marks:
+            print(f"  {name:<32} {ms:8.1f}")
+        imports_ms = self.elapsed("импорт модулей")
+        if imports_ms is not None and imports_ms > STARTUP_IMPORT_BUDGET_MS:
+            print(f"  ! импорт модулей дольше бюджета ({STARTUP_IMPORT_BUDGET_MS} мс)")
+        if crypto_core.LAZY_IMPORT_TIMES:
+            print("Отложенные импорты (при первом использовании):")
+            for name, ms in crypto_core.LAZY_IMPORT_TIMES.items():
+                print(f"  {name:<32} {ms:8.1f}")
+
+
+startup_timer = StartupTimer(_MODULE_STARTED)
+startup_timer.mark("импорт модулей", at=_IMPORTS_DONE)
 
 
 # --- Константы ---
-BASE_DIR = os.path.dirname(os.path.abspath(sys.argv[0]))
-CONFIG_FILE = os.path.join(BASE_DIR, 'config.json')
-API_URL = "https://api.coingecko.com/api/v3/simple/price"
-REFRESH_RATE_MS = 60000 # Обновление раз в минуту
+FETCH_POLL_MS = 100 # Как часто основной поток проверяет очередь результатов загрузки
+COIN_SUGGESTIONS = 8 # Сколько подсказок показывать при вводе ID монеты
+REFRESH_TIER_AUTO = "общий" # Интервал обновления монеты не задан: как у всего виджета
+REFRESH_TIER_LABELS = {sec: (f"{sec} сек" if sec < 60 else f"{sec // 60} мин") for sec in REFRESH_TIERS_SEC}
+ANALYTICS_WINDOW_LABELS = {"1h": "1ч", "24h": "24ч", "7d": "7д"} # Подписи окон прибыли/убытка под итогом портфеля
+STARTUP_IMPORT_BUDGET_MS = 150 # Бюджет на импорт модулей при запуске (превышение отмечается в отчете)
 COINGECKO_HOME_LINK = "https://www.coingecko.com/ru" 
-HISTORY_SIZE = 5 # Размер истории трендов (5x)
-APP_NAME = "CryptoWidgetCoinGecko" # Имя приложения для реестра
 RUN_KEY = r"Software\Microsoft\Windows\CurrentVersion\Run"
 
 
-# Сообщения для уведомлений о трендах в зависимости от длины серии (>= 2)
-TREND_MESSAGES = {
-    1: {
-        "BULLISH": "НАЧАЛЬНЫЙ ПРИЗНАК: Возможен восходящий импульс.",
-        "BEARISH": "НАЧАЛЬНЫЙ ПРИЗНАК: Возможен нисходящий импульс."
-    },
-    2: {
-        "BULLISH": "ПОДВТЕРЖДЕЮЩИЙСЯ ПРИЗНАК: Возможен восходящий импульс.",
-        "BEARISH": "ПОДТВЕРЖДАЮЩИЙСЯ ПРИЗНАК: Возможен нисходящий импульс."
-    },
-    3: {
-        "BULLISH": "УСИЛЕНИЕ: Подтверждается краткосрочный восходящий тренд.",
-        "BEARISH": "УСИЛЕНИЕ: Подтверждается краткосрочный нисходящий тренд."
-    },
-    4: {
-        "BULLISH": "СИЛЬНЫЙ СИГНАЛ: Высокая вероятность продолжения роста.",
-        "BEARISH": "СИЛЬНЫЙ СИГНАЛ: Высокая вероятность продолжения падения."
-    },
-    5: {
-        "BULLISH": "МАКСИМАЛЬНЫЙ ТРЕНД: Устойчивый, сильный бычий сигнал.",
-        "BEARISH": "МАКСИМАЛЬНЫЙ ТРЕНД: Устойчивый, сильный медвежий сигнал."
-    }
-}
-
 # Ключи для сортировки
 SORT_KEYS = {
     'name': (0, 'Монета:'),
@@ -99,10 +129,54 @@ THEMES = {
     }
 }
 
+# Роли виджетов для тем: {роль: {опция виджета: ключ цвета в THEMES}}
+THEME_ROLES = {
+    'background': {'bg': 'bg'}, # Фреймы и метки со своим цветом текста
+    'text': {'bg': 'bg', 'fg': 'fg'},
+    'header': {'bg': 'bg', 'fg': 'header_fg'},
+    'separator': {'bg': 'separator_bg'}
+}
+
+
+class ThemeRegistry:
+    """
+    Виджеты, зарегистрированные по ролям при создании.
+    Смена темы — один проход по списку, без обхода дерева виджетов и без
+    угадывания роли по цвету или тексту. Ячейки таблицы и заголовки CanvasTable
+    (элементы холста, а не виджеты) сюда не входят: их цвета задаются при отрисовке (update_widget).
+    """
+    def __init__(self):
+        self.widgets = [] # [(виджет, роль)]
+        self.colors = None
+
+    def register(self, widget, role):
+        """Добавляет виджет (и сразу красит его, если тема уже применена). Возвращает widget."""
+        self.widgets.append((widget, role))
+        if self.colors is not None:
+            self.style(widget, role)
+        return widget
+
+    def style(self, widget, role):
+        widget.configure(**{option: self.colors[key] for option, key in THEME_ROLES[role].items()})
+
+    def apply(self, colors):
+        """Применяет цвета ко всем зарегистрированным виджетам, забывая уничтоженные."""
+        self.colors = colors
+        alive = []
+        for widget, role in self.widgets:
+            try:
+                self.style(widget, role)
+            except tk.TclError:
+                continue # Виджет уже уничтожен
+            alive.append((widget, role))
+        self.widgets = alive
+
 
 # --- Создание Иконки (для трея) ---
 def create_icon_image(size=64):
     """Создает простое изображение голубого квадрата для иконки трея."""
+    Image = crypto_core.timed_import('PIL.Image')
+    ImageDraw = crypto_core.timed_import('PIL.ImageDraw')
     img = Image.new('RGB', (size, size), color='white')
     d = ImageDraw.Draw(img)
     # Рисуем голубой квадрат
@@ -176,128 +250,29 @@ def check_startup():
 
 
 # --- Управление Конфигурацией ---
-def load_config():
-    """Загружает конфигурацию из config.json или создает дефолтную."""
-    default_config = {
-        "base_currency": "usd", 
-        "coins": {
-            "bitcoin": {"name": "BTC", "amount": 0.0}, 
-            "ethereum": {"name": "ETH", "amount": 0.0}
-        },
-        "trend_threshold_percent": 0.01, # процент при котором выскакивает окошко оповещения о тренде
-        "font_size": 10,
-        "window_x": None, 
-        "window_y": None,
-        "notification_window_x": None, # НОВОЕ: Позиция окна уведомления X
-        "notification_window_y": None, # НОВОЕ: Позиция окна уведомления Y
-        "opacity": 0.95,
-        "autostart_enabled": True,
-        "hide_on_close": True, 
-        "theme": "light",
-        "trend_notifications_enabled": True, # Оставлено для совместимости при миграции
-        "notification_duration_sec": 10,  # НОВОЕ: Длительность уведомления в секундах
-        "notification_mode": "always"     # НОВОЕ: "always", "tray_only", "disabled"
-    }
-    
-    if not os.path.exists(CONFIG_FILE):
-        return default_config
-    
-    try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            
-            # Обновление старого формата монет на новый
-            if 'coins' in config:
-                new_coins = {}
-                for api_id, data in config['coins'].items():
-                    if isinstance(data, str):
-                        new_coins[api_id] = {"name": data, "amount": 0.0}
-                    elif isinstance(data, dict):
-                        # Игнорируем специфические поля DEX, если они есть
-                        coin_data = {
-                            "name": data.get("name", api_id.upper()),
-                            "amount": data.get("amount", 0.0)
-                        }
-                        new_coins[api_id] = coin_data
-                    
-                config['coins'] = new_coins
-            
-            for key, default_val in default_config.items():
-                if key not in config:
-                    config[key] = default_val
-                    
-            # Миграция: если старая настройка отключена, устанавливаем режим "disabled"
-            if 'trend_notifications_enabled' in config and not config['trend_notifications_enabled'] and config.get('notification_mode', default_config['notification_mode']) == default_config['notification_mode']:
-                 config['notification_mode'] = 'disabled'
-            # Удаляем старую настройку
-            if 'trend_notifications_enabled' in config:
-                del config['trend_notifications_enabled']
-                
-            return config
-            
-    except Exception:
-        return default_config
+# Запись на диск — в фоне и не чаще раза в CONFIG_SAVE_DELAY_SEC (перетаскивание окна, настройки)
+config_persister = crypto_core.ConfigPersister()
 
 def save_config(config):
-    """Сохраняет текущую конфигурацию в config.json."""
-    
-    suppress_error = '-autostart' in sys.argv 
-    
-    # Удаляем старую настройку, если она еще осталась
-    if 'trend_notifications_enabled' in config:
-        del config['trend_notifications_enabled']
-        
+    """Ставит конфигурацию в очередь на сохранение в config.json (запись — в фоновом потоке)."""
+    config_persister.save(config)
+
+def show_config_save_errors():
+    """Показывает пользователю ошибки прав доступа фоновой записи конфига (в основном потоке)."""
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=4)
-    except PermissionError as e:
-        print(f"Ошибка прав доступа при сохранении конфига: {e}") 
-        
-        if not suppress_error:
+        while True:
+            e = config_persister.errors.get_nowait()
+            if '-autostart' in sys.argv:
+                continue
             messagebox.showerror(
                 "Ошибка сохранения", 
-                f"Не удалось сохранить файл настроек '{CONFIG_FILE}' из-за ошибки прав доступа.\n"
+                f"Не удалось сохранить файл настроек '{crypto_core.CONFIG_FILE}' из-за ошибки прав доступа.\n"
                 f"Ошибка: {e}"
             )
-    except Exception as e:
-        print(f"Неизвестная ошибка при сохранении конфига: {e}")
-
-
-# --- Получение данных (API) ---
-def get_crypto_prices(coin_ids, currency):
-    """Получает цены и процент изменения за 24ч с CoinGecko."""
-    if not coin_ids:
-        return {}
-
-    try:
-        response = requests.get(
-            "https://api.coingecko.com/api/v3/coins/markets",
-            params={
-                "vs_currency": currency,
-                "ids": ",".join(coin_ids),
-                "price_change_percentage": "24h"
-            },
-            timeout=10
-        )
-        response.raise_for_status()
-        data = response.json()
-
-        # Преобразуем ответ в формат, совместимый со старым кодом
-        result = {}
-        for item in data:
-            result[item["id"]] = {
-                currency: item["current_price"],
-                "change_24h": item.get("price_change_percentage_24h", 0.0),
-                "market_cap": item.get("market_cap"),
-                "volume": item.get("total_volume")
-            }
-        return result
+    except queue.Empty:
+        pass
 
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка сети/API: {e}")
-        return {}
 
-        
 # --- Всплывающее Окно Уведомлений ---
 
 # Конфигурация размеров окна: 'max' и 'min'
@@ -318,8 +293,79 @@ SIZE_CONFIGS = {
     }
 }
 
+class NotificationRow:
+    """Виджеты сигнала одной монеты в окне уведомлений (переиспользуются между показами)."""
+    def __init__(self, parent, bg_color):
+        self.separator = tk.Frame(parent, height=1, bg='#555555') # Разделитель между монетами
+        self.coin_frame = tk.Frame(parent, bg=bg_color)
+        self.title_label = tk.Label(self.coin_frame, bg=bg_color)
+        self.title_label.pack(side=tk.LEFT, fill='x')
+        self.percent_label = tk.Label(self.coin_frame, bg=bg_color)
+        self.percent_label.pack(side=tk.RIGHT)
+        self.message_label = tk.Label(parent, bg=bg_color, fg='#FFFFFF', justify=tk.LEFT)
+        self.signal = None
+
+    def update(self, signal, size_config, history_size, trend_messages):
+        """Заполняет строку данными сигнала (размеры шрифтов — из size_config, тексты — из trend_messages)."""
+        self.signal = signal
+        trend_type = signal['trend_type']
+        series_length = signal['series_length']
+        change_percent = signal['change_percent']
+        
+        trend_color = 'green' if trend_type == "BULLISH" else 'red'  
+        trend_icon = '▲' if trend_type == "BULLISH" else '▼'
+        
+        # Повторение иконки (стрелочки) в количестве series_length
+        importance_arrows = trend_icon * series_length 
+        title_prefix = "📈 БЫЧИЙ" if trend_type == "BULLISH" else "📉 МЕДВЕЖИЙ"
+        self.title_label.config(
+            text=f"{importance_arrows} {signal['coin_name']} ({title_prefix}) ({series_length}/{history_size})", 
+            font=('Arial', size_config['font_title'], 'bold'), 
+            fg=trend_color
+        )
+        
+        # Процент изменения с многоуровневой подсветкой
+        percent_str = f"+{change_percent:.2f}%" if change_percent > 0 else f"{change_percent:.2f}%"
+        percent_font = ('Arial', size_config['font_percent'], 'bold')
+        percent_color = trend_color
+        if abs(change_percent) >= 10:
+            percent_font = ('Arial', size_config['font_percent'] + 16, 'bold')
+            percent_color = '#FF3333'  # ярко-красный
+        elif abs(change_percent) >= 1:
+            percent_font = ('Arial', size_config['font_percent'] + 8, 'bold')
+            percent_color = '#FF6600'  # неоново-оранжевый
+        elif abs(change_percent) >= 0.1:
+            percent_font = ('Arial', size_config['font_percent'] + 4, 'bold')
+            percent_color = '#FFD700'  # золотой
+        self.percent_label.config(text=percent_str, font=percent_font, fg=percent_color)
+        
+        # Основное сообщение
+        self.message_label.config(
+            text=get_trend_message(series_length, trend_type, trend_messages), 
+            font=('Arial', size_config['font_message']), 
+            wraplength=size_config['wraplength']
+        )
+
+    def show(self, with_separator):
+        if with_separator:
+            self.separator.pack(fill='x', pady=5)
+        self.coin_frame.pack(fill='x')
+        self.message_label.pack(fill='x', pady=(0, 5))
+
+    def hide(self):
+        for widget in (self.separator, self.coin_frame, self.message_label):
+            widget.pack_forget()
+        self.signal = None
+
+
 class NotificationWindow(tk.Toplevel):
-    def __init__(self, master, active_signals, duration_sec): 
+    """
+    Одно долгоживущее окно уведомлений о трендах.
+    Новые сигналы сливаются с уже показанными (строка монеты обновляется, а не
+    дублируется), обратный отсчет начинается заново, а при закрытии окно
+    скрывается (withdraw), и его строки остаются в запасе для следующих сигналов.
+    """
+    def __init__(self, master): 
         super().__init__(master)
         
         self.master = master
@@ -329,28 +375,25 @@ class NotificationWindow(tk.Toplevel):
         self.size_config = SIZE_CONFIGS[self.current_size_mode]
         # ----------------------------------------
         
+        self.withdraw() # Окно показывается в show_signals
         self.overrideredirect(True)
         self.attributes('-topmost', True)
-        
-        # ---  ПРИМЕНЕНИЕ ПРОЗРАЧНОСТИ для всплывающего окна ---
-        opacity_value = self.master.config.get('opacity', 0.95) 
-        self.attributes('-alpha', opacity_value) 
-        # -------------------------------------------------
-
 
         self.drag_x = 0
         self.drag_y = 0
         
         # Выбираем цвета и фон
-        bg_color = '#000000' 
+        self.bg_color = bg_color = '#000000' 
         fg_color = '#FFFFFF' 
         header_color = '#4EC9B0' 
         
         self.config(bg=bg_color)
         
-        self.duration_sec = duration_sec
-        self.time_left = duration_sec 
+        self.duration_sec = 0
+        self.time_left = 0 
         self.timer_id = None
+        self.rows = {} # {api_id: NotificationRow} — показанные сигналы (в порядке появления)
+        self.free_rows = [] # Скрытые строки для повторного использования
         
         # Общий заголовок
         header_label = tk.Label(
@@ -375,7 +418,7 @@ class NotificationWindow(tk.Toplevel):
         scrollable_frame = tk.Frame(self, bg=bg_color)
         scrollable_frame.pack(fill='both', expand=True, padx=15, pady=(0, 5))
         
-        canvas = tk.Canvas(scrollable_frame, bg=bg_color, highlightthickness=0, height=450)
+        self.canvas = canvas = tk.Canvas(scrollable_frame, bg=bg_color, highlightthickness=0, height=450)
         scrollbar = tk.Scrollbar(scrollable_frame, orient="vertical", command=canvas.yview)
         
         self.signals_frame = tk.Frame(canvas, bg=bg_color)
@@ -390,80 +433,6 @@ class NotificationWindow(tk.Toplevel):
         
         scrollbar.pack(side="right", fill="y")
         canvas.pack(side="left", fill="both", expand=True)
-
-        # Отрисовка каждого сигнала
-        for signal in active_signals:
-            coin_name = signal['coin_name']
-            trend_type = signal['trend_type']
-            series_length = signal['series_length']
-            change_percent = signal['change_percent']
-            
-            trend_color = 'green' if trend_type == "BULLISH" else 'red'  
-            trend_icon = '▲' if trend_type == "BULLISH" else '▼'
-
-            # Разделитель между монетами
-            if signal != active_signals[0]:
-                 tk.Frame(self.signals_frame, height=1, bg='#555555').pack(fill='x', pady=5)
-            
-            # Фрейм для одной монеты
-            coin_frame = tk.Frame(self.signals_frame, bg=bg_color)
-            coin_frame.pack(fill='x')
-            
-            # Повторение иконки (стрелочки) в количестве series_length
-            importance_arrows = trend_icon * series_length 
-            title_prefix = "📈 БЫЧИЙ" if trend_type == "BULLISH" else "📉 МЕДВЕЖИЙ"
-            
-            # Заголовок монеты (Используем размер шрифта из size_config)
-            tk.Label(
-                coin_frame, 
-                text=f"{importance_arrows} {coin_name} ({title_prefix}) ({series_length}/{HISTORY_SIZE})", 
-                font=('Arial', self.size_config['font_title'], 'bold'), 
-                fg=trend_color, 
-                bg=bg_color
-            ).pack(side=tk.LEFT, fill='x')
-            
-            # Процент изменения (Используем размер шрифта из size_config)
-
-            # Процент изменения (Используем размер шрифта из size_config)
-            percent_str = f"+{change_percent:.2f}%" if change_percent > 0 else f"{change_percent:.2f}%"
-
-            # Базовые значения
-            percent_font = ('Arial', self.size_config['font_percent'], 'bold')
-            percent_color = trend_color
-
-            # Многоуровневая подсветка
-            if abs(change_percent) >= 10:
-                percent_font = ('Arial', self.size_config['font_percent'] + 16, 'bold')
-                percent_color = '#FF3333'  # ярко-красный
-            elif abs(change_percent) >= 1:
-                percent_font = ('Arial', self.size_config['font_percent'] + 8, 'bold')
-                percent_color = '#FF6600'  # неоново-оранжевый
-            elif abs(change_percent) >= 0.1:
-                percent_font = ('Arial', self.size_config['font_percent'] + 4, 'bold')
-                percent_color = '#FFD700'  # золотой
-
-            tk.Label(
-                coin_frame, 
-                text=f"{percent_str}", 
-                font=percent_font, 
-                fg=percent_color, 
-                bg=bg_color
-            ).pack(side=tk.RIGHT)
-
-
-            
-            
-            # Основное сообщение (Используем размер шрифта и wraplength из size_config)
-            message = TREND_MESSAGES[series_length][trend_type]
-            tk.Label(
-                self.signals_frame, 
-                text=message, 
-                font=('Arial', self.size_config['font_message']), 
-                fg=fg_color, 
-                bg=bg_color,
-                justify=tk.LEFT,
-                wraplength=self.size_config['wraplength'] # <--- Используем wraplength из конфига
-            ).pack(fill='x', pady=(0, 5))
             
         # Фрейм для нижней части с кнопками
         bottom_buttons_frame = tk.Frame(self, bg=bg_color)
@@ -497,62 +466,63 @@ class NotificationWindow(tk.Toplevel):
         # Обратный отсчет
         self.countdown_label = tk.Label(
             bottom_buttons_frame,
-            text=f"Закрытие через {self.time_left} сек...",
             font=('Arial', 9),
             fg='#FFD700',
             bg=bg_color
         )
         self.countdown_label.pack(side=tk.RIGHT)
 
-
-        # Установка позиции (загрузка сохраненной или центрирование)
-        self.update_idletasks()
-        self.load_window_position() # Использует DESIRED_WIDTH из size_config
-
-        # Автоматическое закрытие и отсчет
+    def show_signals(self, active_signals, duration_sec):
+        """
+        Добавляет сигналы в окно (строки монет, которые уже показаны, обновляются),
+        перезапускает обратный отсчет и показывает окно, если оно было скрыто.
+        """
+        history_size = self.master.trend_engine.history_size
+        trend_messages = get_trend_messages(self.master.config)
+        for signal in active_signals:
+            row = self.rows.get(signal['api_id'])
+            if row is None:
+                row = self.free_rows.pop() if self.free_rows else NotificationRow(self.signals_frame, self.bg_color)
+                row.show(with_separator=bool(self.rows))
+                self.rows[signal['api_id']] = row
+            row.update(signal, self.size_config, history_size, trend_messages)
+        
+        # ---  ПРИМЕНЕНИЕ ПРОЗРАЧНОСТИ для всплывающего окна ---
+        self.attributes('-alpha', self.master.config.get('opacity', 0.95)) 
+        
+        # Обратный отсчет начинается заново
+        self.duration_sec = duration_sec
+        self.time_left = duration_sec 
+        self.countdown_label.config(text=f"Закрытие через {self.time_left} сек...")
+        if self.timer_id:
+            self.after_cancel(self.timer_id)
         self.timer_id = self.after(1000, self.update_countdown)
+        
+        if self.state() == 'withdrawn':
+            # Установка позиции (загрузка сохраненной или центрирование)
+            self.load_window_position()
+            self.deiconify()
+            self.canvas.yview_moveto(0)
+        self.lift()
 
     # --- НОВЫЙ МЕТОД: Переключение размера ---
     def toggle_size(self):
-        """Переключает режим размера окна и сохраняет его в конфиге."""
+        """Переключает режим размера окна, сохраняет его в конфиге и сразу перерисовывает сигналы."""
         # Определяем новый режим
         new_mode = 'min' if self.current_size_mode == 'max' else 'max'
+        self.current_size_mode = new_mode
+        self.size_config = SIZE_CONFIGS[new_mode]
+        self.size_button.config(text="[ S ]" if new_mode == 'min' else "[ L ]")
         
         # Сохраняем в конфиге
         self.master.config['notification_window_size'] = new_mode
-        save_config(self.master.config) 
-        
-        # Закрываем текущее окно (чтобы заставить его открыться в новом размере при следующем уведомлении)
-        # ИЛИ, если мы хотим изменить размер немедленно:
-        
-        # 1. Запоминаем текущую позицию
-        current_x = self.winfo_x()
-        current_y = self.winfo_y()
-        self.master.config['notification_window_x'] = current_x
-        self.master.config['notification_window_y'] = current_y
-        
-        # 2. Перезапускаем окно с новым режимом
-        self.after_cancel(self.timer_id)
-        self.destroy()
         
-        # Создаем и открываем новое окно с теми же сигналами, но новым размером
-        # (Это нужно реализовать в основном классе CryptoWidget, но для простоты
-        # при следующем срабатывании оно откроется с новым размером. 
-        # Если нужно переоткрыть немедленно, это усложнит код, 
-        # поэтому давайте пока закроем его, чтобы он запомнил.)
-        
-        # ВАЖНО: При следующем уведомлении (или перезапуске программы) окно откроется в новом размере.
-        # Если необходимо мгновенное переключение, нужно будет доработать логику взаимодействия 
-        # с родительским классом CryptoWidget, чтобы он мог пересоздать NotificationWindow.
-        
-        # Пока просто закрываем, чтобы сохранить новый размер.
-        # self.close_window() # Уже делаем это через self.destroy()
-
-        messagebox.showinfo(
-            "Настройка сохранена", 
-            f"Размер окна уведомлений изменен на '{new_mode}'.\n"
-            f"Изменение вступит в силу при следующем тренд-уведомлении."
-        )
+        history_size = self.master.trend_engine.history_size
+        trend_messages = get_trend_messages(self.master.config)
+        for row in self.rows.values():
+            row.update(row.signal, self.size_config, history_size, trend_messages)
+        self.save_window_position() # Сохраняет и конфиг
+        self.load_window_position() # Новая ширина окна
 
 
     # --- МЕТОДЫ ДЛЯ ПЕРЕТАСКИВАНИЯ И ПОЗИЦИИ ---
@@ -567,7 +537,7 @@ class NotificationWindow(tk.Toplevel):
         # ---------------------------------------------------------
 
         self.update_idletasks() 
-        height = self.winfo_height()
+        height = self.winfo_reqheight() # У скрытого окна реальной высоты еще нет
 
         if x is None or y is None:
             screen_width = self.winfo_screenwidth()
@@ -616,37 +586,479 @@ class NotificationWindow(tk.Toplevel):
         self.timer_id = self.after(1000, self.update_countdown)
         
     def close_window(self):
-        """Закрывает окно уведомления и отменяет таймер, сохраняя позицию."""
+        """Скрывает окно уведомления, сохраняя позицию."""
         self.save_window_position()
-        if hasattr(self, 'timer_id') and self.timer_id:
+        self.hide()
+
+    def hide(self):
+        """Отменяет таймер, убирает показанные сигналы в запас и скрывает окно (без уничтожения)."""
+        if self.timer_id:
             self.after_cancel(self.timer_id)
-        self.destroy()
+            self.timer_id = None
+        for row in self.rows.values():
+            row.hide()
+            self.free_rows.append(row)
+        self.rows = {}
+        self.withdraw()
 
 # ... (Остальной код класса CryptoWidget остается без изменений)
 
 
+# --- Строка таблицы монет ---
+class CoinRow:
+    """
+    Постоянная строка (слот) таблицы.
+    Виджеты создаются один раз и стоят на своем месте в сетке (grid), а при
+    прокрутке и сортировке в слот подставляется другая монета: меняются только
+    те ячейки, у которых изменился текст, цвет или шрифт.
+    """
+    def __init__(self, widget, parent):
+        self.widget = widget # Главное окно (CryptoWidget), нужно для колбэков
+        self.api_id = None # Монета, которая сейчас показана в слоте
+        self.row_num = None
+        self.link_colors = (None, None)
+        self.cell_cache = {} # {ячейка: последние примененные опции}
+        
+        # Колонка 0: Имя монеты (ссылка на CoinGecko)
+        self.name_label = tk.Label(parent, cursor="hand2")
+        self.name_label.bind("<Button-1>", lambda e: self.widget.open_coin_link(self.api_id))
+        self.name_label.bind("<Enter>", lambda e: self.name_label.config(fg=self.link_colors[1]))
+        self.name_label.bind("<Leave>", lambda e: self.name_label.config(fg=self.link_colors[0]))
+        
+        # Колонки 1-3: Количество, Курс, Стоимость
+        self.amount_label = tk.Label(parent)
+        self.price_label = tk.Label(parent)
+        self.value_label = tk.Label(parent)
+        
+        # Колонка 4: Фрейм для двух значений в одной ячейке (локальное | за 24 часа)
+        self.change_frame = tk.Frame(parent)
+        self.change_label = tk.Label(self.change_frame)
+        self.change_label.pack(side='left')
+        self.separator_label = tk.Label(self.change_frame)
+        self.separator_label.pack(side='left')
+        self.change_24h_label = tk.Label(self.change_frame)
+        self.change_24h_label.pack(side='left')
+        
+        # Колонка 5: История трендов
+        self.forecast_frame = tk.Frame(parent)
+        self.trend_labels = []
+
+    def set_cell(self, key, widget, **options):
+        """Применяет опции к ячейке, только если они отличаются от уже установленных."""
+        if self.cell_cache.get(key) == options:
+            return
+        widget.configure(**options)
+        self.cell_cache[key] = options
+
+    def place(self, row_num):
+        """Размещает строку в сетке (повторно — только если строка сместилась)."""
+        if self.row_num == row_num:
+            return
+        self.row_num = row_num
+        self.name_label.grid(row=row_num, column=0, sticky='w', padx=(0, 5))
+        self.amount_label.grid(row=row_num, column=1, sticky='e', padx=(5, 10))
+        self.price_label.grid(row=row_num, column=2, sticky='e', padx=(5, 10))
+        self.value_label.grid(row=row_num, column=3, sticky='e', padx=(5, 10))
+        self.change_frame.grid(row=row_num, column=4, sticky='e', padx=(5, 10))
+        self.forecast_frame.grid(row=row_num, column=5, sticky='e', padx=(5, 0))
+
+    def update(self, view, colors, font_size):
+        """Обновляет значения ячеек строки по подготовленным в update_widget данным."""
+        small_font = ('Arial', max(8, font_size - 2))
+        bg = colors['bg']
+        history_size = self.widget.trend_engine.history_size
+        
+        self.link_colors = (colors['link_fg'], colors['link_hover_fg'])
+        self.set_cell('name', self.name_label, text=f"{view['name']}:", fg=colors['link_fg'], bg=bg, font=('Arial', font_size, 'bold'))
+        self.set_cell('amount', self.amount_label, text=view['amount_text'], fg=colors['amount_fg'], bg=bg, font=('Arial', font_size))
+        self.set_cell('change_frame', self.change_frame, bg=bg)
+        self.set_cell('forecast_frame', self.forecast_frame, bg=bg)
+        
+        if view['has_data']:
+            trend = view['trend']
+            self.set_cell('price', self.price_label, text=view['price_text'], fg=colors['price_fg'], bg=bg, font=('Arial', font_size))
+            self.set_cell('value', self.value_label, text=view['value_text'], fg=colors['total_value_fg'], bg=bg, font=('Arial', font_size, 'bold'))
+            self.set_cell('change', self.change_label, text=view['change_text'], fg=view['change_color'], bg=bg, font=small_font)
+            self.set_cell('separator', self.separator_label, text=" | ", fg=colors['fg'], bg=bg, font=small_font)
+            self.set_cell('change_24h', self.change_24h_label, text=view['change_24h_text'], fg=view['change_24h_color'], bg=bg, font=small_font)
+        else:
+            # Если нет данных
+            trend = [("❓", colors['fg'])] * history_size
+            self.set_cell('price', self.price_label, text="---", fg=colors['fg'], bg=bg, font=('Arial', font_size))
+            self.set_cell('value', self.value_label, text="---", fg=colors['fg'], bg=bg, font=('Arial', font_size))
+            self.set_cell('change', self.change_label, text="---", fg=colors['fg'], bg=bg, font=small_font)
+            self.set_cell('separator', self.separator_label, text="", fg=colors['fg'], bg=bg, font=small_font)
+            self.set_cell('change_24h', self.change_24h_label, text="", fg=colors['fg'], bg=bg, font=small_font)
+        
+        # Значки тренда: недостающие позиции заполняются пробелами
+        trend = list(trend) + [(" ", 'gray')] * (history_size - len(trend))
+        while len(self.trend_labels) < len(trend):
+            label = tk.Label(self.forecast_frame)
+            label.pack(side=tk.LEFT, padx=0, pady=0)
+            self.trend_labels.append(label)
+        while len(self.trend_labels) > len(trend):
+            self.trend_labels.pop().destroy()
+            self.cell_cache.pop(f'trend_{len(self.trend_labels)}', None)
+            
+        for i, (icon, color) in enumerate(trend):
+            self.set_cell(f'trend_{i}', self.trend_labels[i], text=icon, fg=color, bg=bg, font=small_font)
+
+    def destroy(self):
+        for widget in (self.name_label, self.amount_label, self.price_label, self.value_label, self.change_frame, self.forecast_frame):
+            widget.destroy()
+
+
+class CanvasTable:
+    """
+    Таблица монет на одном tk.Canvas (config['table_renderer'] = 'canvas').
+    Вместо ~15 виджетов на строку каждая ячейка — текстовый элемент холста:
+    при обновлении через itemconfigure меняются только изменившиеся элементы,
+    а клики по ссылкам и заголовкам сортировки определяются по тегам элемента
+    под курсором. Строки переиспользуются при прокрутке так же, как CoinRow.
+    """
+    COLUMNS = ('name', 'amount', 'price', 'value', 'change', 'separator', 'change_24h', 'trend')
+    TREND_ICONS = "▲▼▬❓ "
+    COLUMN_PAD = 10 # Отступ между колонками
+    ROW_PAD = 2 # Отступ сверху и снизу строки
+
+    def __init__(self, widget, parent):
+        self.widget = widget # Главное окно (CryptoWidget), нужно для колбэков
+        self.canvas = tk.Canvas(parent, highlightthickness=0, bd=0)
+        self.canvas.grid(row=0, column=0, sticky='nw')
+        
+        self.item_cache = {} # {элемент: последние примененные опции}
+        self.fonts = {} # {(размер, жирность): tkfont.Font} для измерения ширины текста
+        self.slots = [] # [{ячейка: элемент}] — видимые строки
+        self.slot_api_ids = [] # Монета, показанная в каждой строке
+        self.link_items = {} # {элемент имени монеты: номер строки}
+        self.link_colors = (None, None)
+        self.layout = None # Раскладка последней отрисовки (x колонок, высоты)
+        self.layout_key = None # (самые длинные значения колонок, шрифт, длина истории)
+        
+        # Заголовки: текст, значок сортировки и линия-разделитель
+        self.header_items = {
+            'name': self.canvas.create_text(0, 0, tags=('help', 'help:name')),
+            'amount': self.canvas.create_text(0, 0, tags=('help', 'help:amount')),
+            'price': self.canvas.create_text(0, 0),
+            'value': self.canvas.create_text(0, 0, text="Стоимость:"),
+            'change': self.canvas.create_text(0, 0, text="Изм. % | за 24часа:"),
+            'trend': self.canvas.create_text(0, 0, tags=('help', 'help:forecast'))
+        }
+        self.sort_items = {
+            key: self.canvas.create_text(0, 0, tags=('sort', f'sort:{key}'))
+            for key in ('name', 'amount', 'price')
+        }
+        self.header_line = self.canvas.create_line(0, 0, 0, 0)
+        
+        self.canvas.tag_bind('link', '<Button-1>', self.on_link_click)
+        self.canvas.tag_bind('link', '<Enter>', lambda e: self.on_link_hover(True))
+        self.canvas.tag_bind('link', '<Leave>', lambda e: self.on_link_hover(False))
+        self.canvas.tag_bind('sort', '<Button-1>', self.on_sort_click)
+        self.canvas.tag_bind('help', '<Button-1>', self.on_help_click)
+        for tag, cursor in (('link', 'hand2'), ('sort', 'hand2'), ('help', 'question_arrow')):
+            self.canvas.tag_bind(tag, '<Enter>', lambda e, c=cursor: self.canvas.configure(cursor=c), add='+')
+            self.canvas.tag_bind(tag, '<Leave>', lambda e: self.canvas.configure(cursor=''), add='+')
+
+    def set_item(self, item, **options):
+        """Применяет опции к элементу холста, только если они отличаются от уже установленных."""
+        if self.item_cache.get(item) == options:
+            return
+        self.canvas.itemconfigure(item, **options)
+        self.item_cache[item] = options
+
+    def get_font(self, size, bold=False):
+        key = (size, bold)
+        if key not in self.fonts:
+            self.fonts[key] = tkfont.Font(family='Arial', size=size, weight='bold' if bold else 'normal')
+        return self.fonts[key]
+
+    def current_item(self):
+        items = self.canvas.find_withtag('current')
+        return items[0] if items else None
+
+    # --- Обработчики кликов (по тегам элемента под курсором) ---
+    def on_link_click(self, event):
+        slot_num = self.link_items.get(self.current_item())
+        if slot_num is not None:
+            self.widget.open_coin_link(self.slot_api_ids[slot_num])
+
+    def on_link_hover(self, hover):
+        item = self.current_item()
+        if item in self.link_items:
+            self.canvas.itemconfigure(item, fill=self.link_colors[1 if hover else 0])
+
+    def on_sort_click(self, event):
+        for tag in self.canvas.gettags(self.current_item()):
+            if tag.startswith('sort:'):
+                self.widget.sort_by_column(tag[len('sort:'):])
+
+    def on_help_click(self, event):
+        handlers = {
+            'help:name': self.widget.show_coin_explanation,
+            'help:amount': self.widget.show_portfolio_explanation,
+            'help:forecast': self.widget.show_forecast_explanation
+        }
+        for tag in self.canvas.gettags(self.current_item()):
+            if tag in handlers:
+                handlers[tag](event)
+
+    # --- Раскладка и отрисовка ---
+    @staticmethod
+    def longest_texts(row_views):
+        """
+        Самые длинные значения колонок по всем строкам (а не только видимым),
+        чтобы таблица не "прыгала" при прокрутке. Раскладка зависит только от них,
+        поэтому они же — ключ кэша раскладки: шрифт меряет только изменившиеся строки.
+        """
+        def longest(texts, default="---"):
+            return max(texts, key=len, default=default)
+        
+        return {
+            'name': longest(f"{view['name']}:" for view in row_views),
+            'amount': longest(view['amount_text'] for view in row_views),
+            'price': longest(view.get('price_text', "---") for view in row_views),
+            'value': longest(view.get('value_text', "---") for view in row_views),
+            'change': longest(view.get('change_text', "---") for view in row_views),
+            'change_24h': longest((view.get('change_24h_text', "") for view in row_views), "")
+        }
+
+    def measure_layout(self, texts, font_size, history_size):
+        """Ширины колонок по самым длинным значениям (longest_texts); для каждой колонки измеряется одна строка."""
+        font = self.get_font(font_size)
+        bold = self.get_font(font_size, True)
+        small = self.get_font(max(8, font_size - 2))
+        header = self.get_font(max(8, font_size - 4), True)
+        indicator = self.get_font(max(6, font_size - 6))
+        indicator_w = indicator.measure("↕") + 2
+        
+        icon_w = max(small.measure(icon) for icon in self.TREND_ICONS)
+        widths = {
+            'name': max(bold.measure(texts['name']), header.measure("Монета:") + indicator_w),
+            'amount': max(font.measure(texts['amount']), header.measure("Количество:") + indicator_w),
+            'price': max(font.measure(texts['price']), header.measure("Курс:") + indicator_w),
+            'value': max(bold.measure(texts['value']), header.measure("Стоимость:")),
+            'change': small.measure(texts['change']),
+            'separator': small.measure(" | "),
+            'change_24h': small.measure(texts['change_24h']),
+            'trend': max(icon_w * history_size, header.measure(f"Тренд ({history_size}x):"))
+        }
+        # Заголовок "Изм. % | за 24часа" занимает три подколонки
+        change_header_w = header.measure("Изм. % | за 24часа:")
+        change_w = widths['change'] + widths['separator'] + widths['change_24h']
+        if change_header_w > change_w:
+            widths['change'] += change_header_w - change_w
+        
+        x = {}
+        left = 0
+        for key in self.COLUMNS:
+            x[key] = (left, left + widths[key])
+            left += widths[key] + (0 if key in ('change', 'separator') else self.COLUMN_PAD)
+        
+        header_h = header.metrics('linespace') + 2 * self.ROW_PAD
+        return {
+            'x': x,
+            'width': left - self.COLUMN_PAD,
+            'header_h': header_h,
+            'rows_top': header_h + 7, # Под заголовком — линия-разделитель
+            'row_h': max(font.metrics('linespace'), bold.metrics('linespace')) + 2 * self.ROW_PAD,
+            'icon_w': icon_w,
+            'indicator_w': indicator_w,
+            'name_header_w': header.measure("Монета:"),
+            'history_size': history_size
+        }
+
+    def create_slot(self):
+        slot = {key: self.canvas.create_text(0, 0) for key in self.COLUMNS if key != 'trend'}
+        self.canvas.addtag_withtag('link', slot['name'])
+        slot['trend'] = []
+        return slot
+
+    def place_slot(self, slot, slot_num):
+        """Ставит элементы строки по текущей раскладке."""
+        layout = self.layout
+        y = layout['rows_top'] + slot_num * layout['row_h'] + layout['row_h'] / 2
+        for key in self.COLUMNS:
+            left, right = layout['x'][key]
+            if key == 'name':
+                self.canvas.coords(slot[key], left, y)
+                self.canvas.itemconfigure(slot[key], anchor='w')
+            elif key == 'trend':
+                while len(slot['trend']) < layout['history_size']:
+                    slot['trend'].append(self.canvas.create_text(0, 0, anchor='w'))
+                while len(slot['trend']) > layout['history_size']:
+                    item = slot['trend'].pop()
+                    self.canvas.delete(item)
+                    self.item_cache.pop(item, None)
+                for i, item in enumerate(slot['trend']):
+                    self.canvas.coords(item, left + i * layout['icon_w'], y)
+            else:
+                self.canvas.coords(slot[key], right, y)
+                self.canvas.itemconfigure(slot[key], anchor='e')
+
+    def place_header(self, font_size, history_size):
+        layout = self.layout
+        y = layout['header_h'] / 2
+        header_font = ('Arial', max(8, font_size - 4), 'bold')
+        indicator_font = ('Arial', max(6, font_size - 6))
+        
+        for key, item in self.header_items.items():
+            left, right = layout['x'][key]
+            if key == 'change':
+                right = layout['x']['change_24h'][1]
+            if key in self.sort_items:
+                # Значок сортировки стоит сразу справа от заголовка
+                sort_item = self.sort_items[key]
+                if key == 'name':
+                    self.canvas.coords(item, left, y)
+                    self.canvas.coords(sort_item, left + layout['name_header_w'] + layout['indicator_w'], y)
+                else:
+                    self.canvas.coords(item, right - layout['indicator_w'], y)
+                    self.canvas.coords(sort_item, right, y)
+                self.canvas.itemconfigure(sort_item, anchor='e', font=indicator_font)
+            else:
+                self.canvas.coords(item, right, y)
+            self.canvas.itemconfigure(item, anchor='w' if key == 'name' else 'e', font=header_font)
+        
+        self.canvas.itemconfigure(self.header_items['name'], text="Монета:")
+        self.canvas.itemconfigure(self.header_items['amount'], text="Количество:")
+        self.canvas.itemconfigure(self.header_items['price'], text="Курс:")
+        self.canvas.itemconfigure(self.header_items['trend'], text=f"Тренд ({history_size}x):")
+        line_y = layout['header_h'] + 3
+        self.canvas.coords(self.header_line, 0, line_y, layout['width'], line_y)
+
+    def draw(self, row_views, offset, visible_count, colors, font_size, sort_state):
+        """Рисует строки row_views[offset:offset + visible_count] (раскладка — по всем row_views)."""
+        history_size = self.widget.trend_engine.history_size
+        texts = self.longest_texts(row_views)
+        layout_key = (tuple(texts.values()), font_size, history_size)
+        layout_changed = layout_key != self.layout_key
+        if layout_changed:
+            self.layout = self.measure_layout(texts, font_size, history_size)
+            self.layout_key = layout_key
+            self.place_header(font_size, history_size)
+        
+        # Пул строк меняется только при изменении числа видимых строк
+        while len(self.slots) < visible_count:
+            self.slots.append(self.create_slot())
+            self.place_slot(self.slots[-1], len(self.slots) - 1)
+        while len(self.slots) > visible_count:
+            slot = self.slots.pop()
+            for item in [slot[key] for key in self.COLUMNS if key != 'trend'] + slot['trend']:
+                self.canvas.delete(item)
+                self.item_cache.pop(item, None)
+        if layout_changed:
+            for slot_num, slot in enumerate(self.slots):
+                self.place_slot(slot, slot_num)
+        self.link_items = {slot['name']: slot_num for slot_num, slot in enumerate(self.slots)}
+        
+        # Цвета заголовков и значки сортировки
+        column, direction = sort_state
+        for item in self.header_items.values():
+            self.set_item(item, fill=colors['header_fg'])
+        for key, item in self.sort_items.items():
+            text = ("▼" if direction == 'DESC' else "▲") if key == column else "↕"
+            self.set_item(item, text=text, fill=colors['header_fg'])
+        self.set_item(self.header_line, fill=colors['separator_bg'])
+        
+        height = self.layout['rows_top'] + visible_count * self.layout['row_h']
+        if self.item_cache.get('canvas') != (colors['bg'], self.layout['width'], height):
+            self.canvas.configure(bg=colors['bg'], width=self.layout['width'], height=height)
+            self.item_cache['canvas'] = (colors['bg'], self.layout['width'], height)
+        
+        font = ('Arial', font_size)
+        bold_font = ('Arial', font_size, 'bold')
+        small_font = ('Arial', max(8, font_size - 2))
+        self.link_colors = (colors['link_fg'], colors['link_hover_fg'])
+        self.slot_api_ids = [view['api_id'] for view in row_views[offset:offset + visible_count]]
+        
+        for slot, view in zip(self.slots, row_views[offset:offset + visible_count]):
+            self.set_item(slot['name'], text=f"{view['name']}:", fill=colors['link_fg'], font=bold_font)
+            self.set_item(slot['amount'], text=view['amount_text'], fill=colors['amount_fg'], font=font)
+            if view['has_data']:
+                trend = view['trend']
+                self.set_item(slot['price'], text=view['price_text'], fill=colors['price_fg'], font=font)
+                self.set_item(slot['value'], text=view['value_text'], fill=colors['total_value_fg'], font=bold_font)
+                self.set_item(slot['change'], text=view['change_text'], fill=view['change_color'], font=small_font)
+                self.set_item(slot['separator'], text=" | ", fill=colors['fg'], font=small_font)
+                self.set_item(slot['change_24h'], text=view['change_24h_text'], fill=view['change_24h_color'], font=small_font)
+            else:
+                trend = [("❓", colors['fg'])] * history_size
+                self.set_item(slot['price'], text="---", fill=colors['fg'], font=font)
+                self.set_item(slot['value'], text="---", fill=colors['fg'], font=font)
+                self.set_item(slot['change'], text="---", fill=colors['fg'], font=small_font)
+                self.set_item(slot['separator'], text="", fill=colors['fg'], font=small_font)
+                self.set_item(slot['change_24h'], text="", fill=colors['fg'], font=small_font)
+            
+            # Значки тренда: недостающие позиции заполняются пробелами
+            trend = list(trend) + [(" ", 'gray')] * (history_size - len(trend))
+            for item, (icon, color) in zip(slot['trend'], trend):
+                self.set_item(item, text=icon, fill=color, font=small_font)
+
+
 # --- GUI Виджет (Основное окно) ---
 class CryptoWidget(tk.Tk):
     def __init__(self):
         super().__init__()
         self.config = load_config()
+        configure_api(self.config)
         
         self._x = 0
         self._y = 0
         
         self.prev_prices = {} 
         self.current_prices = {} 
-        
-        # trend_history: {api_id: [('▲', 'green'), ('▬', 'gray'), ...]}
-        self.trend_history = {api_id: [] for api_id in self.config['coins']}
-        
-        self.progress_value = 0
-        self.max_progress = REFRESH_RATE_MS // 1000 
+        self.current_data = {} # Последние полученные данные (рисуются, пока идет новый запрос)
+        
+        # История трендов: кольцевые буферы значков [('▲', 'green'), ('▬', 'gray'), ...] по каждой монете.
+        # История и последние цены восстанавливаются с диска, чтобы тренд не начинался заново
+        self.trend_engine = TrendEngine(self.config.get('trend_history_size', HISTORY_SIZE))
+        self.signal_engine = SignalEngine() # Отбор уведомлений: без повторов раз в минуту по той же серии
+        self.signal_engine.configure(self.config)
+        self.trend_store = TrendStore()
+        self.prev_prices, trend_history = self.trend_store.load(self.config['coins'].keys(), PIVOT_CURRENCY, self.trend_engine.history_size)
+        self.trend_engine.load(trend_history)
+        self.current_prices = self.prev_prices.copy() # Станут prev_prices при первом обновлении
+        # Аналитика портфеля по истории цен (NumPy): загружается в фоне после первого обновления,
+        # чтобы импорт NumPy и чтение истории не замедляли запуск и не останавливали окно
+        self.analytics = None
+        self.analytics_thread = None
+        self.analytics_backlog = [] # Цены, пришедшие пока история загружалась [(цены, время)]; None — загрузка закончена
+        self.analytics_result = None
+        
+        # Снимок прошлого запуска: таблица рисуется сразу (с пометкой "устарели"), свежие данные
+        # приходят из фонового запроса. Цены снимка — база для сравнения, только если они не слишком старые.
+        snapshot = load_market_snapshot()
+        self.current_data = snapshot['data']
+        if snapshot['fetched_at'] is not None and time.time() - snapshot['fetched_at'] <= HISTORY_PREV_PRICE_MAX_AGE_SEC:
+            self.current_prices.update(snapshot['prices'])
+        self.snapshot_saved_at = None # time.monotonic() последнего сохранения снимка
+        self.snapshot_thread = None # Фоновое сохранение снимка (destroy дожидается его перед последним)
+        
+        # Очередь обновления монет: у каждой монеты свой интервал ("refresh_sec"), наступившие сроки — одним запросом
+        self.refresh_queue = CoinRefreshQueue()
+        self.refresh_queue.set_tiers(get_coin_refresh_tiers(self.config))
+        # Планировщик запросов (интервал адаптируется к лимитам API)
+        self.refresh_scheduler = RefreshScheduler(self.get_refresh_base_interval())
+        
+        # --- Фоновая загрузка: Инициализация ---
+        self.fetch_worker = PriceFetchWorker()
+        self.fetch_worker.start()
+        self.fetch_in_progress = False
+        self.rest_fetched_at = None # time.monotonic() последнего удачного ответа API
+        
+        # Поток цен по WebSocket (если задан stream_url): цены между запросами приходят сразу
+        self.price_stream = None
+        self.stream_prices = {} # Последние цены из потока {api_id: (цена, время получения)}
+        self.configure_stream()
+        # ---------------------------------------
         
         # --- Трей: Инициализация ---
         self.tray_icon = None
         self.is_hidden = False # Флаг, скрыт ли виджет
         self.tray_thread = None # Поток для pystray
+        self.notification_window = None # Создается при первом сигнале и потом только скрывается
+        self.coin_index = None # Индекс монет CoinGecko для настроек (загружается в фоне при первом открытии)
+        self.coin_index_thread = None
         # ---------------------------
 
         # --- СОРТИРОВКА: Инициализация ---
@@ -664,13 +1076,24 @@ class CryptoWidget(tk.Tk):
         
         self.attributes('-alpha', self.config.get('opacity', 0.95)) 
         
-        self.coins_frame = tk.Frame(self)
+        self.theme_registry = ThemeRegistry()
+        
+        self.coins_frame = self.theme_registry.register(tk.Frame(self), 'background')
         self.coins_frame.pack(padx=10, pady=(5, 0), fill='both', expand=True) 
         
-        self.portfolio_frame = tk.Frame(self)
+        self.portfolio_frame = self.theme_registry.register(tk.Frame(self), 'background')
         self.portfolio_frame.pack(side=tk.BOTTOM, fill='x', padx=10, pady=(0, 5)) 
         
-        self.bottom_frame = tk.Frame(self) # Сделали self.bottom_frame для доступа к теме
+        # Строки-слоты таблицы: создаются только для видимой части списка и переиспользуются при прокрутке
+        self.row_slots = []
+        self.row_views = [] # Данные всех строк в порядке отображения
+        self.table_style = None # (цвета, размер шрифта) последней отрисовки
+        self.scroll_offset = 0 # Индекс первой видимой строки
+        self.visible_row_count = 0
+        self.build_table_header()
+        self.build_portfolio_total()
+        
+        self.bottom_frame = self.theme_registry.register(tk.Frame(self), 'background')
         self.bottom_frame.pack(side=tk.BOTTOM, fill='x', padx=5, pady=(0, 5))
         
         self.progress_bar = ttk.Progressbar(
@@ -678,8 +1101,8 @@ class CryptoWidget(tk.Tk):
             orient='horizontal', 
             length=200, 
             mode='determinate',
-            maximum=self.max_progress,
-            value=self.progress_value
+            maximum=self.refresh_scheduler.cycle_length(),
+            value=0
         )
         self.progress_bar.pack(side=tk.LEFT, fill='x', expand=True, padx=(5, 10))
         
@@ -688,18 +1111,26 @@ class CryptoWidget(tk.Tk):
             font=('Arial', 10, 'bold'),
         )
         self.settings_button.pack(side=tk.RIGHT) 
+        self.theme_registry.register(self.settings_button, 'text')
+        
+        # Пометка устаревших данных (показывается, пока API недоступен и выводятся данные из кэша)
+        self.stale_since = get_stale_since(self.current_data)
+        self.stale_label = self.theme_registry.register(tk.Label(self.bottom_frame, fg='#FF6600', font=('Arial', 9, 'bold')), 'background')
 
         self.bind("<Button-1>", self.start_move)
         self.bind("<B1-Motion>", self.do_move)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.bind(sequence, self.on_table_mousewheel) # Прокрутка таблицы (проверка — в обработчике)
         self.settings_button.bind("<Button-1>", self.open_settings_and_break)
         
         self.protocol("WM_DELETE_WINDOW", self.on_close)
         self.protocol("WM_ICONIFY", self.on_minimize) 
         
-        # Первое обновление
+        # Первое обновление (запрос уходит в фоновый поток, окно рисуется сразу)
         self.update_widget()
         self.load_window_position()
         self.update_progress()
+        self.after(FETCH_POLL_MS, self.process_fetch_results)
         
         self.apply_theme() # ПРИМЕНЕНИЕ ТЕМЫ ПОСЛЕ СОЗДАНИЯ ВСЕХ ВИДЖЕТОВ
 
@@ -712,51 +1143,14 @@ class CryptoWidget(tk.Tk):
         # 1. Основное окно
         self.configure(bg=colors['bg'])
         
-        # 2. Перекрашивание виджетов
-        self.recolorize_widgets(self, colors)
+        # 2. Виджеты, зарегистрированные по ролям (фреймы, кнопки)
+        self.theme_registry.apply(colors)
+        
+        # 3. Таблица, заголовки и итог портфеля: кэш ячеек сам увидит новые цвета
+        self.update_widget(recalculate_order=False)
         
         # Обновление прогресс-бар (поскольку это ttk, фон не меняется, но это не критично)
         self.progress_bar.configure(style=f'TProgressbar')
-        
-    def recolorize_widgets(self, parent, colors):
-        """Рекурсивно меняет цвета у всех виджетов внутри фрейма/окна."""
-        for widget in parent.winfo_children():
-            try:
-                # Метки и кнопки: меняем фон
-                if isinstance(widget, (tk.Label, tk.Button, tk.Checkbutton, tk.Radiobutton)):
-                    # Игнорируем специфичные цвета для трендов, изменений и т.д.
-                    current_fg = widget.cget('fg')
-                    
-                    if current_fg in ['gray', 'green', 'red']:
-                         # Это специфичная метка с данными, меняем только фон
-                         widget.configure(bg=colors['bg'])
-                    elif widget.cget('text').endswith(':') and widget.master in [self.coins_frame, self.portfolio_frame]: 
-                         # Заголовки (напр., "Общий Портфель:") и заголовки таблицы
-                         widget.configure(bg=colors['bg'], fg=colors['header_fg'])
-                    elif current_fg in ['darkmagenta', 'darkgreen', 'darkblue', '#9cdcfe', '#c586c0', '#ffd700']:
-                         # Это специфичная метка с данными, которые будут перерисованы в update_widget
-                         widget.configure(bg=colors['bg'])
-                    elif widget.cget('text') == '⚙':
-                         widget.configure(bg=colors['bg'], fg=colors['fg'])
-                    else:
-                         # Обычный текст
-                         widget.configure(bg=colors['bg'], fg=colors['fg'])
-                    
-                    if isinstance(widget, tk.Button):
-                        widget.configure(bg=colors['bg'])
-
-                # Фреймы
-                elif isinstance(widget, (tk.Frame, ttk.Frame)):
-                    widget.configure(bg=colors['bg'])
-                    self.recolorize_widgets(widget, colors) # Рекурсия
-                    
-            except tk.TclError:
-                # Некоторые виджеты не имеют bg/fg
-                pass
-                
-        # Специальный случай для разделителей
-        for sep in [w for w in parent.winfo_children() if isinstance(w, tk.Frame) and w.cget('height') == 1]:
-            sep.configure(bg=colors['separator_bg'])
 
     # --- Методы трея ---
     
@@ -771,6 +1165,7 @@ class CryptoWidget(tk.Tk):
     
     def setup_tray_icon(self):
         """Создает объект иконки трея и меню."""
+        pystray = crypto_core.timed_import('pystray')
         
         def show_window(icon, item):
             """Обработчик для показа окна (запускается в потоке трея)."""
@@ -851,12 +1246,21 @@ class CryptoWidget(tk.Tk):
                 self.tray_icon.stop() 
             self.destroy()
 
+    def destroy(self):
+        """Сохраняет снимок данных, дописывает отложенные настройки и закрывает базу истории перед выходом."""
+        if self.price_stream is not None:
+            self.price_stream.stop()
+        if self.snapshot_thread is not None:
+            self.snapshot_thread.join() # Иначе старый снимок из фона может заменить последний
+        if self.current_data:
+            save_market_snapshot(self.current_data, self.current_prices)
+        config_persister.flush()
+        self.trend_store.close()
+        super().destroy()
+
     # --- Методы сортировки ---
     def update_sort_button_labels(self):
         """Обновляет иконки на кнопках сортировки в соответствии с self.sort_state."""
-        theme_name = self.config.get('theme', 'light')
-        colors = THEMES.get(theme_name, THEMES['light'])
-        
         column, direction = self.sort_state
         
         for key, button in self.sort_button_labels.items():
@@ -867,8 +1271,6 @@ class CryptoWidget(tk.Tk):
                     button.config(text="▲")
             else:
                 button.config(text="↕")
-            
-            button.config(bg=colors['bg'], fg=colors['header_fg'])
 
     def sort_by_column(self, column_key):
         """Реализует тройную логику сортировки: DESC -> ASC -> Initial."""
@@ -888,9 +1290,25 @@ class CryptoWidget(tk.Tk):
             return
 
         self.sort_state = (column_key, new_direction)
+
+        # Применяем сортировку к списку ключей
+        try:
+            self.apply_sort_order()
+            self.update_widget(recalculate_order=False)
+        except Exception as e:
+            print(f"Ошибка сортировки по {column_key}: {e}")
+            messagebox.showerror("Ошибка Сортировки", f"Не удалось отсортировать по полю {column_key}.")
+
+    def apply_sort_order(self):
+        """Пересчитывает self.coin_order_list по текущему self.sort_state (без перерисовки)."""
+        column_key, direction = self.sort_state
+        self.coin_order_list = self.initial_coin_order[:]
+        
+        if column_key is None:
+            return
         
         # Определяем функцию-ключ для сортировки
-        reverse = (new_direction == 'DESC')
+        reverse = (direction == 'DESC')
         
         if column_key == 'name':
             # Сортировка по отображаемому имени (строка)
@@ -906,31 +1324,191 @@ class CryptoWidget(tk.Tk):
                 # Используем 0.0, если цена еще не загружена или API вернул ошибку
                 return self.current_prices.get(api_id, 0.0)
 
-        # Применяем сортировку к списку ключей
-        try:
-            self.coin_order_list.sort(key=sort_key, reverse=reverse)
-            self.update_widget(recalculate_order=False)
-        except Exception as e:
-            print(f"Ошибка сортировки по {column_key}: {e}")
-            messagebox.showerror("Ошибка Сортировки", f"Не удалось отсортировать по полю {column_key}.")
+        self.coin_order_list.sort(key=sort_key, reverse=reverse)
 
     # --- Остальные методы ---
     def update_progress(self):
-        """Обновляет значение прогресс-бара каждую секунду и вызывает обновление данных при завершении."""
-        self.progress_value += 1
-        if self.progress_value >= self.max_progress:
+        """
+        Обновляет прогресс-бар каждую секунду (показывает время до следующего запроса
+        по планировщику) и вызывает обновление данных, когда запрос пора выполнять.
+        """
+        scheduler = self.refresh_scheduler
+        if not self.fetch_in_progress and scheduler.is_due():
             # При обновлении данных, всегда возвращаемся к исходному порядку, 
             # но сохраняем текущий режим сортировки для повторного применения
-            self.update_widget(recalculate_order=True)
-        self.progress_bar['value'] = self.progress_value % self.max_progress 
+            if self.stream_covers_refresh():
+                # Свежие цены уже пришли из потока: точка тренда по монетам, чей срок наступил, без запроса к API
+                now = time.monotonic()
+                updated_ids = self.refresh_queue.pop_due(now)
+                self.schedule_next_batch(now)
+                if updated_ids:
+                    self.update_widget(recalculate_order=True, data=dict(self.current_data), updated_ids=updated_ids)
+                    self.save_snapshot_if_due()
+            else:
+                self.update_widget(recalculate_order=True)
+            
+        cycle = scheduler.cycle_length()
+        self.progress_bar.configure(maximum=cycle, value=cycle - scheduler.seconds_until_next())
+        self.update_stale_label()
         self.after(1000, self.update_progress) 
 
+    def update_stale_label(self):
+        """Показывает возраст устаревших данных (или скрывает пометку, если данные свежие)."""
+        if self.stale_since is None:
+            if self.stale_label.winfo_manager():
+                self.stale_label.pack_forget()
+            return
+            
+        age_sec = max(0, int(time.time() - self.stale_since))
+        age_text = f"{age_sec} сек" if age_sec < 60 else f"{age_sec // 60} мин" if age_sec < 3600 else f"{age_sec // 3600} ч"
+        self.stale_label.configure(text=f"⚠ данные устарели: {age_text}", bg=self.bottom_frame.cget('bg'), fg='#FF6600')
+        if not self.stale_label.winfo_manager():
+            self.stale_label.pack(side=tk.RIGHT, padx=(0, 5))
+
+    def request_prices(self):
+        """Отправляет запрос цен в фоновый поток, не блокируя основной цикл Tkinter."""
+        if self.fetch_in_progress:
+            return # Предыдущий запрос еще выполняется
+            
+        now = time.monotonic()
+        if not self.refresh_queue.is_due(now):
+            self.schedule_next_batch(now) # Ни одной монете еще не пора обновляться
+            return
+        if not self.refresh_scheduler.try_acquire(now):
+            return # Лимит запросов исчерпан: планировщик выполнит запрос позже
+            
+        self.progress_bar.configure(maximum=self.refresh_scheduler.cycle_length(), value=0)
+        self.fetch_in_progress = True
+        # Цены всегда запрашиваются в опорной валюте: валюты виджета получаются пересчетом по курсам
+        self.fetch_worker.submit(self.refresh_queue.pop_due(now), PIVOT_CURRENCY)
+
+    def schedule_next_batch(self, now):
+        """Назначает плановое обновление на срок ближайшей монеты в очереди."""
+        wait = self.refresh_queue.seconds_until_next(now)
+        self.refresh_scheduler.schedule(self.refresh_scheduler.base_interval if wait is None else wait, now)
+
+    def get_refresh_base_interval(self):
+        """Базовый интервал планировщика — самый короткий интервал среди монет."""
+        return min(self.refresh_queue.tiers.values(), default=self.config.get('refresh_rate_ms', REFRESH_RATE_MS) / 1000)
+
+    def process_fetch_results(self):
+        """Разбирает очередь результатов фонового потока (вызывается через after)."""
+        latest = None
+        try:
+            while True:
+                latest = self.fetch_worker.results.get_nowait()
+        except queue.Empty:
+            pass
+            
+        ticks = self.drain_stream_ticks()
+        rendered = False
+            
+        if latest is not None:
+            self.fetch_in_progress = False
+            coin_ids, currency, data, status, retry_after = latest
+            self.refresh_scheduler.on_result(status, retry_after)
+            if status == FETCH_OK:
+                self.rest_fetched_at = time.monotonic()
+            else:
+                self.refresh_queue.mark_due(get_missing_ids(coin_ids, data)) # Повтор — когда разрешит планировщик
+            
+            # Монеты, удаленные из настроек, пока шел запрос, пропускаем (новые уже стоят в очереди)
+            api_coin_ids = set(get_api_coin_ids(self.config))
+            coin_ids = [api_id for api_id in coin_ids if api_id in api_coin_ids]
+            if coin_ids:
+                # Ответ приносит только монеты, срок которых наступил: остальные остаются как были.
+                # Цены из потока, пришедшие позже ответа API, не откатываются назад
+                data = merge_price_ticks(data, self.stream_prices)
+                merged = dict(self.current_data)
+                merged.update({api_id: data[api_id] for api_id in coin_ids if api_id in data})
+                rendered = True
+                self.stale_since = get_stale_since(merged)
+                self.update_widget(recalculate_order=True, data=merged, updated_ids=coin_ids)
+                self.update_stale_label()
+                self.save_snapshot_if_due()
+                
+            if self.refresh_queue.is_due():
+                self.request_prices() # Пока шел запрос, добавились монеты (лимиты проверит планировщик)
+                
+            if startup_timer.elapsed("первые данные") is None:
+                startup_timer.mark("первые данные")
+                if '--startup-report' in sys.argv:
+                    startup_timer.report()
+                    
+        if ticks and not rendered:
+            # Цены из потока только перерисовывают таблицу: точка тренда добавляется раз в интервал обновления
+            merge_price_ticks(self.current_data, ticks)
+            self.stale_since = get_stale_since(self.current_data)
+            self.update_widget(recalculate_order=False)
+            self.update_stale_label()
+                
+        show_config_save_errors()
+        self.after(FETCH_POLL_MS, self.process_fetch_results)
+
+    def configure_stream(self):
+        """Запускает, перезапускает или останавливает поток цен по адресу из настроек и передает ему список монет."""
+        url = resolve_stream_url(self.config)
+        if self.price_stream is not None and self.price_stream.url != url:
+            self.price_stream.stop()
+            self.price_stream = None
+        if url and self.price_stream is None:
+            self.price_stream = PriceStreamWorker(url)
+            self.price_stream.start()
+            
+        coin_ids = get_api_coin_ids(self.config)
+        self.stream_prices = {api_id: tick for api_id, tick in self.stream_prices.items() if api_id in coin_ids}
+        if self.price_stream is not None:
+            self.price_stream.set_coins(coin_ids)
+
+    def drain_stream_ticks(self):
+        """Забирает накопившиеся цены из потока: {api_id: (цена, время)}, по каждой монете — последняя."""
+        ticks = {}
+        if self.price_stream is None:
+            return ticks
+        try:
+            while True:
+                ticks.update(self.price_stream.ticks.get_nowait())
+        except queue.Empty:
+            pass
+        self.stream_prices.update(ticks)
+        return ticks
+
+    def stream_covers_refresh(self):
+        """
+        Можно ли обойтись без планового запроса к API: поток живой, по всем монетам есть цены
+        моложе интервала обновления, а полный ответ API был не раньше STREAM_REST_EVERY_SEC назад.
+        """
+        if self.price_stream is None or not self.price_stream.is_live():
+            return False
+        if self.rest_fetched_at is None or time.monotonic() - self.rest_fetched_at > STREAM_REST_EVERY_SEC:
+            return False
+        now = time.time()
+        max_age = self.refresh_scheduler.base_interval
+        return all(
+            api_id in self.current_data and not self.current_data[api_id].get('stale')
+            and now - self.current_data[api_id].get('fetched_at', 0) <= max_age
+            for api_id in get_api_coin_ids(self.config)
+        )
+
+    def save_snapshot_if_due(self):
+        """Сохраняет снимок последних данных в фоне (после первого запроса и затем раз в SNAPSHOT_SAVE_EVERY_SEC)."""
+        now = time.monotonic()
+        if self.snapshot_saved_at is not None and now - self.snapshot_saved_at < SNAPSHOT_SAVE_EVERY_SEC:
+            return
+        if not self.current_data or self.stale_since is not None:
+            return # Сохраняем только свежие данные
+        self.snapshot_saved_at = now
+        self.snapshot_thread = threading.Thread(
+            target=save_market_snapshot, args=(dict(self.current_data), dict(self.current_prices)), daemon=True
+        )
+        self.snapshot_thread.start()
+
     def open_coin_link(self, api_id):
         url = f"https://www.coingecko.com/coins/{api_id}" 
-        webbrowser.open(url)
+        open_url(url)
         
     def open_developer_link(self):
-        webbrowser.open("https://github.com/pavekscb/Crypto-Widget-Desktop.git")
+        open_url("https://github.com/pavekscb/Crypto-Widget-Desktop.git")
 
     def open_settings_and_break(self, event):
         self.open_settings()
@@ -1028,41 +1606,13 @@ class CryptoWidget(tk.Tk):
              else:
                  return "0.00"
         
-    def calculate_change_percent(self, current_price, prev_price):
-        if prev_price is None or prev_price == 0:
-            return 0.0, "(0.00%)", "gray" 
-            
-        try:
-            threshold = self.config.get('trend_threshold_percent', 0.01)
-            change = ((current_price - prev_price) / prev_price) * 100
-
-            if change > threshold:
-                color = 'green'
-                prefix = '+'
-            elif change < -threshold:
-                color = 'red'
-                prefix = ''
-            else:
-                color = 'gray'
-                prefix = ''
-                
-            return change, f"({prefix}{change:.2f}%)", color
-        except Exception:
-            return 0.0, "(0.00%)", "gray"
-            
-    def get_forecast_tuple(self, change_percent):
-        threshold = self.config.get('trend_threshold_percent', 0.01)
-        if change_percent > threshold: return ("▲", "green")
-        elif change_percent < -threshold: return ("▼", "red")
-        else: return ("▬", "gray") 
-
     def show_forecast_explanation(self, event):
         explanation = ("ЛОГИКА ПРОГНОЗА И ИСТОРИИ ТРЕНДОВ:\n\nЭти значки отображают ПРЕДПОЛОЖЕНИЕ о продолжении тренда, "
-                       f"основанное на изменении курса за последние {REFRESH_RATE_MS // 1000} секунд (интервал обновления).\n\n"
+                       f"основанное на изменении курса за последние {int(self.refresh_scheduler.base_interval)} секунд (интервал обновления).\n\n"
                        " • ▲ (Зеленый): Цена выросла более чем на 0.01% с последнего обновления.\n • ▼ (Красный): Цена упала более чем на 0.01%.\n"
                        " • ▬ (Серый): Цена осталась стабильной (изменение менее 0.01%).\n\n"
                        "СТОЛБЕЦ ТРЕНДА:\n"
-                       f"Визуализация показывает **{HISTORY_SIZE} последних** трендов. Инерция.\n\n"
+                       f"Визуализация показывает **{self.trend_engine.history_size} последних** трендов. Инерция.\n\n"
                        "УВЕДОМЛЕНИЯ О ТРЕНДАХ:\n"
                        "Всплывающее ОКНО появляется, когда 2, 3, 4 или 5 индикаторов подряд одинаковые (по всем монетам в одном сообщении)."
                       )
@@ -1107,100 +1657,89 @@ class CryptoWidget(tk.Tk):
         if mode == 'tray_only' and not self.is_hidden:
             return # Окно открыто, а режим "только в трее"
 
-        # Запускаем окно уведомления в основном потоке Tkinter
-        NotificationWindow(self, active_signals, duration)
-
+        # Одно окно на все время работы: новые сигналы добавляются в уже открытое
+        if self.notification_window is None:
+            self.notification_window = NotificationWindow(self)
+        self.notification_window.show_signals(active_signals, duration)
 
-    def update_widget(self, recalculate_order=True):
-        """Обновляет курсы и перерисовывает виджет в виде таблички."""
-        
-        font_size = self.config['font_size']
-        # Собираем уникальные базовые ID для API-запроса (aptos_2 → aptos)
-        #coin_ids = list(self.config['coins'].keys())
-        coin_ids = []
-        for cid in self.config['coins'].keys():
-            base_id = cid.split('_')[0]  # отрезаем "_2", "_3" и т.д.
-            if base_id not in coin_ids:
-                coin_ids.append(base_id)
 
-        currency = self.config['base_currency']
-        
-        theme_name = self.config.get('theme', 'light')
-        colors = THEMES.get(theme_name, THEMES['light'])
-        
-        active_trend_signals = [] # НОВАЯ ПЕРЕМЕННАЯ ДЛЯ СБОРА СИГНАЛОВ
-        
-        # 1. Если это первое или полное обновление, обновляем данные и порядок
-        if recalculate_order:
-            self.progress_value = 0 
-            self.progress_bar['value'] = self.progress_value
-            self.prev_prices = self.current_prices.copy()
-            data = get_crypto_prices(coin_ids, currency)
-            self.current_prices.clear()
-            self.current_data = data 
-            
-            self.initial_coin_order = list(self.config['coins'].keys())
-            self.coin_order_list = self.initial_coin_order[:]
-            
-            # Повторное применение сортировки, если она была активна
-            if self.sort_state[0] is not None:
-                temp_state = self.sort_state 
-                self.sort_state = (None, None) 
-                self.sort_by_column(temp_state[0])
+    def build_table_header(self):
+        """
+        Создает заголовки таблицы для выбранного способа отрисовки (config['table_renderer']):
+        'labels' — сетка из Label-виджетов, 'canvas' — один холст (CanvasTable).
+        """
+        self.header_widgets = [] # [(виджет, роль)] для обновления шрифтов (цвета — через theme_registry)
+        self.sort_button_labels = {} 
+        self.header_style = None # Последний примененный размер шрифта
+        self.table_renderer = self.config.get('table_renderer', 'labels')
+        
+        if self.table_renderer == 'canvas':
+            # Заголовки рисуются на холсте вместе со строками
+            self.canvas_table = CanvasTable(self, self.coins_frame)
+            for col_num in range(7):
+                self.coins_frame.grid_columnconfigure(col_num, weight=0)
         else:
-            data = self.current_data 
-
-        # 2. Очистка и отрисовка фреймов
-        for widget in self.coins_frame.winfo_children(): widget.destroy()
-        for widget in self.portfolio_frame.winfo_children(): widget.destroy()
-             
-        row_num = 0
-        total_portfolio_value = 0.0
+            self.canvas_table = None
+            self.build_label_header()
+        
+        # Полоса прокрутки (показывается, только если монет больше, чем видимых строк).
+        # Без тега окна в bindtags, чтобы перетаскивание ползунка не двигало виджет.
+        self.table_scrollbar = tk.Scrollbar(self.coins_frame, orient='vertical', command=self.on_table_scrollbar)
+        self.table_scrollbar.bindtags((str(self.table_scrollbar), 'Scrollbar', 'all'))
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.table_scrollbar.bind(sequence, self.on_table_mousewheel)
+
+    def rebuild_table(self):
+        """Пересоздает таблицу (после смены способа отрисовки в настройках)."""
+        for widget in self.coins_frame.winfo_children():
+            widget.destroy()
+        self.row_slots = []
+        self.build_table_header()
 
-        # --- Заголовки столбцов с кнопками сортировки ---
-        header_font = ('Arial', max(8, font_size - 4), 'bold')
-        button_font = ('Arial', max(6, font_size - 6))
-        self.sort_button_labels = {} 
-        
+    def build_label_header(self):
+        """Заголовки таблицы из Label-виджетов (строки — CoinRow)."""
         # Создание фрейма для заголовка и кнопки
         def create_header_with_sort(col_key, text, col_num, sticky='w'):
-            frame = tk.Frame(self.coins_frame, bg=colors['bg'])
-            frame.grid(row=row_num, column=col_num, sticky=sticky, padx=(0, 5) if sticky=='w' else (5, 0))
+            frame = self.theme_registry.register(tk.Frame(self.coins_frame), 'background')
+            frame.grid(row=0, column=col_num, sticky=sticky, padx=(0, 5) if sticky=='w' else (5, 0))
             
-            header_label = tk.Label(frame, text=text, font=header_font, bg=colors['bg'], fg=colors['header_fg'], cursor="question_arrow")
+            header_label = self.theme_registry.register(tk.Label(frame, text=text, cursor="question_arrow"), 'header')
             header_label.pack(side=tk.LEFT)
             
             sort_btn = tk.Button(
                 frame, 
                 text="↕", 
                 command=lambda key=col_key: self.sort_by_column(key),
-                font=button_font,
                 padx=2,
                 pady=0,
                 cursor="hand2",
                 relief=tk.FLAT,
-                bd=0,
-                bg=colors['bg'],
-                fg=colors['header_fg']
+                bd=0
             )
             sort_btn.pack(side=tk.LEFT, padx=(2, 0))
+            self.theme_registry.register(sort_btn, 'header')
             self.sort_button_labels[col_key] = sort_btn
             
             if col_key == 'name':
                 header_label.bind("<Button-1>", self.show_coin_explanation)
             elif col_key == 'amount':
                 header_label.bind("<Button-1>", self.show_portfolio_explanation)
+                
+            self.header_widgets += [(header_label, 'header'), (sort_btn, 'sort_button')]
 
         create_header_with_sort('name', 'Монета:', 0, sticky='w')
         create_header_with_sort('amount', 'Количество:', 1, sticky='e')
         create_header_with_sort('price', 'Курс:', 2, sticky='e')
 
         # Остальные заголовки без сортировки
-        tk.Label(self.coins_frame, text="Стоимость:", font=header_font, bg=colors['bg'], fg=colors['header_fg']).grid(row=row_num, column=3, sticky='e', padx=(5, 10))
-        tk.Label(self.coins_frame, text="Изм. % | за 24часа:", font=header_font, bg=colors['bg'], fg=colors['header_fg']).grid(row=row_num, column=4, sticky='e', padx=(5, 10))
-        forecast_header_label = tk.Label(self.coins_frame, text=f"Тренд ({HISTORY_SIZE}x):", font=header_font, bg=colors['bg'], fg=colors['header_fg'], cursor="question_arrow") 
-        forecast_header_label.grid(row=row_num, column=5, sticky='e', padx=(5, 0))
-        forecast_header_label.bind("<Button-1>", self.show_forecast_explanation)
+        value_header_label = self.theme_registry.register(tk.Label(self.coins_frame, text="Стоимость:"), 'header')
+        value_header_label.grid(row=0, column=3, sticky='e', padx=(5, 10))
+        change_header_label = self.theme_registry.register(tk.Label(self.coins_frame, text="Изм. % | за 24часа:"), 'header')
+        change_header_label.grid(row=0, column=4, sticky='e', padx=(5, 10))
+        self.forecast_header_label = self.theme_registry.register(tk.Label(self.coins_frame, cursor="question_arrow"), 'header')
+        self.forecast_header_label.grid(row=0, column=5, sticky='e', padx=(5, 0))
+        self.forecast_header_label.bind("<Button-1>", self.show_forecast_explanation)
+        self.header_widgets += [(value_header_label, 'header'), (change_header_label, 'header'), (self.forecast_header_label, 'header')]
         
         # Настройка весов столбцов
         self.coins_frame.grid_columnconfigure(0, weight=0)
@@ -1210,155 +1749,292 @@ class CryptoWidget(tk.Tk):
         self.coins_frame.grid_columnconfigure(4, weight=1)
         self.coins_frame.grid_columnconfigure(5, weight=0)
 
-        row_num += 1
-        tk.Frame(self.coins_frame, height=1, bg=colors['separator_bg']).grid(row=row_num, columnspan=6, sticky='ew', pady=(2, 5))
-        row_num += 1
+        self.header_separator = self.theme_registry.register(tk.Frame(self.coins_frame, height=1), 'separator')
+        self.header_separator.grid(row=1, columnspan=6, sticky='ew', pady=(2, 5))
+
+    def build_portfolio_total(self):
+        """Создает строку общей стоимости портфеля (один раз за время жизни окна)."""
+        # --- Общая стоимость портфеля ---
+        self.portfolio_separator = self.theme_registry.register(tk.Frame(self.portfolio_frame, height=1), 'separator')
+        self.portfolio_separator.pack(fill='x', pady=2)
+
+        self.total_label = tk.Label(self.portfolio_frame, text="Общий Портфель:")
+        self.total_label.pack(side=tk.LEFT, padx=5, pady=2)
         
-        self.update_sort_button_labels()
+        self.total_value_label = tk.Label(self.portfolio_frame)
+        self.total_value_label.pack(side=tk.RIGHT, padx=5, pady=2)
         
-        # --- Строки с курсами (Используем self.coin_order_list для порядка) ---
-        for api_id in self.coin_order_list:
-            coin_data = self.config['coins'].get(api_id, {"name": api_id.upper(), "amount": 0.0})
-            
-            display_name = coin_data.get('name', api_id.upper())
-            amount = coin_data.get('amount', 0.0)
-            current_value = 0.0
-            
-            # Колонка 0: Имя монеты
-            name_label = tk.Label(self.coins_frame, text=f"{display_name}:", fg=colors['link_fg'], bg=colors['bg'], font=('Arial', font_size, 'bold'), cursor="hand2")
-            name_label.grid(row=row_num, column=0, sticky='w', padx=(0, 5))
-            name_label.bind("<Button-1>", lambda e, id=api_id: self.open_coin_link(id))
-            name_label.bind("<Enter>", lambda e, l=name_label: l.config(fg=colors['link_hover_fg']))
-            name_label.bind("<Leave>", lambda e, l=name_label: l.config(fg=colors['link_fg']))
-            
-            # Колонка 1: Количество монет (Amount)
-            tk.Label(self.coins_frame, text=self.format_amount(amount), fg=colors['amount_fg'], bg=colors['bg'], font=('Arial', font_size)).grid(row=row_num, column=1, sticky='e', padx=(5, 10))
+        # Прибыль/убыток и просадка (показывается, когда есть аналитика)
+        self.analytics_label = self.theme_registry.register(tk.Label(self.portfolio_frame, justify=tk.RIGHT, anchor='e'), 'header')
 
+    def render_table(self, row_views, colors, font_size):
+        """
+        Перерисовывает таблицу по row_views (все монеты в порядке отображения).
+        Виджеты есть только у видимых строк, см. render_visible_rows.
+        """
+        self.row_views = row_views
+        self.table_style = (colors, font_size)
+        if self.canvas_table is not None:
+            self.render_visible_rows() # Заголовки CanvasTable рисует сам
+            return
+        
+        self.forecast_header_label.configure(text=f"Тренд ({self.trend_engine.history_size}x):")
+        
+        if self.header_style != font_size:
+            header_font = ('Arial', max(8, font_size - 4), 'bold')
+            button_font = ('Arial', max(6, font_size - 6))
+            for widget, role in self.header_widgets:
+                widget.configure(font=header_font if role == 'header' else button_font)
+            self.header_style = font_size
             
-            base_id = api_id.split('_')[0]
-            if base_id in data and currency in data[base_id]:
-                price = data[base_id][currency]
-                change_24h = data[base_id].get("change_24h", 0.0)
-                self.current_prices[api_id] = price 
-                
-                try:
-                    current_value = amount * price
-                    total_portfolio_value += current_value
-                except Exception:
-                    pass
-                    
-                price_str = self.format_price(price, currency) 
-                prev_price = self.prev_prices.get(api_id)
-                change_percent, change_str, change_color = self.calculate_change_percent(price, prev_price)
-                current_forecast_tuple = self.get_forecast_tuple(change_percent) 
-
-                if prev_price is not None and recalculate_order:
-                    # 1. Обновляем историю
-                    self.trend_history[api_id].append(current_forecast_tuple) 
-                    self.trend_history[api_id] = self.trend_history[api_id][-HISTORY_SIZE:] 
-                    
-                    # 2. Проверяем самую длинную серию одинаковых индикаторов
-                    history = self.trend_history[api_id]
-                    
-                    # Ищем самую длинную серию в конце истории (от 5 до 2)
-                    max_series_length = 0
-                    trend_icon = None
-                    
-                    # Проходим от самой длинной серии (5) до самой короткой (1)
-                    for length in range(HISTORY_SIZE, 0, -1): # 5, 4, 3, 2, 1
-                        if len(history) >= length:
-                            last_n_icons = [t[0] for t in history[-length:]]
-                            
-                            if all(icon == '▲' for icon in last_n_icons):
-                                max_series_length = length
-                                trend_icon = '▲'
-                                break # Нашли самую длинную, выходим
-                            elif all(icon == '▼' for icon in last_n_icons):
-                                max_series_length = length
-                                trend_icon = '▼'
-                                break # Нашли самую длинную, выходим
-
-                    # 3. СБОР СИГНАЛА вместо отправки уведомления
-                    if max_series_length >= 1:
-                        trend_type = "BULLISH" if trend_icon == '▲' else "BEARISH"
-                        
-                        active_trend_signals.append({
-                            'coin_name': display_name,
-                            'trend_type': trend_type,
-                            'series_length': max_series_length,
-                            'change_percent': change_percent
-                        })
-                
-                
-                # Колонка 2: Курс
-                tk.Label(self.coins_frame, text=price_str, fg=colors['price_fg'], bg=colors['bg'], font=('Arial', font_size)).grid(row=row_num, column=2, sticky='e', padx=(5, 10)) 
-                
-                # Колонка 3: Стоимость (Value)
-                tk.Label(self.coins_frame, text=self.format_total_value(current_value, currency), fg=colors['total_value_fg'], bg=colors['bg'], font=('Arial', font_size, 'bold')).grid(row=row_num, column=3, sticky='e', padx=(5, 10)) 
+        self.update_sort_button_labels()
+        self.render_visible_rows()
 
-                # Колонка 4: 
-                #tk.Label(self.coins_frame, text=f"{change_str}, {change_24h:+.2f}%", fg=("green" if change_24h > 0 else "red" if change_24h < 0 else colors['fg']), bg=colors['bg'], font=('Arial', max(8, font_size - 2)), justify='right').grid(row=row_num, column=4, sticky='e', padx=(5, 10))
+    def render_visible_rows(self):
+        """
+        Заполняет строки-слоты монетами из окна [scroll_offset, scroll_offset + число слотов).
+        Слотов не больше max_visible_rows, поэтому высота окна не зависит от размера портфеля.
+        """
+        colors, font_size = self.table_style
+        total = len(self.row_views)
+        visible_count = min(total, max(1, int(self.config.get('max_visible_rows', MAX_VISIBLE_ROWS))))
+        self.scroll_offset = max(0, min(self.scroll_offset, total - visible_count))
+        self.visible_row_count = visible_count
+        
+        if self.canvas_table is not None:
+            self.canvas_table.draw(self.row_views, self.scroll_offset, visible_count, colors, font_size, self.sort_state)
+            self.update_table_scrollbar(row=0, column=1, rowspan=1)
+            return
+        
+        # Пул слотов меняется только при изменении числа видимых строк
+        while len(self.row_slots) < visible_count:
+            row = CoinRow(self, self.coins_frame)
+            row.place(len(self.row_slots) + 2) # 0 — заголовки, 1 — разделитель
+            self.row_slots.append(row)
+        while len(self.row_slots) > visible_count:
+            self.row_slots.pop().destroy()
+        
+        for row, view in zip(self.row_slots, self.row_views[self.scroll_offset:self.scroll_offset + visible_count]):
+            row.api_id = view['api_id']
+            row.update(view, colors, font_size)
+        
+        self.update_table_scrollbar(row=2, column=6, rowspan=visible_count)
+
+    def update_table_scrollbar(self, **grid_options):
+        """Показывает полосу прокрутки (если видна не вся таблица) и обновляет положение ползунка."""
+        total = len(self.row_views)
+        if total > self.visible_row_count:
+            self.table_scrollbar.grid(sticky='ns', **grid_options)
+            self.table_scrollbar.set(self.scroll_offset / total, (self.scroll_offset + self.visible_row_count) / total)
+        elif self.table_scrollbar.winfo_manager():
+            self.table_scrollbar.grid_remove()
+
+    def scroll_table_to(self, offset):
+        """Прокручивает таблицу так, чтобы первой видимой была строка offset."""
+        offset = max(0, min(offset, len(self.row_views) - self.visible_row_count))
+        if offset == self.scroll_offset or self.table_style is None:
+            return
+        self.scroll_offset = offset
+        self.render_visible_rows()
 
-                # Определяем цвета отдельно
-                color_local = change_color
-                color_24h = "green" if change_24h > 0 else "red" if change_24h < 0 else colors['fg']
+    def on_table_scrollbar(self, action, value, unit=None):
+        """Команда полосы прокрутки: 'moveto' (перетаскивание) или 'scroll' (стрелки и клик по полосе)."""
+        if action == 'moveto':
+            self.scroll_table_to(round(float(value) * len(self.row_views)))
+        else:
+            step = self.visible_row_count if unit == 'pages' else 1
+            self.scroll_table_to(self.scroll_offset + int(value) * step)
 
-                # Фрейм для двух значений в одной ячейке
-                frame = tk.Frame(self.coins_frame, bg=colors['bg'])
-                frame.grid(row=row_num, column=4, sticky='e', padx=(5, 10))
+    def on_table_mousewheel(self, event):
+        """Прокрутка колесом мыши над таблицей (Windows/macOS — <MouseWheel>, Linux — Button-4/5)."""
+        if not (self.is_table_widget(event.widget) or event.widget == self.table_scrollbar):
+            return
+        if event.num == 4 or event.delta > 0:
+            self.scroll_table_to(self.scroll_offset - 3)
+        elif event.num == 5 or event.delta < 0:
+            self.scroll_table_to(self.scroll_offset + 3)
+        return "break"
 
-                # Локальное изменение
-                tk.Label(frame, text=f"{change_str}", fg=color_local, bg=colors['bg'], font=('Arial', max(8, font_size - 2))).pack(side='left')
+    def is_table_widget(self, widget):
+        """Лежит ли виджет внутри таблицы (по цепочке родителей: по префиксу имени .!frame совпал бы и с .!frame2)."""
+        while widget is not None:
+            if widget is self.coins_frame:
+                return True
+            widget = getattr(widget, 'master', None) # event.widget бывает строкой (служебные окна Tk)
+        return False
 
-                # Разделительная черта
-                tk.Label(frame,text=" | ", fg=colors['fg'], bg=colors['bg'], font=('Arial', max(8, font_size - 2))).pack(side='left')
+    def render_portfolio_total(self, totals, colors, font_size):
+        """Обновляет общую стоимость портфеля (по строке на каждую валюту портфеля)."""
+        self.total_label.configure(font=('Arial', font_size, 'bold'), bg=colors['bg'], fg=colors['fg'])
+        self.total_value_label.configure(
+            text="\n".join(self.format_total_value(value, currency) for currency, value in totals.items()), 
+            font=('Arial', font_size, 'bold'), bg=colors['bg'], fg=colors['total_value_fg'], justify=tk.RIGHT
+        )
+        
+        if self.analytics_result is None:
+            if self.analytics_label.winfo_manager():
+                self.analytics_label.pack_forget()
+            return
+        self.analytics_label.configure(
+            text=self.format_analytics(self.analytics_result, self.config['base_currency']),
+            font=('Arial', max(8, font_size - 4))
+        )
+        if not self.analytics_label.winfo_manager():
+            # Отдельной строкой под итогом: упаковывается раньше меток итога, поэтому занимает всю ширину
+            self.analytics_label.pack(side=tk.BOTTOM, fill='x', padx=5, before=self.total_label)
+
+    def format_analytics(self, analytics, currency):
+        """Текст аналитики: прибыль/убыток за окна ANALYTICS_WINDOWS и просадка стоимости портфеля."""
+        fx_rates = get_fx_rates()
+        if fx_rates.convert(1.0, currency) is None:
+            currency = PIVOT_CURRENCY # Курса нет — суммы как в истории цен
+            
+        parts = []
+        for name, window in analytics['pnl'].items():
+            label = ANALYTICS_WINDOW_LABELS.get(name, name)
+            if window is None:
+                parts.append(f"{label}: —") # История короче окна
+                continue
+            value = window['value'] if currency == PIVOT_CURRENCY else fx_rates.convert(window['value'], currency)
+            percent = f" ({window['percent']:+.2f}%)" if window['percent'] is not None else ""
+            parts.append(f"{label}: {value:+,.2f}{percent}")
+            
+        return (
+            f"Δ {currency.upper()} " + " · ".join(parts) + "\n"
+            f"Просадка: {analytics['drawdown']:.2f}% (макс. {analytics['max_drawdown']:.2f}%)"
+        )
 
-                # Изменение за 24 часа
-                tk.Label(frame, text=f"{change_24h:+.2f}%", fg=color_24h, bg=colors['bg'], font=('Arial', max(8, font_size - 2))).pack(side='left')
+    def update_analytics(self, result):
+        """
+        Дописывает свежие цены в историю аналитики и пересчитывает ее. При первом вызове NumPy
+        и история загружаются в фоновом потоке, а цены до конца загрузки копятся в analytics_backlog.
+        """
+        if self.analytics_backlog is None:
+            if self.analytics is None:
+                return # NumPy не установлен
+            self.analytics.record(result['fresh_prices'])
+        else:
+            self.analytics_backlog.append((result['fresh_prices'], time.time()))
+            if self.analytics_thread is None:
+                self.analytics_thread = threading.Thread(target=self.load_analytics, args=(self.config,), daemon=True)
+                self.analytics_thread.start()
+            if self.analytics_thread.is_alive():
+                return
+            backlog, self.analytics_backlog = self.analytics_backlog, None
+            if self.analytics is None:
+                return
+            self.analytics.set_holdings(self.config) # Настройки могли измениться, пока история загружалась
+            for prices, ts in backlog:
+                self.analytics.record(prices, ts)
+        self.analytics_result = self.analytics.evaluate()
+
+    def load_analytics(self, config):
+        # Выполняется в фоновом потоке: свое соединение с базой истории, только присваивание, Tk не трогаем
+        trend_store = TrendStore(self.trend_store.path)
+        try:
+            self.analytics = create_portfolio_analytics(config, trend_store)
+        finally:
+            trend_store.close()
 
+    def update_widget(self, recalculate_order=True, data=None, updated_ids=None):
+        """
+        Обновляет курсы и перерисовывает виджет в виде таблички.
+        Если recalculate_order=True, а данные не переданы, запрос уходит в фоновый поток,
+        а виджет пока перерисовывается по последним известным данным.
+        updated_ids — монеты, обновленные этим запросом (None — все): точка тренда и новая
+        база для сравнения только у них.
+        """
+        if recalculate_order and data is None:
+            self.request_prices()
+            recalculate_order = False
+        
+        font_size = self.config['font_size']
+        
+        theme_name = self.config.get('theme', 'light')
+        colors = THEMES.get(theme_name, THEMES['light'])
+        
+        # 1. Если это первое или полное обновление, обновляем данные и порядок
+        if recalculate_order:
+            self.prev_prices = roll_prev_prices(self.prev_prices, self.current_prices, updated_ids)
+            self.current_data = data 
+            
+            self.initial_coin_order = list(self.config['coins'].keys())
+            self.coin_order_list = self.initial_coin_order[:]
+        else:
+            data = self.current_data 
 
+        # 2. Расчет портфеля и трендов (ядро без Tk), история трендов пополняется только при новом запросе
+        result = evaluate_portfolio(
+            self.config, data, self.prev_prices,
+            trend_engine=self.trend_engine if recalculate_order else None,
+            signal_engine=self.signal_engine,
+            coin_order=self.coin_order_list,
+            updated_ids=updated_ids
+        )
+        if recalculate_order:
+            # Перерисовка без нового запроса не меняет базу для сравнения (например, цены из снимка)
+            self.current_prices = result['prices']
+        currency = result['currency'] # Валюта виджета или, пока курсов нет, валюта ответа API
+        
+        # Строки таблицы (сами виджеты не пересоздаются)
+        row_views = {}
+        for api_id, coin in result['coins'].items():
+            view = {
+                'api_id': api_id,
+                'name': coin['name'],
+                'amount_text': self.format_amount(coin['amount']),
+                'has_data': coin['price'] is not None
+            }
+            
+            if view['has_data']:
+                change_24h = coin['change_24h']
+                view.update({
+                    'price_text': self.format_price(coin['price'], currency),
+                    'value_text': self.format_total_value(coin['value'], currency),
+                    'change_text': coin['change_text'],
+                    'change_color': coin['change_color'],
+                    'change_24h_text': f"{change_24h:+.2f}%",
+                    'change_24h_color': "green" if change_24h > 0 else "red" if change_24h < 0 else colors['fg'],
+                    'trend': self.trend_engine.get_history(api_id)
+                })
                 
-                # Колонка 5: История трендов
-                forecast_frame = tk.Frame(self.coins_frame, bg=colors['bg'])
-                forecast_frame.grid(row=row_num, column=5, sticky='e', padx=(5, 0)) 
-                
-                for i, (icon, color) in enumerate(self.trend_history.get(api_id, [])):
-                    tk.Label(forecast_frame, text=icon, fg=color, bg=colors['bg'], font=('Arial', max(8, font_size - 2))).pack(side=tk.LEFT, padx=0, pady=0) 
-                    
-                if len(self.trend_history.get(api_id, [])) < HISTORY_SIZE:
-                    for _ in range(HISTORY_SIZE - len(self.trend_history.get(api_id, []))):
-                         tk.Label(forecast_frame, text=" ", fg='gray', bg=colors['bg'], font=('Arial', max(8, font_size - 2))).pack(side=tk.LEFT, padx=0, pady=0)
+            row_views[api_id] = view
 
+        # Сохраняем цены и новые значки тренда на диск
+        if recalculate_order:
+            self.trend_store.record_refresh(result['fresh_prices'], result['new_trends'], PIVOT_CURRENCY)
+            self.update_analytics(result)
 
-            else:
-                # Если нет данных
-                tk.Label(self.coins_frame, text="---", fg=colors['fg'], bg=colors['bg'], font=('Arial', font_size)).grid(row=row_num, column=2, sticky='e', padx=(5, 10))
-                tk.Label(self.coins_frame, text="---", fg=colors['fg'], bg=colors['bg'], font=('Arial', font_size)).grid(row=row_num, column=3, sticky='e', padx=(5, 10))
-                tk.Label(self.coins_frame, text="---", fg=colors['fg'], bg=colors['bg'], font=('Arial', max(8, font_size - 2))).grid(row=row_num, column=4, sticky='e', padx=(5, 10))
-                tk.Label(self.coins_frame, text="❓" * HISTORY_SIZE, fg=colors['fg'], bg=colors['bg'], font=('Arial', max(8, font_size - 2))).grid(row=row_num, column=5, sticky='e', padx=(5, 0)) 
+        # Повторное применение сортировки, если она была активна (уже по новым ценам)
+        if recalculate_order and self.sort_state[0] is not None:
+            self.apply_sort_order()
 
-            row_num += 1
+        # 3. Отрисовка: обновляем только изменившиеся ячейки (порядок — self.coin_order_list)
+        self.render_table([row_views[api_id] for api_id in self.coin_order_list], colors, font_size)
+        self.render_portfolio_total(result['totals'], colors, font_size)
 
-        # --- Общая стоимость портфеля ---
-        tk.Frame(self.portfolio_frame, height=1, bg=colors['separator_bg']).pack(fill='x', pady=2)
-
-        total_label = tk.Label(self.portfolio_frame, text="Общий Портфель:", font=('Arial', font_size, 'bold'), bg=colors['bg'], fg=colors['fg'])
-        total_label.pack(side=tk.LEFT, padx=5, pady=2)
-        
-        value_label = tk.Label(self.portfolio_frame, text=self.format_total_value(total_portfolio_value, currency), font=('Arial', font_size, 'bold'), bg=colors['bg'], fg=colors['total_value_fg'])
-        value_label.pack(side=tk.RIGHT, padx=5, pady=2)
-
-        # 4. ВЫЗОВ КОНСОЛИДИРОВАННОГО ОКНА УВЕДОМЛЕНИЙ ПОСЛЕ ЗАВЕРШЕНИЯ ЦИКЛА
-        if active_trend_signals:
-            active_trend_signals.sort(key=lambda s: abs(s['change_percent']), reverse=True)
-            self.show_consolidated_notification(active_trend_signals)
+        # 4. ВЫЗОВ КОНСОЛИДИРОВАННОГО ОКНА УВЕДОМЛЕНИЙ ПОСЛЕ ЗАВЕРШЕНИЯ ЦИКЛА (сигналы уже отсортированы)
+        if result['signals']:
+            self.show_consolidated_notification(result['signals'])
 
         self.coins_frame.update_idletasks() 
 
     # --- Методы настроек (SettingsWindow) ---
     def open_settings(self):
         self.save_window_position()
+        self.ensure_coin_index()
         SettingsWindow(self, self.config)
+
+    def ensure_coin_index(self):
+        """Загружает индекс монет в фоновом потоке (с диска, а если он устарел — из API), один раз за время работы."""
+        if self.coin_index is not None or (self.coin_index_thread is not None and self.coin_index_thread.is_alive()):
+            return
+        self.coin_index_thread = threading.Thread(target=self.load_coin_index, daemon=True)
+        self.coin_index_thread.start()
+
+    def load_coin_index(self):
+        # Выполняется в фоновом потоке: только присваивание, Tk не трогаем
+        self.coin_index = load_coin_index()
         
     def apply_settings(self, new_config):
         
@@ -1374,16 +2050,30 @@ class CryptoWidget(tk.Tk):
         save_config(self.config)
 
         self.attributes('-alpha', self.config.get('opacity', 0.95))
+        configure_api(self.config)
+        self.refresh_queue.set_tiers(get_coin_refresh_tiers(self.config))
+        self.refresh_scheduler.set_base_interval(self.get_refresh_base_interval())
         
         # Обновляем initial_coin_order, если были добавлены/удалены монеты
         self.initial_coin_order = list(self.config['coins'].keys())
         self.coin_order_list = self.initial_coin_order[:]
         self.sort_state = (None, None) 
         
-        new_coin_ids = set(self.config['coins'].keys())
-        self.trend_history = {api_id: self.trend_history.get(api_id, []) for api_id in new_coin_ids}
-        
-        self.update_widget()
+        self.trend_engine.resize(self.config.get('trend_history_size', HISTORY_SIZE))
+        self.trend_engine.set_coins(self.config['coins'].keys())
+        self.signal_engine.configure(self.config)
+        self.signal_engine.set_coins(self.config['coins'].keys())
+        if self.analytics is not None and self.analytics_backlog is None:
+            # Новые количества сразу меняют стоимость и доли, история цен сохраняется
+            self.analytics.set_holdings(self.config)
+            self.analytics_result = self.analytics.evaluate()
+        self.configure_stream()
+        
+        if self.config.get('table_renderer', 'labels') != self.table_renderer:
+            self.rebuild_table()
+        
+        # Новый запрос нужен, только если появились монеты (или сократился их интервал): смена валюты — это пересчет по курсам
+        self.update_widget(recalculate_order=self.refresh_queue.is_due())
         self.apply_theme() # Применяем новую тему
 
 # --- GUI Окно Настроек (SettingsWindow) ---
@@ -1393,6 +2083,7 @@ class SettingsWindow(tk.Toplevel):
         self.master = master
         self.config = config.copy() 
         self.coin_amount_entries = {} 
+        self.coin_tier_vars = {} # {api_id: StringVar с подписью интервала обновления}
         
         self.title("Настройки")
         self.grab_set() 
@@ -1463,6 +2154,22 @@ class SettingsWindow(tk.Toplevel):
             bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg']
         ).pack(side=tk.LEFT, padx=10)
 
+        # Способ отрисовки таблицы: холст быстрее для больших списков (меньше виджетов)
+        self.renderer_var = tk.StringVar(value=self.config.get('table_renderer', 'labels'))
+        renderer_frame = tk.Frame(main_content_frame, bg=current_theme_colors['bg'])
+        renderer_frame.pack(pady=(0, 5), anchor='w', padx=10) 
+        
+        for text, value in (("Таблица: виджеты", "labels"), ("Таблица: холст (быстрее)", "canvas")):
+            tk.Radiobutton(
+                renderer_frame, 
+                text=text,
+                variable=self.renderer_var,
+                value=value,
+                selectcolor=select_color,
+                font=('Arial', 9),
+                bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg']
+            ).pack(side=tk.LEFT, padx=10)
+
         tk.Frame(main_content_frame, height=1, bg="gray").pack(fill='x', padx=10, pady=5) 
         
         # --- Настройки Автозапуска ---
@@ -1588,6 +2295,34 @@ class SettingsWindow(tk.Toplevel):
             command=lambda v: self.threshold_label.config(text=f'Текущий: {float(v):.2f}%')
         ).pack(side=tk.LEFT, fill='x', expand=True, padx=(0, 10))
 
+        # --- Пауза перед повтором того же уведомления ---
+        tk.Label(main_content_frame, text="Повтор того же уведомления не чаще (мин):", font=header_font, bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg']).pack(pady=(5, 5)) 
+        cooldown_frame = tk.Frame(main_content_frame, bg=current_theme_colors['bg']); cooldown_frame.pack(fill='x', padx=10)
+        self.cooldown_var = tk.DoubleVar(value=self.config.get('signal_cooldown_sec', SIGNAL_COOLDOWN_SEC) / 60)
+        self.cooldown_label = tk.Label(cooldown_frame, text=f"Текущая: {int(self.cooldown_var.get())} мин", bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg'])
+        self.cooldown_label.pack(side=tk.RIGHT)
+        
+        ttk.Scale(
+            cooldown_frame, from_=0, to=120, orient='horizontal', variable=self.cooldown_var,
+            command=lambda v: self.cooldown_label.config(text=f"Текущая: {int(float(v))} мин")
+        ).pack(side=tk.LEFT, fill='x', expand=True, padx=(0, 10))
+
+        tk.Frame(main_content_frame, height=1, bg="gray").pack(fill='x', padx=10, pady=5)
+
+        # --- Валюты (пересчет по курсам, без повторной загрузки цен) ---
+        tk.Label(main_content_frame, text="Валюты:", font=header_font, bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg']).pack(pady=(5, 5)) 
+        currency_frame = tk.Frame(main_content_frame, bg=current_theme_colors['bg']); currency_frame.pack(fill='x', padx=10)
+        
+        tk.Label(currency_frame, text="Валюта виджета:", bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg']).pack(side=tk.LEFT)
+        self.base_currency_entry = tk.Entry(currency_frame, width=6)
+        self.base_currency_entry.insert(0, self.config.get('base_currency', 'usd'))
+        self.base_currency_entry.pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(currency_frame, text="Валюты портфеля (через запятую):", bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg']).pack(side=tk.LEFT)
+        self.display_currencies_entry = tk.Entry(currency_frame, width=16)
+        self.display_currencies_entry.insert(0, ", ".join(self.config.get('display_currencies', [])))
+        self.display_currencies_entry.pack(side=tk.LEFT, padx=5)
+
         tk.Frame(main_content_frame, height=1, bg="gray").pack(fill='x', padx=10, pady=5)
 
 
@@ -1603,6 +2338,19 @@ class SettingsWindow(tk.Toplevel):
         
         tk.Frame(main_content_frame, height=1, bg="gray").pack(fill='x', padx=10, pady=5) 
 
+        tk.Label(main_content_frame, text="Строк в таблице (остальные — прокруткой):", font=header_font, bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg']).pack(pady=(5, 5)) 
+        rows_frame = tk.Frame(main_content_frame, bg=current_theme_colors['bg']); rows_frame.pack(fill='x', padx=10)
+        self.rows_var = tk.DoubleVar(value=self.config.get('max_visible_rows', MAX_VISIBLE_ROWS))
+        self.rows_label = tk.Label(rows_frame, text=f"Текущее: {int(self.rows_var.get())}", bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg'])
+        self.rows_label.pack(side=tk.RIGHT)
+        
+        ttk.Scale(
+            rows_frame, from_=5, to=50, orient='horizontal', variable=self.rows_var,
+            command=lambda v: self.rows_label.config(text=f"Текущее: {int(float(v))}")
+        ).pack(side=tk.LEFT, fill='x', expand=True, padx=(0, 10))
+        
+        tk.Frame(main_content_frame, height=1, bg="gray").pack(fill='x', padx=10, pady=5) 
+
         tk.Label(main_content_frame, text="Прозрачность окна (0.1 - 1.0):", font=header_font, bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg']).pack(pady=(5, 5)) 
         opacity_frame = tk.Frame(main_content_frame, bg=current_theme_colors['bg']); opacity_frame.pack(fill='x', padx=10)
         self.opacity_var = tk.DoubleVar(value=self.config.get('opacity', 0.95))
@@ -1622,7 +2370,7 @@ class SettingsWindow(tk.Toplevel):
         tk.Label(inst_frame, text="ID монеты (CoinGecko) | Имя в виджете | Количество монет (Amount)", font=('Arial', 8), bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg']).pack(pady=(5, 0)) 
         coingecko_search_label = tk.Label(inst_frame, text="Найти ID монеты на CoinGecko", fg='blue', cursor="hand2", bg=current_theme_colors['bg'])
         coingecko_search_label.pack(pady=(0, 5)) 
-        coingecko_search_label.bind("<Button-1>", lambda e: webbrowser.open(COINGECKO_HOME_LINK)) 
+        coingecko_search_label.bind("<Button-1>", lambda e: open_url(COINGECKO_HOME_LINK)) 
         
         # Увеличиваем высоту фрейма для списка монет (180 -> 240)
         list_frame = tk.Frame(main_content_frame, height=240, bg=current_theme_colors['bg']) 
@@ -1663,6 +2411,20 @@ class SettingsWindow(tk.Toplevel):
 
         tk.Button(add_frame, text="Добавить", command=self.add_coin, bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg']).pack(side=tk.LEFT, padx=10)
         
+        # Проверка ID по локальному списку монет CoinGecko и подсказки по мере ввода
+        self.coin_status_label = tk.Label(main_content_frame, text="", font=('Arial', 8), bg=current_theme_colors['bg'], fg='gray')
+        self.coin_status_label.pack()
+        self.suggestions = [] # [(api_id, символ, имя)] в списке подсказок
+        self.suggestion_list = tk.Listbox(main_content_frame, height=COIN_SUGGESTIONS, font=('Arial', 9), activestyle='none',
+                                        bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg'])
+        self.api_id_entry.bind("<KeyRelease>", self.on_api_id_changed)
+        self.api_id_entry.bind("<Down>", self.focus_suggestions)
+        self.api_id_entry.bind("<Escape>", lambda e: self.hide_suggestions())
+        self.suggestion_list.bind("<Return>", self.choose_suggestion)
+        self.suggestion_list.bind("<Double-Button-1>", self.choose_suggestion)
+        self.suggestion_list.bind("<Escape>", lambda e: self.hide_suggestions())
+        self.wait_for_coin_index()
+        
         # Кнопка "Применить и Закрыть"
         tk.Button(
             main_content_frame, 
@@ -1702,6 +2464,7 @@ class SettingsWindow(tk.Toplevel):
             widget.destroy()
             
         self.coin_amount_entries = {}
+        self.coin_tier_vars = {}
         current_theme_colors = THEMES.get(self.master.config.get('theme', 'light'), THEMES['light'])
             
         for api_id, coin_data in self.config['coins'].items():
@@ -1729,6 +2492,13 @@ class SettingsWindow(tk.Toplevel):
             
             self.coin_amount_entries[api_id] = amount_var
             
+            # Интервал обновления монеты: стабильным монетам хватает редких запросов
+            tier_var = tk.StringVar(value=REFRESH_TIER_LABELS.get(coin_data.get('refresh_sec'), REFRESH_TIER_AUTO))
+            tier_menu = tk.OptionMenu(coin_row, tier_var, REFRESH_TIER_AUTO, *REFRESH_TIER_LABELS.values())
+            tier_menu.configure(font=('Arial', 8), width=6, bg=current_theme_colors['bg'], fg=current_theme_colors['settings_fg'], highlightthickness=0)
+            tier_menu.pack(side=tk.LEFT, padx=5)
+            self.coin_tier_vars[api_id] = tier_var
+            
             delete_btn = tk.Button(
                 coin_row, 
                 text="Удалить", 
@@ -1742,6 +2512,73 @@ class SettingsWindow(tk.Toplevel):
         self.current_coins_frame.update_idletasks()
 
 
+    # --- Поиск ID монеты по локальному индексу ---
+    def wait_for_coin_index(self):
+        """Показывает, что список монет загружается, пока фоновый поток его не получит."""
+        if not self.winfo_exists():
+            return
+        if self.master.coin_index is not None:
+            self.on_api_id_changed()
+        elif self.master.coin_index_thread is not None and self.master.coin_index_thread.is_alive():
+            self.coin_status_label.config(text="Список монет CoinGecko загружается…", fg='gray')
+            self.after(200, self.wait_for_coin_index)
+        else:
+            self.coin_status_label.config(text="Список монет CoinGecko недоступен: ID не проверяется", fg='gray')
+
+    def on_api_id_changed(self, event=None):
+        """Подсказки по префиксу ID, символа или имени и проверка введенного ID (без запросов в сеть)."""
+        index = self.master.coin_index
+        if index is None or (event is not None and event.keysym in ('Down', 'Escape', 'Return')):
+            return
+        text = self.api_id_entry.get().strip().lower()
+        if not text:
+            self.coin_status_label.config(text=f"В списке CoinGecko {len(index)} монет: начните вводить ID, символ или имя", fg='gray')
+            self.hide_suggestions()
+            return
+            
+        if text in index:
+            symbol, name = index.coins[text]
+            self.coin_status_label.config(text=f"✓ {name} ({symbol.upper()})", fg='green')
+        else:
+            self.coin_status_label.config(text="Такого ID нет в списке CoinGecko — выберите монету из подсказок", fg='#FF6600')
+            
+        self.suggestions = index.search(text, COIN_SUGGESTIONS)
+        if not self.suggestions or self.suggestions[0][0] == text and len(self.suggestions) == 1:
+            self.hide_suggestions()
+            return
+        self.suggestion_list.delete(0, tk.END)
+        for api_id, symbol, name in self.suggestions:
+            self.suggestion_list.insert(tk.END, f"{api_id}  —  {symbol.upper()}  —  {name}")
+        # Список поверх окна, сразу под полем ввода ID (разметка окна не сдвигается)
+        self.suggestion_list.place(in_=self.api_id_entry, x=0, rely=1.0, width=360)
+        self.suggestion_list.lift()
+
+    def hide_suggestions(self):
+        self.suggestion_list.place_forget()
+
+    def focus_suggestions(self, event=None):
+        if self.suggestion_list.winfo_manager():
+            self.suggestion_list.focus_set()
+            self.suggestion_list.selection_clear(0, tk.END)
+            self.suggestion_list.selection_set(0)
+            self.suggestion_list.activate(0)
+        return "break"
+
+    def choose_suggestion(self, event=None):
+        """Подставляет выбранную монету: ID, а имя в виджете — символ, если поле имени пустое."""
+        selection = self.suggestion_list.curselection()
+        if not selection:
+            return "break"
+        api_id, symbol, _name = self.suggestions[selection[0]]
+        self.api_id_entry.delete(0, tk.END)
+        self.api_id_entry.insert(0, api_id)
+        if not self.display_name_entry.get().strip():
+            self.display_name_entry.insert(0, symbol.upper())
+        self.hide_suggestions()
+        self.on_api_id_changed()
+        self.display_name_entry.focus_set()
+        return "break"
+
     def add_coin(self):
         """Добавляет новую монету в конфигурацию с нулевым количеством."""
         api_id = self.api_id_entry.get().strip().lower()
@@ -1750,6 +2587,14 @@ class SettingsWindow(tk.Toplevel):
         if not api_id or not display_name:
             messagebox.showerror("Ошибка", "Поля 'ID монеты' и 'Имя' должны быть заполнены.")
             return
+            
+        # Опечатка в ID видна сразу, а не строкой "---" после следующего обновления
+        index = self.master.coin_index
+        if index is not None and len(index) and api_id not in index:
+            suggestions = ", ".join(coin[0] for coin in index.search(api_id[:max(3, len(api_id) // 2)], 3))
+            hint = f"\n\nПохожие ID: {suggestions}" if suggestions else ""
+            if not messagebox.askyesno("Предупреждение", f"Монеты с ID '{api_id}' нет в списке CoinGecko.{hint}\n\nВсе равно добавить?"):
+                return
 
         #if api_id in self.config['coins']:
         #    messagebox.showwarning("Предупреждение", f"Монета '{api_id}' уже есть в списке.")
@@ -1774,6 +2619,8 @@ class SettingsWindow(tk.Toplevel):
         self.update_coin_list()
         self.api_id_entry.delete(0, tk.END)
         self.display_name_entry.delete(0, tk.END)
+        self.hide_suggestions()
+        self.on_api_id_changed()
         messagebox.showinfo("Готово", f"Монета '{display_name}' добавлена.")
 
     def delete_coin(self, api_id):
@@ -1795,8 +2642,35 @@ class SettingsWindow(tk.Toplevel):
             except ValueError:
                 messagebox.showerror("Ошибка ввода", f"Неверное количество для монеты '{self.config['coins'][api_id]['name']}'. Используйте числа (напр., 0.5, 12.34).")
                 return 
+                
+        for api_id, tier_var in self.coin_tier_vars.items():
+            coin = self.config['coins'].get(api_id)
+            if coin is None:
+                continue
+            refresh_sec = next((sec for sec, label in REFRESH_TIER_LABELS.items() if label == tier_var.get()), None)
+            if refresh_sec is None:
+                coin.pop('refresh_sec', None) # Общий интервал обновления
+            else:
+                coin['refresh_sec'] = refresh_sec
+        
+        # 2. Валюты: проверяем по таблице курсов, если она уже загружена
+        currencies = get_display_currencies({
+            'base_currency': self.base_currency_entry.get(),
+            'display_currencies': self.display_currencies_entry.get().split(',')
+        })
+        if not currencies:
+            messagebox.showerror("Ошибка ввода", "Укажите валюту виджета (напр., usd, eur, rub).")
+            return
+        fx_rates = get_fx_rates()
+        if fx_rates.updated_at is not None:
+            unknown = [currency for currency in currencies if currency not in fx_rates.rates]
+            if unknown:
+                messagebox.showerror("Ошибка ввода", f"Неизвестные валюты: {', '.join(unknown)}.")
+                return
+        self.config['base_currency'] = currencies[0]
+        self.config['display_currencies'] = currencies[1:]
         
-        # 2. Сбор данных автозапуска, трея, темы, режима и ДЛИТЕЛЬНОСТИ УВЕДОМЛЕНИЙ
+        # 3. Сбор данных автозапуска, трея, темы, режима и ДЛИТЕЛЬНОСТИ УВЕДОМЛЕНИЙ
         if winreg:
              self.config['autostart_enabled'] = self.autostart_var.get()
         else:
@@ -1804,22 +2678,29 @@ class SettingsWindow(tk.Toplevel):
              
         self.config['hide_on_close'] = self.hide_var.get()
         self.config['theme'] = self.theme_var.get() 
+        self.config['table_renderer'] = self.renderer_var.get()
         #self.config['trend_threshold_percent'] = float(self.threshold_var.get())
         self.config['trend_threshold_percent'] = round(float(self.threshold_var.get()), 2)
         self.config['notification_mode'] = self.notify_mode_var.get()
         self.config['notification_duration_sec'] = int(self.duration_var.get())
+        self.config['signal_cooldown_sec'] = int(self.cooldown_var.get()) * 60
         
 
-        # 3. Сохранение общих настроек (берем из временных значений, которые были в master.config)
+        # 4. Сохранение общих настроек (берем из временных значений, которые были в master.config)
         self.config['font_size'] = int(self.font_var.get())
+        self.config['max_visible_rows'] = int(self.rows_var.get())
         self.config['opacity'] = self.opacity_var.get()
         
-        # 4. Применение и закрытие
+        # 5. Применение и закрытие
         self.master.apply_settings(self.config)
         self.destroy()
 
 
 if __name__ == '__main__':
+    # Режим без окна: только загрузка цен и сигналы в формате JSON Lines
+    if '--headless' in sys.argv:
+        sys.exit(crypto_core.main(sys.argv[1:]))
+        
     # Гарантируем, что файл конфигурации существует с правильной структурой
     config_data = load_config()
     
@@ -1841,9 +2722,14 @@ if __name__ == '__main__':
                  print("Не удалось удалить автозапуск, статус в конфиге скорректирован.")
 
     save_config(config_data) 
+    config_persister.flush() # Окно ниже читает конфиг с диска, поэтому запись — сразу
     # -------------------------------------------------------------
+    setup_locale()
+    startup_timer.mark("конфиг и автозапуск")
         
     app = CryptoWidget()
+    startup_timer.mark("создание окна")
+    app.after_idle(lambda: startup_timer.mark("первая отрисовка окна"))
     
     # --- БЛОК: СТАРТ В ТРЕЕ ---
     # Если запуск произошел через автозапуск Windows с флагом -autostart
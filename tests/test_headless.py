@@ -0,0 +1,52 @@
+# Тест режима без окна против заглушки API, которая отвечает только ошибками 5xx (без Tk и внешней сети).
+
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class HeadlessOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.stub = subprocess.Popen(
+            [sys.executable, '-u', os.path.join(ROOT, 'coingecko_stub_server.py'), '--port', '0', '--rate-5xx', '1', '--quiet'],
+            stdout=subprocess.PIPE, text=True
+        )
+        self.addCleanup(self.stub.stdout.close)
+        self.addCleanup(self.stub.wait)
+        self.addCleanup(self.stub.terminate)
+        # Первая строка заглушки — ее адрес: "Заглушка CoinGecko: http://127.0.0.1:<порт>/api/v3"
+        self.api_url = re.search(r'http://\S+', self.stub.stdout.readline()).group(0)
+
+    def run_headless(self):
+        config_path = os.path.join(self.tmpdir.name, 'config.json')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump({'coins': {'bitcoin': {'amount': 1}, 'ethereum': {'amount': 2}}}, f)
+        return subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'crypto_core.py'), '--headless', '--once',
+             '--config', config_path, '--history-db', os.path.join(self.tmpdir.name, 'history.db')],
+            env=dict(os.environ, CRYPTO_WIDGET_API_URL=self.api_url), cwd=self.tmpdir.name,
+            capture_output=True, text=True, timeout=60
+        )
+
+    def test_stdout_carries_only_json_records(self):
+        result = self.run_headless()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("Ошибка сети/API", result.stderr) # Диагностика ушла в stderr
+        lines = result.stdout.splitlines()
+        self.assertEqual(len(lines), 1)
+        for line in lines:
+            record = json.loads(line)
+            self.assertEqual(record['status'], 'server_error')
+            self.assertIsNone(record['coins']['bitcoin']['price'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# Тесты аналитики портфеля на известных рядах цен (без Tk и сети; без NumPy пропускаются).
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_core import HISTORY_THIN_STEP_SEC, PIVOT_CURRENCY, PortfolioAnalytics, TrendStore, create_portfolio_analytics, import_numpy
+
+np = import_numpy()
+HOUR = 60 * 60
+START = 1_700_000_000 - 1_700_000_000 % HOUR # Начало часа: отрезки истории не делят точки ряда
+
+
+@unittest.skipIf(np is None, "NumPy не установлен")
+class PortfolioAnalyticsTest(unittest.TestCase):
+    def setUp(self):
+        self.analytics = PortfolioAnalytics(np)
+        self.analytics.set_holdings({'coins': {'btc': {'amount': 2}, 'eth': {'amount': 1}, 'dust': {'amount': 0}}})
+
+    def record_series(self, series):
+        """series: [(смещение в часах, {api_id: цена})]."""
+        for hours, prices in series:
+            self.analytics.record(prices, START + hours * HOUR)
+
+    def test_no_history(self):
+        self.assertIsNone(self.analytics.evaluate())
+
+    def test_value_weights_pnl_and_drawdown(self):
+        # Стоимость: 250 → 270 → 240 → 260 (eth без цены переносится из прошлого отрезка)
+        self.record_series([
+            (0, {'btc': 100, 'eth': 50}),
+            (1, {'btc': 110}),
+            (2, {'btc': 90, 'eth': 60}),
+            (3, {'btc': 100})
+        ])
+        result = self.analytics.evaluate()
+        self.assertAlmostEqual(result['total_value'], 260)
+        self.assertAlmostEqual(result['weights']['btc'], 200 / 260)
+        self.assertAlmostEqual(result['weights']['eth'], 60 / 260)
+        self.assertEqual(result['weights']['dust'], 0)
+
+        hour = result['pnl']['1h']
+        self.assertAlmostEqual(hour['value'], 20)
+        self.assertAlmostEqual(hour['percent'], 20 / 240 * 100)
+        self.assertAlmostEqual(hour['coins']['btc'], 20)
+        self.assertAlmostEqual(hour['coins']['eth'], 0)
+        self.assertIsNone(result['pnl']['24h']) # История короче окна
+
+        self.assertAlmostEqual(result['drawdown'], (260 / 270 - 1) * 100)
+        self.assertAlmostEqual(result['max_drawdown'], (240 / 270 - 1) * 100)
+
+    def test_long_windows(self):
+        self.record_series([(hours, {'btc': 100 + hours, 'eth': 50}) for hours in range(0, 7 * 24 + 1)])
+        result = self.analytics.evaluate()
+        self.assertAlmostEqual(result['pnl']['24h']['value'], 2 * 24)
+        self.assertAlmostEqual(result['pnl']['7d']['value'], 2 * 7 * 24)
+        self.assertEqual(result['max_drawdown'], 0)
+
+    def test_new_coin_does_not_look_like_a_jump(self):
+        self.record_series([(0, {'btc': 100}), (1, {'btc': 100})])
+        self.analytics.set_holdings({'coins': {'btc': {'amount': 2}, 'sol': {'amount': 10}}})
+        self.record_series([(2, {'sol': 5}), (3, {'sol': 4})])
+        result = self.analytics.evaluate()
+        # До первой цены монета считается по ней, поэтому просадка — только от падения sol
+        self.assertAlmostEqual(result['max_drawdown'], (240 / 250 - 1) * 100)
+        self.assertAlmostEqual(result['pnl']['1h']['value'], -10)
+
+    def test_older_prices_are_ignored(self):
+        self.record_series([(1, {'btc': 100, 'eth': 50}), (0, {'btc': 1})])
+        self.assertAlmostEqual(self.analytics.evaluate()['total_value'], 250)
+
+
+@unittest.skipIf(np is None, "NumPy не установлен")
+class AnalyticsHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = TrendStore(os.path.join(self.tmpdir.name, 'history.db'))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_history_from_store_matches_recorded_series(self):
+        now = time.time()
+        for minute in range(3 * 60):
+            self.store.record_refresh({'btc': 100 + minute, 'eth': 50}, {}, PIVOT_CURRENCY, now - (3 * 60 - minute) * 60)
+
+        rows = self.store.load_price_history(PIVOT_CURRENCY, now - 4 * HOUR, 300)
+        self.assertLessEqual(len(rows), 2 * (3 * 60 // 5 + 1)) # По одной цене на монету за отрезок
+
+        analytics = create_portfolio_analytics({'coins': {'btc': {'amount': 1}, 'eth': {'amount': 2}}}, self.store)
+        result = analytics.evaluate()
+        self.assertAlmostEqual(result['total_value'], 100 + 179 + 100)
+        self.assertAlmostEqual(result['pnl']['1h']['value'], 60, delta=5) # Точность — шаг отрезка
+
+    def test_compact_keeps_hourly_points_for_long_windows(self):
+        now = time.time()
+        for step in range(2 * 24 * 12):
+            self.store.record_refresh({'btc': 1.0}, {}, PIVOT_CURRENCY, now - 2 * 24 * HOUR + step * 300)
+        self.store.compact(keep=12)
+
+        rows = self.store.load_price_history(PIVOT_CURRENCY, 0, 1)
+        recent = [ts for _api_id, ts, _price in rows if ts >= rows[-12][1]]
+        older = [ts for _api_id, ts, _price in rows if ts < rows[-12][1]]
+        self.assertEqual(len(recent), 12)
+        self.assertLessEqual(len(older), 2 * 24 * HOUR // HISTORY_THIN_STEP_SEC + 1)
+        self.assertLess(older[0], now - 47 * HOUR)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# Тесты набора источников цен: неполные ответы, hedged-запросы и закрытие (без сети: источники подменяются).
+
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_core
+from crypto_core import FETCH_NETWORK_ERROR, FETCH_OK, ApiClient, MarketDataCache, PartialMarketsError, ProviderPool, fetch_prices, get_missing_ids
+
+
+class FakeProvider:
+    """Источник, знающий только монеты known и отвечающий через delay секунд."""
+    def __init__(self, name, known, delay=0.0, blocked_until=0.0):
+        self.name = name
+        self.known = set(known)
+        self.delay = delay
+        self.blocked_until = blocked_until
+        self.calls = 0
+
+    def supports(self, currency):
+        return True
+
+    def get_markets(self, coin_ids, currency):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {api_id: {currency: 1.0, "change_24h": 0.0} for api_id in coin_ids if api_id in self.known}
+
+
+class ChunkedClient(ApiClient):
+    """Клиент без сети: части списка, содержащие монету из failing, отвечают ошибкой."""
+    name = 'coingecko'
+    default_base_url = 'http://localhost'
+
+    def __init__(self, failing=()):
+        super().__init__()
+        self.failing = set(failing)
+
+    def get_markets_chunk(self, coin_ids, currency):
+        if self.failing.intersection(coin_ids):
+            raise crypto_core.requests.exceptions.ConnectionError("нет соединения")
+        return {api_id: {currency: 1.0, "change_24h": 0.0} for api_id in coin_ids}
+
+
+class ProviderPoolTest(unittest.TestCase):
+    def make_pool(self, *providers, hedge_after_sec=0.05):
+        pool = ProviderPool(list(providers), hedge_after_sec, deadline_sec=2)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_primary_answer_is_accepted_even_if_partial(self):
+        pool = self.make_pool(FakeProvider('coingecko', 'ab'), FakeProvider('binance', 'abz'))
+        self.assertEqual(set(pool.get_markets(['a', 'b', 'z'], 'usd')), {'a', 'b'})
+        self.assertEqual((pool.last_provider, pool.last_missing), ('coingecko', []))
+
+    def test_partial_fallback_is_not_a_full_answer_while_primary_is_paused(self):
+        primary = FakeProvider('coingecko', 'abz', blocked_until=time.monotonic() + 60)
+        pool = self.make_pool(primary, FakeProvider('binance', 'a'))
+        self.assertEqual(set(pool.get_markets(['a', 'b', 'z'], 'usd')), {'a'})
+        self.assertEqual(pool.last_provider, 'binance')
+        self.assertEqual(pool.last_missing, ['b', 'z'])
+        self.assertEqual(primary.calls, 0)
+
+    def test_partial_fallback_answers_are_merged(self):
+        primary = FakeProvider('coingecko', 'abz', blocked_until=time.monotonic() + 60)
+        pool = self.make_pool(primary, FakeProvider('binance', 'a'), FakeProvider('coincap', 'b'))
+        self.assertEqual(set(pool.get_markets(['a', 'b', 'z'], 'usd')), {'a', 'b'})
+        self.assertEqual(pool.last_missing, ['z'])
+
+    def test_slow_primary_is_hedged(self):
+        pool = self.make_pool(FakeProvider('coingecko', 'ab', delay=1.0), FakeProvider('binance', 'ab'))
+        started = time.monotonic()
+        self.assertEqual(set(pool.get_markets(['a', 'b'], 'usd')), {'a', 'b'})
+        self.assertEqual(pool.last_provider, 'binance')
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_close_lets_in_flight_call_finish(self):
+        pool = ProviderPool([FakeProvider('coingecko', 'a', delay=0.3), FakeProvider('binance', 'a')], 0.1, 2)
+        results = []
+        worker = threading.Thread(target=lambda: results.append(pool.get_markets(['a'], 'usd')))
+        worker.start()
+        time.sleep(0.05)
+        pool.close() # Запрос к запасному источнику уходит уже после закрытия
+        worker.join()
+        self.assertEqual(results, [{'a': {'usd': 1.0, 'change_24h': 0.0}}])
+        self.assertTrue(pool.executor._shutdown)
+        with self.assertRaises(ValueError):
+            pool.get_markets(['a'], 'usd')
+
+
+class ChunkFailureTest(unittest.TestCase):
+    def setUp(self):
+        crypto_core.import_requests()
+        patcher = mock.patch.object(crypto_core, 'MARKETS_CHUNK_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_client(self, failing=()):
+        client = ChunkedClient(failing)
+        self.addCleanup(lambda: client.executor and client.executor.shutdown())
+        return client
+
+    def test_failed_chunk_ids_are_reported(self):
+        with self.assertRaises(PartialMarketsError) as caught:
+            self.make_client(failing='c').get_markets(['a', 'b', 'c', 'd', 'e'], 'usd')
+        self.assertEqual(set(caught.exception.result), {'a', 'b', 'e'})
+        self.assertEqual(caught.exception.missing, ['c', 'd'])
+
+    def test_primary_with_failed_chunk_is_a_partial_answer(self):
+        pool = ProviderPool([self.make_client(failing='c')], 0.05, 2)
+        self.addCleanup(pool.close)
+        self.assertEqual(set(pool.get_markets(['a', 'b', 'c', 'd'], 'usd')), {'a', 'b'})
+        self.assertEqual((pool.last_provider, pool.last_missing), ('coingecko', ['c', 'd']))
+
+    def test_fallback_fills_failed_chunk(self):
+        pool = ProviderPool([self.make_client(failing='c'), FakeProvider('binance', 'abcd')], 0.05, 2)
+        self.addCleanup(pool.close)
+        self.assertEqual(set(pool.get_markets(['a', 'b', 'c', 'd'], 'usd')), {'a', 'b', 'c', 'd'})
+        self.assertEqual((pool.last_provider, pool.last_missing), ('binance', []))
+
+
+class FetchPricesPartialTest(unittest.TestCase):
+    def setUp(self):
+        primary = FakeProvider('coingecko', 'abz', blocked_until=time.monotonic() + 60)
+        self.pool = ProviderPool([primary, FakeProvider('binance', 'a')], 0.05, 2)
+        self.addCleanup(self.pool.close)
+        fx_rates = crypto_core.FxRateTable()
+        fx_rates.updated_at = time.time() # Курсы свежие: запроса курсов нет
+        for name, value in (('_provider_pool', self.pool), ('_market_cache', MarketDataCache()), ('_fx_rates', fx_rates)):
+            patcher = mock.patch.object(crypto_core, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_missing_coins_make_the_fetch_fail_for_them(self):
+        crypto_core._market_cache.put({'b': {'usd': 2.0, 'change_24h': 0.0}}, 'usd', now=time.time() - 60)
+        data, status, _retry_after = fetch_prices(['a', 'b', 'z'], 'usd')
+        self.assertEqual(status, FETCH_NETWORK_ERROR)
+        self.assertTrue(data['b']['stale']) # Из кэша
+        self.assertEqual(get_missing_ids(['a', 'b', 'z'], data), ['b', 'z'])
+
+    def test_complete_answer_is_ok(self):
+        data, status, _retry_after = fetch_prices(['a'], 'usd')
+        self.assertEqual(status, FETCH_OK)
+        self.assertEqual(get_missing_ids(['a'], data), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
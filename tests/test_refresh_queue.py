@@ -0,0 +1,67 @@
+# Тесты очереди обновления монет по интервалам (без Tk и сети).
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_core import REFRESH_MIN_INTERVAL_SEC, CoinRefreshQueue, get_coin_refresh_tiers
+
+
+class CoinRefreshQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = CoinRefreshQueue()
+        self.queue.set_tiers({'btc': 10, 'eth': 60, 'usdt': 300}, now=0)
+
+    def test_new_coins_are_due_at_once(self):
+        self.assertEqual(sorted(self.queue.pop_due(now=0)), ['btc', 'eth', 'usdt'])
+        self.assertFalse(self.queue.is_due(now=0))
+
+    def test_coins_come_due_by_their_tier(self):
+        self.queue.pop_due(now=0)
+        self.assertEqual(self.queue.seconds_until_next(now=0), 10)
+        self.assertEqual(self.queue.pop_due(now=10, ahead_sec=0), ['btc'])
+        self.assertEqual(self.queue.pop_due(now=20, ahead_sec=0), ['btc'])
+        self.assertEqual(self.queue.pop_due(now=30, ahead_sec=0), ['btc'])
+        self.assertEqual(sorted(self.queue.pop_due(now=60, ahead_sec=0)), ['btc', 'eth'])
+        self.assertEqual(self.queue.pop_due(now=61, ahead_sec=0), [])
+
+    def test_batch_takes_coins_due_soon(self):
+        self.queue.pop_due(now=0)
+        self.queue.pop_due(now=50, ahead_sec=0) # btc: следующий срок 60, как у eth
+        self.queue.pop_due(now=57, ahead_sec=0)
+        self.assertEqual(self.queue.pop_due(now=57, ahead_sec=5), [])
+        # Срок eth (60) наступил; usdt (300) дальше окна — не входит в запрос
+        self.assertEqual(sorted(self.queue.pop_due(now=60, ahead_sec=5)), ['btc', 'eth'])
+        self.assertEqual(self.queue.next_due_at(), 70)
+
+    def test_mark_due_after_failure(self):
+        self.queue.pop_due(now=0)
+        self.queue.mark_due(['usdt', 'unknown'], now=5)
+        self.assertEqual(self.queue.pop_due(now=5, ahead_sec=0), ['usdt'])
+        # Старая запись кучи (срок 300) пропускается, новый срок — от последнего запроса
+        self.assertEqual(self.queue.due_at['usdt'], 305)
+
+    def test_shorter_tier_moves_due_time_closer(self):
+        self.queue.pop_due(now=0)
+        self.queue.set_tiers({'btc': 10, 'eth': 60, 'usdt': 20}, now=5)
+        self.assertEqual(self.queue.due_at['usdt'], 25)
+        self.queue.set_tiers({'btc': 10}, now=6)
+        self.assertNotIn('eth', self.queue.due_at)
+        self.assertEqual(self.queue.pop_due(now=60, ahead_sec=0), ['btc'])
+
+
+class CoinRefreshTiersTest(unittest.TestCase):
+    def test_duplicates_take_the_shortest_tier(self):
+        config = {'refresh_rate_ms': 60000, 'coins': {
+            'aptos': {'refresh_sec': 300},
+            'aptos_2': {'refresh_sec': 60},
+            'bitcoin': {},
+            'tether': {'refresh_sec': 1}
+        }}
+        self.assertEqual(get_coin_refresh_tiers(config), {'aptos': 60, 'bitcoin': 60, 'tether': REFRESH_MIN_INTERVAL_SEC})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# Тесты отбора уведомлений: гистерезис, пауза повторов и усиление серии (без Tk и сети).
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_core import SignalEngine
+
+THRESHOLD = 1.0
+
+
+def make_signal(trend_type, series_length, change_percent, api_id='btc'):
+    return {
+        'api_id': api_id,
+        'coin_name': api_id.upper(),
+        'trend_type': trend_type,
+        'series_length': series_length,
+        'change_percent': change_percent
+    }
+
+
+class SignalEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = SignalEngine(cooldown_sec=60, hysteresis=0.5)
+
+    def accept(self, signal, now):
+        return self.engine.filter([signal], THRESHOLD, now) == [signal]
+
+    def test_new_series_needs_margin_over_threshold(self):
+        self.assertFalse(self.accept(make_signal("BULLISH", 1, 1.4), 0)) # Меньше 1.5x порога
+        self.assertTrue(self.accept(make_signal("BULLISH", 1, 1.6), 0))
+
+    def test_repeat_waits_for_cooldown(self):
+        self.assertTrue(self.accept(make_signal("BULLISH", 2, 2.0), 0))
+        self.assertFalse(self.accept(make_signal("BULLISH", 2, 2.0), 30))
+        self.assertFalse(self.accept(make_signal("BULLISH", 1, 2.0), 59))
+        self.assertTrue(self.accept(make_signal("BULLISH", 2, 2.0), 60))
+
+    def test_escalation_is_sent_immediately(self):
+        self.assertTrue(self.accept(make_signal("BULLISH", 2, 2.0), 0))
+        self.assertTrue(self.accept(make_signal("BULLISH", 3, 1.1), 1)) # Усиление не требует запаса над порогом
+        self.assertFalse(self.accept(make_signal("BULLISH", 3, 2.0), 2))
+
+    def test_weak_reversal_closes_series_without_signal(self):
+        self.assertTrue(self.accept(make_signal("BULLISH", 2, 2.0), 0))
+        self.assertFalse(self.accept(make_signal("BEARISH", 1, -1.2), 1))
+        # Серия закрыта: тот же рост снова начинается как новая серия, без ожидания паузы
+        self.assertTrue(self.accept(make_signal("BULLISH", 1, 1.6), 2))
+
+    def test_strong_reversal_starts_new_series(self):
+        self.assertTrue(self.accept(make_signal("BULLISH", 2, 2.0), 0))
+        self.assertTrue(self.accept(make_signal("BEARISH", 1, -1.6), 1))
+
+    def test_filter_keeps_order_and_coins_are_independent(self):
+        signals = [make_signal("BULLISH", 1, 3.0, 'btc'), make_signal("BEARISH", 1, -0.5, 'eth'), make_signal("BEARISH", 1, -2.0, 'sol')]
+        self.assertEqual([s['api_id'] for s in self.engine.filter(signals, THRESHOLD, 0)], ['btc', 'sol'])
+
+    def test_configure_and_set_coins(self):
+        self.engine.configure({'signal_cooldown_sec': -5, 'signal_hysteresis': 0.0})
+        self.assertEqual((self.engine.cooldown_sec, self.engine.hysteresis), (0, 0.0))
+        self.assertTrue(self.accept(make_signal("BULLISH", 1, 1.1), 0))
+        self.engine.set_coins(['eth'])
+        self.assertEqual(self.engine.state, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# Тесты движка серий трендов и уровней сообщений (без Tk и сети).
+#
+#     python -m unittest discover tests
+#     python -m pytest tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_core import TREND_MESSAGES, TrendEngine, get_trend_message, get_trend_messages
+
+UP = ('▲', 'green')
+DOWN = ('▼', 'red')
+FLAT = ('▬', 'gray')
+
+
+class TrendEngineTest(unittest.TestCase):
+    def test_streak_grows_and_resets_on_direction_change(self):
+        engine = TrendEngine(5)
+        self.assertEqual([engine.push('btc', UP)[1] for _ in range(3)], [1, 2, 3])
+        self.assertEqual(engine.push('btc', DOWN), ('▼', 1))
+        self.assertEqual(engine.push('btc', FLAT), ('▬', 0))
+        self.assertEqual(engine.push('btc', DOWN), ('▼', 1))
+
+    def test_streak_is_capped_by_history_size(self):
+        engine = TrendEngine(3)
+        for _ in range(10):
+            icon, length = engine.push('btc', UP)
+        self.assertEqual((icon, length), ('▲', 3))
+        self.assertEqual(engine.get_history('btc'), [UP] * 3)
+        # Счетчик продолжает считать: после увеличения истории серия длиннее старого окна
+        engine.resize(5)
+        self.assertEqual(engine.get_streak('btc'), ('▲', 3))
+        engine.push('btc', UP)
+        self.assertEqual(engine.get_streak('btc'), ('▲', 4))
+
+    def test_load_restores_streak(self):
+        engine = TrendEngine(5)
+        engine.load({'btc': [DOWN, UP, UP], 'eth': [UP, FLAT]})
+        self.assertEqual(engine.get_streak('btc'), ('▲', 2))
+        self.assertEqual(engine.get_streak('eth'), ('▬', 0))
+
+    def test_resize_keeps_latest_icons(self):
+        engine = TrendEngine(5)
+        for forecast in (DOWN, DOWN, UP, UP, UP):
+            engine.push('btc', forecast)
+        engine.resize(2)
+        self.assertEqual(engine.get_history('btc'), [UP, UP])
+        self.assertEqual(engine.get_streak('btc'), ('▲', 2))
+
+    def test_set_coins_drops_removed_and_adds_new(self):
+        engine = TrendEngine(5)
+        engine.push('btc', UP)
+        engine.set_coins(['eth'])
+        self.assertEqual(engine.get_history('btc'), [])
+        self.assertEqual(engine.get_streak('eth'), (None, 0))
+
+
+class TrendMessagesTest(unittest.TestCase):
+    def test_highest_tier_not_longer_than_streak(self):
+        messages = {2: {"BULLISH": "up2", "BEARISH": "down2"}, 4: {"BULLISH": "up4", "BEARISH": "down4"}}
+        self.assertEqual(get_trend_message(1, "BULLISH", messages), "up2") # Короче младшего уровня — младший
+        self.assertEqual(get_trend_message(3, "BEARISH", messages), "down2")
+        self.assertEqual(get_trend_message(9, "BULLISH", messages), "up4")
+
+    def test_config_tiers_are_validated(self):
+        config = {'trend_messages': {
+            "3": {"BULLISH": "up3", "BEARISH": "down3"},
+            "x": {"BULLISH": "bad", "BEARISH": "bad"},
+            "5": {"BULLISH": "no bearish"}
+        }}
+        self.assertEqual(get_trend_messages(config), {3: {"BULLISH": "up3", "BEARISH": "down3"}})
+
+    def test_default_config_uses_builtin_tiers(self):
+        self.assertEqual(get_trend_messages({}), TREND_MESSAGES)
+        config = {'trend_messages': {str(tier): texts for tier, texts in TREND_MESSAGES.items()}}
+        self.assertEqual(get_trend_messages(config), TREND_MESSAGES)
+
+
+if __name__ == '__main__':
+    unittest.main()
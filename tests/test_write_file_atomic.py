@@ -0,0 +1,43 @@
+# Тесты атомарной записи файлов (без Tk и сети).
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_core import write_file_atomic
+
+
+class WriteFileAtomicTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'market_snapshot.json')
+
+    def test_concurrent_writers_do_not_share_temp_file(self):
+        errors = []
+
+        def write(n):
+            try:
+                for _ in range(20):
+                    write_file_atomic(json.dumps({'writer': n, 'payload': 'x' * 10000}), self.path)
+            except OSError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        with open(self.path, encoding='utf-8') as f:
+            self.assertIn(json.load(f)['writer'], range(4)) # Файл целый: последний записавший поток
+        self.assertEqual(os.listdir(self.tmpdir.name), ['market_snapshot.json']) # Временных файлов не осталось
+
+
+if __name__ == '__main__':
+    unittest.main()